@@ -19,7 +19,7 @@ const char* wifi_password = ""; //FIXME
 // MQTT
 // Make sure to update this for your own MQTT Broker!
 const char* mqtt_server = "0.0.0.0"; //FIXME
-const char* mqtt_topic = "meteo";
+const char* mqtt_topic = "meteo"; // one station; with more stations use "meteo/<station_id>" (letters, digits, _ and -)
 const char* mqtt_username = "meteo";
 const char* mqtt_password = ""; //FIXME
 // The client id identifies the ESP8266 device. Think of it a bit like a hostname (Or just a name, like Greg).
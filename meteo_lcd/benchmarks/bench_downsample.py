@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Chart render time vs number of points: all points, "minmax" and "lttb" downsampling.
+# Chart is drawn the same way as in update_meteo.py (22 inch figure, Agg backend).
+#
+# Run from meteo_lcd dir:
+#   python benchmarks/bench_downsample.py [points ...]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+from downsample import downsample
+from time_axis import epoch_to_num
+
+max_points = 2200
+
+
+def synthetic_series(points):
+    t = 1546300800 + np.arange(points, dtype=np.int64) * 180
+    # Daily cycle and some noise
+    y = 10.0 + 8.0 * np.sin(2 * np.pi * (t % 86400) / 86400.0) + np.random.randn(points) * 0.3
+    return t, y
+
+
+def draw(x, y, file_name):
+    fig, ax = plt.subplots()
+    fig.set_size_inches(22, 22)
+    ax.plot_date(x, y, 'r-')
+    ax.set_xlim(x[0], x[-1])
+    ax.grid()
+    fig.savefig(file_name, bbox_inches='tight')
+    plt.close(fig)
+
+
+def main():
+    counts = [1500, 15000, 150000]
+    if len(sys.argv) > 1:
+        counts = [int(a) for a in sys.argv[1:]]
+
+    out_dir = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(out_dir, "chart.png")
+        print("points    method   kept    downsample [ms]  render [s]")
+        for points in counts:
+            t, y = synthetic_series(points)
+            x = epoch_to_num(t)
+            for method in (None, "minmax", "lttb"):
+                start = time.time()
+                dx, dy = downsample(x, y, max_points, method)
+                mid = time.time()
+                draw(dx, dy, file_name)
+                end = time.time()
+                print("%-9d %-8s %-7d %15.1f  %10.2f" % (points, method or "-", len(dx), (mid - start) * 1000, end - mid))
+    finally:
+        shutil.rmtree(out_dir)
+
+
+if __name__ == "__main__":
+    main()
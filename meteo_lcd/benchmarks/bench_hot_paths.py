@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Times the hot paths on synthetic data (see synthetic.py):
+#   update_meteo_data           - batch of readings: web page, log file, db
+#   draw_plot_db                - 3 day plots of update_meteo.py
+#   month_plot.draw_plot_month_db, daily_plot.draw_plot_month_db
+#   log_to_db, db_to_log        - db_tools, whole synthetic log / db
+# Files are written to a temporary dir (paths in modules are changed for the time of benchmark).
+# Results can be saved as JSON and compared with results of other commit (on the same machine).
+#
+# Run from meteo_lcd dir:
+#   python benchmarks/bench_hot_paths.py [--years 2] [--runs 3] [--json results.json]
+#   python benchmarks/bench_hot_paths.py --compare old.json new.json
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "db_tools"))
+
+import synthetic
+
+meteo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Readings in one update_meteo_data run
+update_readings = 500
+# Result is reported as slower/faster when it differs more than this (--compare)
+compare_threshold = 0.10
+
+
+# Output of the benchmarked code (prints of every step) goes to /dev/null
+class Quiet(object):
+
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout.flush()
+        sys.stdout = open(os.devnull, "w")
+
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+
+# Runs func runs times, returns dict with times [s]
+def measure(func, runs, setup=None):
+    times = []
+    for i in range(runs):
+        if setup is not None:
+            with Quiet():
+                setup()
+        with Quiet():
+            start = time.time()
+            func()
+            times.append(time.time() - start)
+    times.sort()
+    return {
+        "runs": runs,
+        "min": times[0],
+        "median": times[len(times) // 2],
+        "max": times[-1],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=meteo_dir).decode("ascii").strip()
+    except Exception:
+        return None
+
+
+def bench_update_meteo(data_dir, db_path, runs, results):
+    import update_meteo
+    from meteo_db import MeteoDB
+    from meteo_template import HtmlTemplate
+    from plot_render import ChartPool
+    from render_worker import RenderWorker
+    from ingest_queue import IngestQueue
+
+    www_dir = os.path.join(data_dir, "www")
+    os.mkdir(www_dir)
+    update_meteo.www_meteo_path = os.path.join(www_dir, "meteo.html")
+    update_meteo.log_file_path = os.path.join(www_dir, "meteo.log")
+    update_meteo.db_path = db_path
+    for name in ("temp_out_diagram_file", "humid_out_diagram_file", "dew_point_out_diagram_file", "pressure_diagram_file"):
+        setattr(update_meteo, name, os.path.join(www_dir, os.path.basename(getattr(update_meteo, name))))
+
+    update_meteo.chart_pool = ChartPool(update_meteo.plot_processes)
+    update_meteo.meteo_db = MeteoDB(db_path, update_meteo.db_commit_rows, update_meteo.db_commit_interval)
+    update_meteo.html_template = HtmlTemplate(os.path.join(meteo_dir, "www", "meteo.html_tmp"))
+    # Plots are timed separately - requests from update_meteo_data are not drawn
+    update_meteo.render_worker = RenderWorker(lambda: None)
+    update_meteo.render_worker.start()
+    update_meteo.ingest_queue = IngestQueue(update_meteo.update_meteo_data)
+    try:
+        with Quiet():
+            station = update_meteo.get_station(update_meteo.default_station)
+
+        # Readings every log_delay, after the newest reading in db
+        state = {"time": datetime.datetime.now() + datetime.timedelta(hours=1)}
+        def batch():
+            readings = []
+            for i in range(update_readings):
+                state["time"] += update_meteo.log_delay
+                readings.append((update_meteo.default_station, state["time"], "21.5", "40", "12.3", "55", 1013.25))
+            return readings
+        def run_update():
+            update_meteo.update_meteo_data(batch())
+            update_meteo.meteo_db.flush()
+        result = measure(run_update, runs)
+        result["readings"] = update_readings
+        results["update_meteo_data"] = result
+
+        results["draw_plot_db"] = measure(lambda: update_meteo.draw_plot_db(station), runs)
+    finally:
+        update_meteo.render_worker.stop()
+        update_meteo.chart_pool.close()
+        with Quiet():
+            update_meteo.meteo_db.close()
+
+
+def bench_history_plots(data_dir, db_path, runs, results):
+    import month_plot
+    import daily_plot
+    hist_dir = os.path.join(data_dir, "hist") + os.sep
+    os.mkdir(hist_dir)
+    for module in (month_plot, daily_plot):
+        module.db_path = db_path
+        module.hist_dir = hist_dir
+        # Every run draws charts (render cache would skip all runs after the first one)
+        module.plot_cache = False
+    results["month_plot.draw_plot_month_db"] = measure(month_plot.draw_plot_month_db, runs)
+    results["daily_plot.draw_plot_month_db"] = measure(daily_plot.draw_plot_month_db, runs)
+
+
+def bench_db_tools(data_dir, log_path, db_path, runs, results):
+    import log_to_db
+    import db_to_log
+
+    import_db = os.path.join(data_dir, "import.db")
+    def new_db():
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(import_db + suffix):
+                os.remove(import_db + suffix)
+        log_to_db.db_path = import_db
+        log_to_db.create_db()
+    results["log_to_db"] = measure(lambda: log_to_db.log_to_db(log_path, True, log_to_db.default_station), runs, new_db)
+
+    db_to_log.db_path = db_path
+    export_path = os.path.join(data_dir, "export.log")
+    results["db_to_log"] = measure(lambda: db_to_log.db_to_log(export_path, "log", db_to_log.log_file_columns, 0, 2 ** 62), runs)
+
+
+def run(years, runs, seed):
+    data_dir = tempfile.mkdtemp()
+    try:
+        log_path = os.path.join(data_dir, "meteo.log")
+        db_path = os.path.join(data_dir, "meteo.db")
+        time_max = int(time.time())
+        time_min = time_max - int(years * 365.25 * 86400)
+        start = time.time()
+        with Quiet():
+            readings = synthetic.write_dataset(synthetic.generate(time_min, time_max, seed=seed), log_path, db_path)
+        print("Synthetic data: " + str(readings) + " readings (" + str(years) + " years) in " + ("%.1f" % (time.time() - start)) + "s")
+
+        results = {}
+        bench_update_meteo(data_dir, db_path, runs, results)
+        bench_history_plots(data_dir, db_path, runs, results)
+        bench_db_tools(data_dir, log_path, db_path, runs, results)
+    finally:
+        shutil.rmtree(data_dir)
+
+    return {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "dataset": {"years": years, "readings": readings, "seed": seed},
+        "results": results,
+    }
+
+
+def print_results(report):
+    print("%-32s %5s %10s %10s %10s" % ("", "runs", "min [s]", "median [s]", "max [s]"))
+    for name, result in sorted(report["results"].items()):
+        print("%-32s %5d %10.3f %10.3f %10.3f" % (name, result["runs"], result["min"], result["median"], result["max"]))
+
+
+# Compares median times of two JSON reports
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print("old: " + str(old.get("commit")) + " (" + old["date"] + ")")
+    print("new: " + str(new.get("commit")) + " (" + new["date"] + ")")
+    if old["dataset"] != new["dataset"]:
+        print("Warning: different datasets: " + str(old["dataset"]) + " / " + str(new["dataset"]))
+    print("%-32s %10s %10s %8s" % ("", "old [s]", "new [s]", "change"))
+    for name in sorted(set(old["results"]) | set(new["results"])):
+        if name not in old["results"] or name not in new["results"]:
+            print("%-32s only in one report" % name)
+            continue
+        old_time = old["results"][name]["median"]
+        new_time = new["results"][name]["median"]
+        change = (new_time - old_time) / old_time if old_time > 0 else 0.0
+        note = ""
+        if change > compare_threshold:
+            note = "  slower"
+        elif change < -compare_threshold:
+            note = "  faster"
+        print("%-32s %10.3f %10.3f %+7.1f%%%s" % (name, old_time, new_time, change * 100, note))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of meteo hot paths on synthetic data")
+    parser.add_argument("--years", type=float, default=2.0, help="synthetic data length (default: 2 years)")
+    parser.add_argument("--runs", type=int, default=3, help="runs of every benchmark (default: 3)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed of synthetic data")
+    parser.add_argument("--json", help="save results to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two saved results")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.compare[0], args.compare[1])
+        return
+
+    report = run(args.years, args.runs, args.seed)
+    print_results(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print("Results saved to " + args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# 3 day charts of update_meteo.py: new figure for every render vs figure reused (live_chart.py).
+# * render time - each of 4 charts drawn --renders times, both ways,
+# * same picture - last png files of both ways are compared pixel by pixel,
+# * memory      - daemon uptime of --days days with reused figures: 4 charts of --stations stations
+#                 every 10 minutes, 3 day window moving forward, drawn by chart pool as in the daemon
+#                 (--processes workers, each chart pinned to one worker); RSS of each worker and number
+#                 of figures it keeps are printed every 6 hours of simulated time.
+#                 --no-pin - charts given to any free worker (each worker ends up with every figure).
+#
+# Run from meteo_lcd dir:
+#   python benchmarks/bench_live_chart.py [--renders 10] [--days 1] [--stations 1] [--processes 4] [--no-pin]
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+import matplotlib.image
+
+import synthetic
+import update_meteo
+from plot_render import ChartJob, ChartPool
+
+
+# Charts drawn by update_meteo.draw_plots: (name, values column in synthetic data, plot args)
+charts = [
+    ("temperature", 3, ('r-', 'Temperatura [C]', 'Wykres temperatury zewnetrznej', 1, 0.1)),
+    ("humidity",    4, ('g-', 'Wilgotnosc wzgledna [%]', 'Wykres wilgotnosci wzglednej', 5, 1)),
+    ("dew point",   5, ('b-', 'Temp. punktu rosy [C]', 'Wykres temperatury punktu rosy', 1, 1)),
+    ("pressure",    6, ('m-', 'Cisnienie atm. [hPa]', 'Wykres cisnienia atmosferycznego', 2, 1)),
+]
+
+# Time between renders in daemon (update_meteo.plot_delay)
+render_period = 10 * 60
+window = int(update_meteo.plot_window.total_seconds())
+
+
+# Resident memory of this process [MB]
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (IOError, OSError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 # max, not current
+
+
+# Runs in chart pool worker: (RSS [MB], number of cached figures)
+def worker_state():
+    import live_chart
+    return rss_mb(), len(live_chart.charts)
+
+# The same for pool without pinned charts: task keeps its worker busy for a while,
+# so each of processes tasks goes to another worker
+def worker_state_any(i):
+    time.sleep(0.5)
+    return worker_state()
+
+
+# Draws 4 charts of 3 day window ending at time_max
+def render_all(t, values, time_max, out_dir, suffix):
+    keep = (t >= time_max - window) & (t < time_max)
+    for name, column, args in charts:
+        plot_type, ylabel, title, major_locator, minor_locator = args
+        update_meteo.plot_set_ax_fig(t[keep], values[keep, column], 0, plot_type, ylabel, title, major_locator, minor_locator,
+                                     os.path.join(out_dir, name.replace(" ", "_") + suffix + ".png"))
+
+
+def time_renders(t, values, time_max, out_dir, renders, reuse, suffix):
+    update_meteo.plot_reuse_figures = reuse
+    times = []
+    for i in range(renders):
+        start = time.time()
+        render_all(t, values, time_max + i * render_period, out_dir, suffix)
+        times.append((time.time() - start) / len(charts))
+    times.sort()
+    return times
+
+
+# Draws 4 charts of every station with chart pool (stations have the same data, but own files)
+def render_pool(pool, t, values, time_max, out_dir, stations):
+    keep = (t >= time_max - window) & (t < time_max)
+    jobs = []
+    for station in range(stations):
+        for name, column, args in charts:
+            file_name = os.path.join(out_dir, name.replace(" ", "_") + "_st" + str(station) + ".png")
+            jobs.append(ChartJob(name, update_meteo.plot_set_ax_fig, t[keep], values[keep, column], 0,
+                                 *(args + (file_name, )), output=file_name))
+    pool.render(jobs)
+
+
+def same_picture(out_dir):
+    for name, column, args in charts:
+        base = os.path.join(out_dir, name.replace(" ", "_"))
+        old = matplotlib.image.imread(base + "_new.png")
+        new = matplotlib.image.imread(base + "_reused.png")
+        if old.shape != new.shape:
+            print("  " + name + ": different size " + str(old.shape) + " / " + str(new.shape))
+        else:
+            print("  " + name + ": " + str(int(np.sum(np.any(old != new, axis=2)))) + " different pixels")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reused chart figures benchmark")
+    parser.add_argument("--renders", type=int, default=10, help="renders of each chart for timing (default: 10)")
+    parser.add_argument("--days", type=float, default=1.0, help="simulated daemon uptime for memory test (default: 1 day)")
+    parser.add_argument("--stations", type=int, default=1, help="stations in memory test (default: 1)")
+    parser.add_argument("--processes", type=int, default=update_meteo.plot_processes,
+                        help="chart pool processes in memory test (default: " + str(update_meteo.plot_processes) + ")")
+    parser.add_argument("--no-pin", action="store_true", help="don't pin charts to workers in memory test")
+    args = parser.parse_args()
+
+    uptime_renders = int(args.days * 86400 / render_period)
+    time_max = int(time.time())
+    time_min = time_max - window - (max(args.renders, uptime_renders) + 1) * render_period
+    chunks = list(synthetic.generate(time_min, time_max, gaps_per_year=0))
+    t = np.concatenate([c[0] for c in chunks])
+    values = np.concatenate([c[1] for c in chunks])
+    first = time_min + window
+
+    # Pool started before anything is drawn here (workers don't get figures of this process)
+    update_meteo.plot_reuse_figures = True
+    pool = ChartPool(args.processes, pinned=not args.no_pin)
+    out_dir = tempfile.mkdtemp()
+    try:
+        print("Render time of one chart (" + str(args.renders) + " renders of " + str(len(charts)) + " charts):")
+        print("                 min [s]  median [s]  max [s]")
+        for reuse, suffix in ((False, "_new"), (True, "_reused")):
+            times = time_renders(t, values, first, out_dir, args.renders, reuse, suffix)
+            print(("%-15s" % ("reused figure" if reuse else "new figure")) + ("%8.3f    %8.3f %8.3f" % (times[0], times[len(times) // 2], times[-1])))
+
+        print("Last charts, new vs reused figure:")
+        same_picture(out_dir)
+
+        print("Memory, reused figures, " + str(args.days) + " days of uptime (" + str(uptime_renders) + " renders), " + \
+              str(args.stations) + " stations, " + str(args.processes) + " processes" + \
+              (", charts not pinned" if args.no_pin else "") + ":")
+        print("  RSS [MB] / figures of each worker")
+        stdout = sys.stdout
+        start = time.time()
+        for i in range(uptime_renders):
+            # Output of chart pool (time of every chart) is not needed here
+            sys.stdout = open(os.devnull, "w")
+            try:
+                render_pool(pool, t, values, first + i * render_period, out_dir, args.stations)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            if i % 36 == 0 or i == uptime_renders - 1:
+                if pool.pools is not None:
+                    states = [worker.apply(worker_state) for worker in pool.pools]
+                elif pool.pool is not None:
+                    states = pool.pool.map(worker_state_any, range(args.processes), chunksize=1)
+                else:
+                    states = [worker_state()]
+                print("  " + ("%6.2f" % (i * render_period / 86400.0)) + " days: " + \
+                      "  ".join(("%.1f" % rss) + " / " + str(figures) for rss, figures in states))
+        if uptime_renders:
+            print("  " + ("%.3f" % ((time.time() - start) / uptime_renders / len(charts) / args.stations)) + "s per chart")
+    finally:
+        pool.close()
+        shutil.rmtree(out_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Startup time of update daemon.
+# * import times - every module imported in a fresh interpreter (time includes its dependencies),
+# * time to first ingested message - daemon started the way update_meteo.py main program does it
+#   (db, stations from db, template, render worker, ingest queue; MQTT is replaced by a direct
+#   handle_message() call), measured from process start until the reading is written to web page,
+#   log and db; then until the first charts are drawn.
+#   "eager" start imports matplotlib.pyplot and dateutil before update_meteo, as it was done at startup before.
+#
+# Run from meteo_lcd dir:
+#   python benchmarks/bench_startup.py [--runs 3]
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+meteo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, meteo_dir)
+
+# Modules of import times table
+modules = ["sqlite3", "numpy", "paho.mqtt.client", "dateutil.parser", "matplotlib", "matplotlib.pyplot",
+           "live_chart", "update_meteo"]
+
+payload = b"21.5;40;12.3;55;101325"
+# Child doesn't wait longer for the first charts [s]
+charts_timeout = 300
+
+
+# Import time [s] of module in a fresh interpreter
+def import_time(module):
+    code = "import time; start = time.time(); import " + module + "; print(time.time() - start)"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=meteo_dir, env=child_env())
+    return float(output.decode("ascii").split()[-1])
+
+
+def child_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = meteo_dir
+    return env
+
+
+# Runs in child process: starts daemon parts, ingests one reading, waits for charts.
+# Prints "<event> <seconds since process start>" lines.
+def child(data_dir, process_start, eager):
+    if eager:
+        import dateutil.parser
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot
+    import update_meteo
+    from meteo_db import MeteoDB
+    from meteo_template import HtmlTemplate
+    from plot_render import ChartPool
+    from render_worker import RenderWorker
+    from ingest_queue import IngestQueue
+
+    # Events go to real stdout, prints of daemon code - to /dev/null
+    out = sys.stdout
+    def event(name):
+        out.write(name + " " + repr(time.time() - process_start) + "\n")
+        out.flush()
+
+    event("imported")
+    update_meteo.www_meteo_path = os.path.join(data_dir, "meteo.html")
+    update_meteo.log_file_path = os.path.join(data_dir, "meteo.log")
+    update_meteo.db_path = os.path.join(data_dir, "meteo.db")
+    for name in ("temp_out_diagram_file", "humid_out_diagram_file", "dew_point_out_diagram_file", "pressure_diagram_file"):
+        setattr(update_meteo, name, os.path.join(data_dir, os.path.basename(getattr(update_meteo, name))))
+
+    sys.stdout = open(os.devnull, "w")
+    update_meteo.create_db()
+    update_meteo.chart_pool = ChartPool(update_meteo.plot_processes)
+    update_meteo.meteo_db = MeteoDB(update_meteo.db_path, update_meteo.db_commit_rows, update_meteo.db_commit_interval)
+    for station_id in update_meteo.meteo_db.stations():
+        update_meteo.get_station(station_id)
+    update_meteo.html_template = HtmlTemplate(os.path.join(meteo_dir, "www", "meteo.html_tmp"))
+    update_meteo.render_worker = RenderWorker(update_meteo.render_plots)
+    update_meteo.render_worker.start()
+    update_meteo.ingest_queue = IngestQueue(update_meteo.update_meteo_data)
+    update_meteo.ingest_queue.start()
+    event("started")
+    try:
+        update_meteo.handle_message(update_meteo.mqtt_topic, payload)
+        while update_meteo.ingest_queue.processed < 1:
+            time.sleep(0.001)
+        event("ingested")
+
+        deadline = time.time() + charts_timeout
+        while update_meteo.render_worker.runs < 1 and time.time() < deadline:
+            time.sleep(0.01)
+        if update_meteo.render_worker.runs:
+            event("charts")
+    finally:
+        update_meteo.ingest_queue.stop()
+        update_meteo.render_worker.stop()
+        update_meteo.chart_pool.close()
+        update_meteo.meteo_db.close()
+        sys.stdout = out
+
+
+# Starts child, returns dict: event -> seconds since process start
+def run_child(data_dir, eager):
+    args = [sys.executable, os.path.abspath(__file__), "--child", data_dir, repr(time.time())]
+    if eager:
+        args.append("--eager")
+    output = subprocess.check_output(args, cwd=meteo_dir, env=child_env())
+    events = {}
+    for line in output.decode("ascii").splitlines():
+        name, seconds = line.split()
+        events[name] = float(seconds)
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time of update daemon")
+    parser.add_argument("--runs", type=int, default=3, help="runs of each measurement, best one is shown (default: 3)")
+    parser.add_argument("--child", nargs=2, metavar=("DATA_DIR", "START"), help=argparse.SUPPRESS)
+    parser.add_argument("--eager", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], float(args.child[1]), args.eager)
+        return
+
+    print("Import time (fresh interpreter, with dependencies):")
+    for module in modules:
+        print("  " + ("%-20s" % module) + ("%7.3f" % min(import_time(module) for i in range(args.runs))) + "s")
+
+    import synthetic
+    data_dir = tempfile.mkdtemp()
+    try:
+        # Last 4 days in db, so there is something to draw
+        time_max = int(time.time()) - 3600
+        db_path = os.path.join(data_dir, "meteo.db")
+        synthetic.write_dataset(synthetic.generate(time_max - 4 * 86400, time_max), db_path=db_path)
+
+        print("Time since process start [s]:")
+        print("         imported  started  ingested  charts")
+        for eager in (True, False):
+            best = None
+            for i in range(args.runs):
+                # Every run starts with the same db (reading from previous run would be too new)
+                run_dir = os.path.join(data_dir, "run_" + str(eager) + "_" + str(i))
+                os.mkdir(run_dir)
+                shutil.copy(db_path, run_dir)
+                events = run_child(run_dir, eager)
+                if best is None or events["ingested"] < best["ingested"]:
+                    best = events
+            print(("%-8s" % ("eager" if eager else "lazy")) + ("%9.3f %8.3f %9.3f " % (best["imported"], best["started"], best["ingested"])) + \
+                  ("%7.3f" % best["charts"] if "charts" in best else "      -"))
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == "__main__":
+    main()
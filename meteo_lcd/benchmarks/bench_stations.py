@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Ingest throughput vs number of stations.
+# Synthetic MQTT messages of N stations (topics meteo/st0 ... meteo/stN-1) go through the daemon code
+# of update_meteo.py: handle_message (topic -> station, parsing) puts readings into ingest queue,
+# its writer thread runs update_meteo_data (station setup from db, dew points, web page, log file,
+# db row with group commit and rollups, memory buffer, data feed). Charts are not drawn (see bench_hot_paths.py).
+# Readings get synthetic times (every log_delay, from now on) instead of the time of parsing,
+# so every reading is written to log and db. Messages per second should not drop when more stations
+# send - total rows written should grow with the number of stations.
+# Files are written to a temporary dir (paths in update_meteo are changed for the time of benchmark).
+#
+# Run from meteo_lcd dir:
+#   python benchmarks/bench_stations.py [messages_per_station]
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import update_meteo
+from meteo_db import MeteoDB
+from meteo_template import HtmlTemplate
+from ingest_queue import IngestQueue
+
+meteo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def run(stations_count, messages, out_dir):
+    run_dir = os.path.join(out_dir, str(stations_count))
+    os.mkdir(run_dir)
+    update_meteo.www_meteo_path = os.path.join(run_dir, "meteo.html")
+    update_meteo.log_file_path = os.path.join(run_dir, "meteo.log")
+    update_meteo.db_path = os.path.join(run_dir, "meteo.db")
+    update_meteo.data_feed_dir = os.path.join(run_dir, "data")
+    update_meteo.create_db()
+    update_meteo.meteo_db = MeteoDB(update_meteo.db_path, update_meteo.db_commit_rows, update_meteo.db_commit_interval)
+    update_meteo.data_feed = update_meteo.create_data_feed()
+    update_meteo.stations.clear()
+
+    # Reading time (set in handle_message) is replaced by synthetic time of the station
+    start_time = datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(hours=1)
+    readings_count = {}
+    def update(readings):
+        stamped = []
+        for reading in readings:
+            n = readings_count.get(reading[0], 0)
+            readings_count[reading[0]] = n + 1
+            stamped.append(reading[:1] + (start_time + n * update_meteo.log_delay, ) + reading[2:])
+        update_meteo.update_meteo_data(stamped)
+
+    # "block" - no reading is dropped when writer is slower than messages
+    update_meteo.ingest_queue = IngestQueue(update, update_meteo.ingest_queue_size, "block",
+                                            update_meteo.ingest_batch_size)
+    update_meteo.ingest_queue.start()
+
+    # Messages of all stations come interleaved, as from the broker
+    topics = [update_meteo.mqtt_topic + "/st" + str(i) for i in range(stations_count)]
+    start = time.time()
+    for n in range(messages):
+        for topic in topics:
+            update_meteo.handle_message(topic, "21.5;40;" + str(n % 30) + ".5;55;100123")
+    update_meteo.ingest_queue.stop()
+    update_meteo.meteo_db.flush()
+    elapsed = time.time() - start
+    rows = update_meteo.meteo_db.rows_written
+    update_meteo.meteo_db.close()
+    return elapsed, rows
+
+
+def main():
+    messages = 500
+    if len(sys.argv) > 1:
+        messages = int(sys.argv[1])
+
+    update_meteo.html_template = HtmlTemplate(os.path.join(meteo_dir, "www", "meteo.html_tmp"))
+    # Charts are not drawn - plot requests are not made
+    update_meteo.plot_png = False
+
+    out_dir = tempfile.mkdtemp()
+    # Output of the daemon code (prints of every step) is not needed here
+    stdout = sys.stdout
+    try:
+        for stations_count in (1, 2, 4, 8, 16):
+            sys.stdout = open(os.devnull, "w")
+            try:
+                elapsed, rows = run(stations_count, messages, out_dir)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            print("stations: %-3d rows: %-7d time: %6.2fs  messages/s: %8.0f  per message: %.3f ms" % \
+                  (stations_count, rows, elapsed, rows / elapsed, elapsed * 1000.0 / rows))
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(out_dir)
+
+
+if __name__ == "__main__":
+    main()
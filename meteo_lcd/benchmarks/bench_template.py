@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Compares meteo.html rendering: old way (8x re.sub per template line)
+# and precompiled HtmlTemplate (one join of byte chunks).
+#
+# Run from meteo_lcd dir:
+#   python benchmarks/bench_template.py [number_of_renders]
+
+import datetime
+import os
+import re
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from meteo_template import HtmlTemplate
+
+template_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "www", "meteo.html_tmp")
+
+values = {
+    "TEMP_OUT": "20.4", "HUMID_OUT": "55", "DEW_OUT": "11.0", "PRESS": "1013.25",
+    "TEMP_IN": "23.1", "HUMID_IN": "40", "DEW_IN": "9.0",
+    "LAST_UPDATE": datetime.datetime(2019, 7, 31, 11, 27, 28).isoformat(' '),
+}
+
+
+# Rendering as it was done in update_meteo_data() before HtmlTemplate
+def render_regexp(src_path, dst_path):
+    tmp_file = open(src_path, "rb")
+    try:
+        os.remove(dst_path)
+    except OSError:
+        pass
+    new_file = open(dst_path, "wb")
+    for line in tmp_file:
+        new_line = line.decode("utf-8")
+        for name, value in values.items():
+            begin = "<!-- " + name + " -->"
+            end   = "<!-- /" + name + " -->"
+            new_line = re.sub(begin + ".*" + end, begin + value + end, new_line)
+        new_file.write(new_line.encode("utf-8"))
+    tmp_file.close()
+    new_file.close()
+
+
+def main():
+    count = 1000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    out_dir = tempfile.mkdtemp()
+    try:
+        dst_path = os.path.join(out_dir, "meteo.html")
+        template = HtmlTemplate(template_path)
+
+        t_regexp   = timeit.timeit(lambda: render_regexp(template_path, dst_path), number=count) / count
+        t_render   = timeit.timeit(lambda: template.render(values), number=count) / count
+        t_write    = timeit.timeit(lambda: template.write(dst_path, values), number=count) / count
+
+        print("renders:                  " + str(count))
+        print("re.sub per line + write:  " + ("%9.1f" % (t_regexp * 1e6)) + " us")
+        print("HtmlTemplate.render:      " + ("%9.1f" % (t_render * 1e6)) + " us")
+        print("HtmlTemplate.write:       " + ("%9.1f" % (t_write * 1e6)) + " us (render + temp file + rename)")
+    finally:
+        shutil.rmtree(out_dir)
+
+
+if __name__ == "__main__":
+    main()
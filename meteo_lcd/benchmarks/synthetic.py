@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Synthetic meteo readings for benchmarks - any number of years, written to meteo.log, meteo.db or both.
+# * temperature out - yearly cycle + daily cycle + slowly changing weather noise,
+# * humidity out    - high at night, low in the afternoon,
+# * pressure        - random walk pulled back to 1013 hPa,
+# * inside          - warm and stable,
+# * dew points      - the same formula as update_meteo.get_dew_point (dew_point.py, "approx"),
+# * gaps            - random periods without readings (station or network down).
+# The same seed gives the same data, so results of different commits can be compared.
+#
+# Run from meteo_lcd dir:
+#   python benchmarks/synthetic.py --years 3 --log /tmp/meteo.log --db /tmp/meteo.db
+
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from meteo_db import migrate_db, rebuild_rollups, default_station, log_columns
+from dew_point import dew_point
+
+# Time between readings [s] (update_meteo.log_delay)
+default_interval = 180
+# Readings are generated and written in chunks of this many rows
+chunk_size = 50000
+
+
+# Returns sorted unix times from time_min to time_max every interval, without random gaps.
+# gaps_per_year - average number of gaps, gap_hours - average gap length
+def reading_times(time_min, time_max, interval, gaps_per_year, gap_hours, rng):
+    times = np.arange(time_min, time_max, interval, dtype=np.int64)
+    years = (time_max - time_min) / (365.25 * 86400)
+    gaps = rng.poisson(gaps_per_year * years) if gaps_per_year > 0 else 0
+    if gaps:
+        keep = np.ones(len(times), dtype=bool)
+        starts = rng.randint(time_min, time_max, gaps)
+        lengths = rng.exponential(gap_hours * 3600, gaps).astype(np.int64)
+        for start, length in zip(starts, lengths):
+            keep[(times >= start) & (times < start + length)] = False
+        times = times[keep]
+    return times
+
+
+# Readings for given times: (times, values) - values columns in meteo.log order:
+# temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure
+# state - dict with random walk state, passed between chunks
+def readings(times, rng, state):
+    n = len(times)
+    day = (times % 86400) / 86400.0
+    year = (times % 31557600) / 31557600.0
+
+    # Weather noise and pressure - random walks pulled back to the mean
+    noise = np.empty(n)
+    pressure = np.empty(n)
+    walk = state.get("noise", 0.0)
+    press = state.get("pressure", 1013.0)
+    noise_steps = rng.normal(0.0, 0.08, n)
+    press_steps = rng.normal(0.0, 0.15, n)
+    for i in range(n):
+        walk += noise_steps[i] - walk * 0.002
+        press += press_steps[i] - (press - 1013.0) * 0.001
+        noise[i] = walk
+        pressure[i] = press
+    state["noise"] = walk
+    state["pressure"] = press
+
+    daily = np.sin(2 * np.pi * (day - 0.375)) # warmest around 15:00
+    temp_out = 8.0 - 12.0 * np.cos(2 * np.pi * (year - 0.03)) + 5.0 * daily + 3.0 * noise
+    humid_out = np.clip(72.0 - 18.0 * daily - 4.0 * noise + rng.normal(0.0, 2.0, n), 15, 100)
+    temp_in = 21.5 + 1.0 * np.sin(2 * np.pi * (day - 0.3)) + rng.normal(0.0, 0.1, n)
+    humid_in = np.clip(42.0 + 5.0 * np.cos(2 * np.pi * year) + rng.normal(0.0, 1.0, n), 20, 70)
+
+    temp_out = np.round(temp_out, 1)
+    humid_out = np.round(humid_out)
+    temp_in = np.round(temp_in, 1)
+    humid_in = np.round(humid_in)
+    pressure = np.round(pressure, 2)
+    values = np.column_stack((temp_in, humid_in, dew_point(temp_in, humid_in),
+                              temp_out, humid_out, dew_point(temp_out, humid_out), pressure))
+    return times, values
+
+
+# Yields chunks (times, values) of readings between time_min and time_max
+def generate(time_min, time_max, interval=default_interval, gaps_per_year=12, gap_hours=6.0, seed=1):
+    rng = np.random.RandomState(seed)
+    times = reading_times(time_min, time_max, interval, gaps_per_year, gap_hours, rng)
+    state = {}
+    for pos in range(0, len(times), chunk_size):
+        yield readings(times[pos:pos + chunk_size], rng, state)
+
+
+# meteo.log line, as update_meteo.log_to_file writes it
+def log_line(t, v):
+    return datetime.datetime.fromtimestamp(t).isoformat() + ";" + str(v[0]) + ";" + str(int(v[1])) + ";" + \
+           str(v[2]) + ";" + str(v[3]) + ";" + str(int(v[4])) + ";" + str(v[5]) + ";" + str(v[6]) + "\n"
+
+
+# Writes readings to log file and/or db (None - don't write). Returns number of readings.
+def write_dataset(chunks, log_path=None, db_path=None, station_id=default_station):
+    lf = None
+    conn = None
+    if log_path is not None:
+        lf = open(log_path, "w", 1024 * 1024)
+    if db_path is not None:
+        migrate_db(db_path)
+        conn = sqlite3.connect(db_path)
+        conn.execute("PRAGMA synchronous=OFF")
+    count = 0
+    try:
+        for times, values in chunks:
+            rows = values.tolist()
+            if lf is not None:
+                lf.write("".join(log_line(int(t), v) for t, v in zip(times, rows)))
+            if conn is not None:
+                # db column order: time, temp, humid, dew_point, pressure, temp_in, humid_in, dew_point_in
+                conn.executemany("INSERT OR IGNORE INTO log (station_id, " + ", ".join(log_columns) + ") \
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                 [(station_id, int(t), v[3], int(v[4]), int(v[5]), v[6], v[0], int(v[1]), int(v[2]))
+                                  for t, v in zip(times, rows)])
+                conn.commit()
+            count += len(times)
+        if conn is not None:
+            rebuild_rollups(conn.cursor())
+            conn.commit()
+    finally:
+        if lf is not None:
+            lf.close()
+        if conn is not None:
+            conn.close()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic meteo data")
+    parser.add_argument("--years", type=float, default=1.0, help="length of data (default: 1 year)")
+    parser.add_argument("--end", help="time of the last reading, YYYY-MM-DD (default: now)")
+    parser.add_argument("--interval", type=int, default=default_interval, help="time between readings [s]")
+    parser.add_argument("--gaps-per-year", type=float, default=12, help="average number of gaps in data per year")
+    parser.add_argument("--gap-hours", type=float, default=6.0, help="average gap length [h]")
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--station", default=default_station, help="station id of db rows")
+    parser.add_argument("--log", help="meteo.log file to write")
+    parser.add_argument("--db", help="meteo.db file to write (rows are added)")
+    args = parser.parse_args()
+    if args.log is None and args.db is None:
+        parser.error("give --log and/or --db")
+
+    time_max = int(time.time())
+    if args.end:
+        time_max = int(time.mktime(datetime.datetime.strptime(args.end, "%Y-%m-%d").timetuple()))
+    time_min = time_max - int(args.years * 365.25 * 86400)
+
+    start = time.time()
+    count = write_dataset(generate(time_min, time_max, args.interval, args.gaps_per_year, args.gap_hours, args.seed),
+                          args.log, args.db, args.station)
+    print(str(count) + " readings written in " + ("%.1f" % (time.time() - start)) + "s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Binary meteo log (optional, alternative to text meteo.log).
+# File starts with a header: magic "METEOBIN", format version, record size.
+# Then fixed size records (little endian, 20 bytes instead of ~60 bytes of text):
+#   time      - int32, unix time
+#   temp_in, humid_in, dew_in, temp_out, humid_out, dew_out - int16, value * 100
+#   pressure  - int32, value * 100
+# Missing value (NaN) is stored as the minimal int value of the field.
+# Values written by update_meteo have at most 2 decimal places, so nothing is lost
+# (except the sign of "-0.0", which is read back as 0.0).
+#
+# File is only appended. Reader maps the file into memory (mmap) and sees records
+# as numpy array - time range is found by binary search on time column, without parsing.
+
+import mmap
+import os
+import struct
+import time
+import datetime
+
+import numpy as np
+
+
+magic = b"METEOBIN"
+version = 1
+header_format = "<8sII" # magic, version, record size
+header_size = struct.calcsize(header_format)
+
+# Record fields in order of meteo.log line
+fields = ("time", "temp_in", "humid_in", "dew_in", "temp_out", "humid_out", "dew_out", "pressure")
+record_dtype = np.dtype([
+    ("time",      "<i4"),
+    ("temp_in",   "<i2"),
+    ("humid_in",  "<i2"),
+    ("dew_in",    "<i2"),
+    ("temp_out",  "<i2"),
+    ("humid_out", "<i2"),
+    ("dew_out",   "<i2"),
+    ("pressure",  "<i4"),
+])
+record_size = record_dtype.itemsize
+record_format = "<i6hi"
+
+# Values are kept as fixed point numbers: value * scale
+scale = 100
+# Fields written to text log as integers (see update_meteo.log_to_file)
+int_fields = ("humid_in", "humid_out")
+
+
+# Missing value marker of each value field
+def missing_values():
+    return [np.iinfo(record_dtype[name]).min for name in fields[1:]]
+
+
+# Value -> fixed point int. Raises ValueError when value can't be stored without loss.
+def to_fixed(value, name):
+    if value != value: # NaN
+        return np.iinfo(record_dtype[name]).min
+    fixed = int(round(value * scale))
+    info = np.iinfo(record_dtype[name])
+    if abs(fixed - value * scale) > 1e-6 or fixed <= info.min or fixed > info.max:
+        raise ValueError("value " + str(value) + " of " + name + " can't be stored in binary log")
+    return fixed
+
+
+# Fixed point int -> text, as str() would write the value in meteo.log
+def format_value(fixed, name):
+    if fixed == np.iinfo(record_dtype[name]).min:
+        return "nan"
+    if name in int_fields and fixed % scale == 0:
+        return str(fixed // scale)
+    text = "%.2f" % (fixed / float(scale))
+    return text.rstrip("0").rstrip(".") + (".0" if text.endswith(".00") else "")
+
+
+def pack_record(t, values):
+    return struct.pack(record_format, int(t), *[to_fixed(float(v), name) for v, name in zip(values, fields[1:])])
+
+
+def check_header(data, path):
+    if len(data) < header_size:
+        raise ValueError(path + ": file too short for binary log header")
+    file_magic, file_version, file_record_size = struct.unpack(header_format, data[:header_size])
+    if file_magic != magic:
+        raise ValueError(path + ": not a binary meteo log")
+    if file_version != version or file_record_size != record_size:
+        raise ValueError(path + ": unsupported binary log version " + str(file_version))
+
+
+# Appends records to binary log. Header is written when file is new.
+class BinaryLogWriter(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    # Opens file for appending. Partial record at the end (e.g. power loss during write) is cut off.
+    def open(self):
+        f = open(self.path, "ab")
+        size = f.tell()
+        if size == 0:
+            f.write(struct.pack(header_format, magic, version, record_size))
+        else:
+            with open(self.path, "rb") as rf:
+                check_header(rf.read(header_size), self.path)
+            extra = (size - header_size) % record_size
+            if extra:
+                f.truncate(size - extra)
+        return f
+
+    # t - unix time, values - (temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure)
+    def append(self, t, values):
+        record = pack_record(t, values)
+        f = self.open()
+        try:
+            f.write(record)
+        finally:
+            f.close()
+
+    # Appends many records: times - unix times, values - rows of 7 values
+    def extend(self, times, values):
+        f = self.open()
+        try:
+            f.write(b"".join(pack_record(t, row) for t, row in zip(times, values)))
+        finally:
+            f.close()
+
+
+class BinaryLog(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    # Calls func(records) with records mapped from file (numpy structured array).
+    # Records are valid only inside func - result must not keep references to them.
+    def with_records(self, func):
+        with open(self.path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            check_header(f.read(header_size), self.path)
+            count = (size - header_size) // record_size
+            if count == 0:
+                return func(np.zeros(0, dtype=record_dtype))
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                records = np.frombuffer(mm, dtype=record_dtype, count=count, offset=header_size)
+                result = func(records)
+                del records
+                return result
+            finally:
+                mm.close()
+
+    # Returns (times, values) of records with time_min <= time < time_max (None - no limit),
+    # the same as LogReader.read_range: times - int64 array, values - float64 array [n, 7]
+    def read_range(self, time_min=None, time_max=None):
+        def read(records):
+            times = records["time"]
+            start = 0 if time_min is None else int(np.searchsorted(times, time_min, "left"))
+            end = len(times) if time_max is None else int(np.searchsorted(times, time_max, "left"))
+            return records_to_columns(records[start:max(start, end)])
+        return self.with_records(read)
+
+    # Number of records in file
+    def __len__(self):
+        return self.with_records(len)
+
+    # Time of the last record (or None for empty log)
+    def last_time(self):
+        return self.with_records(lambda records: int(records["time"][-1]) if len(records) else None)
+
+
+# Structured records -> (times - int64 array, values - float64 array [n, 7], NaN for missing)
+def records_to_columns(records):
+    times = records["time"].astype(np.int64)
+    values = np.empty((len(records), len(fields) - 1), dtype=np.float64)
+    for i, (name, missing) in enumerate(zip(fields[1:], missing_values())):
+        column = records[name]
+        values[:, i] = column / float(scale)
+        values[column == missing, i] = np.nan
+    return times, values
+
+
+# Text log line (as written by update_meteo.log_to_file) for one record
+def format_line(t, fixed_values):
+    return datetime.datetime.fromtimestamp(t).isoformat() + ";" + \
+           ";".join(format_value(v, name) for v, name in zip(fixed_values, fields[1:])) + "\n"
+
+
+# Yields text log lines of records with time_min <= time < time_max (None - no limit).
+# File stays mapped while lines are read - chunk_size records are converted at once.
+def text_lines(path, time_min=None, time_max=None, chunk_size=10000):
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        check_header(f.read(header_size), path)
+        count = (size - header_size) // record_size
+        if count == 0:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            records = np.frombuffer(mm, dtype=record_dtype, count=count, offset=header_size)
+            times = records["time"]
+            start = 0 if time_min is None else int(np.searchsorted(times, time_min, "left"))
+            end = count if time_max is None else int(np.searchsorted(times, time_max, "left"))
+            for pos in range(start, end, chunk_size):
+                # Python values - no references to mapped memory
+                rows = records[pos:min(pos + chunk_size, end)].tolist()
+                for row in rows:
+                    yield format_line(row[0], row[1:])
+            del times, records
+        finally:
+            mm.close()
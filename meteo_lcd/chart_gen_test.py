@@ -7,6 +7,7 @@ from shutil import move
 from os import remove
 from math import sqrt, floor
 import datetime # datetime and timedelta structures
+from collections import deque
 
 from matplotlib.ticker import MultipleLocator
 
@@ -15,6 +16,7 @@ from matplotlib.ticker import MultipleLocator
 
 # Needed for drawing a plot
 import dateutil.parser
+from log_reader import LogReader
 #import plotly
 
 # Data for plotting
@@ -36,14 +38,10 @@ def getDateTimeFromISO8601String(s):
     return d
 
 def draw_plot():
-        # Open log file
-        lf = open("C:\Users\Janusz\meteo.log", "r")
-        num_lines = sum(1 for line in lf)
-        lf.seek(0)
-        print(num_lines)
-        lines_to_skip = num_lines - 350 # 864 - aprox. 3 full days
-        i = 0;
-        j = 0;
+        # Read log file - only last 350 records are kept
+        reader = LogReader("C:\Users\Janusz\meteo.log")
+        records = deque(reader.records(), 350) # 864 - aprox. 3 full days
+        reader.report()
         every_x = 1;
         x_pixels = 700
         y_pixels = 400
@@ -56,28 +54,20 @@ def draw_plot():
         h_out = []; # humid out for plot
         d_out = []; # dew point for plot
         p_out = []; # pressure for plot
-        # From each line of log file create a pairs of meteo data (time, value)
-        for line in lf:
-            i += 1
-            j += 1
-            if i < lines_to_skip:
+        # From each record create a pairs of meteo data (time, value)
+        for i, record in enumerate(records):
+            if i % every_x:
                 continue
-            if j >= every_x:
-                j = 0
-            else:
-                continue
-            # Parse line
-            time, temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure = str(line).split(";")
+            # Record format: (time, temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure)
+            time, temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure = record
             # Append time for time axis
-            #t.append(matplotlib.dates.date2num(getDateTimeFromISO8601String(time)))
-            t.append(getDateTimeFromISO8601String(time))
+            t.append(datetime.datetime.fromtimestamp(time))
             # Append meteo data for their axis
-            t_out.append(float(temp_out))
-            h_out.append(float(humid_out))
-            d_out.append(float(dew_out))
-            p_out.append(float(pressure))
+            t_out.append(temp_out)
+            h_out.append(humid_out)
+            d_out.append(dew_out)
+            p_out.append(pressure)
                 
-        lf.close()
         # draw plots for outside values: temperature, humidity, dew piont, pressure
         fig, ax = plt.subplots()
         #plt.figure(figsize=(y_pixels/100.0, x_pixels/100.0), dpi=100)
@@ -12,11 +12,23 @@ import dateutil.parser
 import datetime # datetime and timedelta structures
 import time
 import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MultipleLocator
+import numpy as np
+
+# Drawing charts in parallel (pool of processes)
+from plot_render import ChartJob, ChartPool, rows_to_columns
+# Unix times -> Matplotlib date numbers
+from time_axis import epoch_to_num
+# Reducing number of points before drawing
+from downsample import downsample
 
 # Sqlite3 database
 import sqlite3
+from meteo_db import get_stations, default_station
+# Files of many stations
+from stations import station_file
 
 
 # choose working dir
@@ -33,6 +45,18 @@ humid_out_diagram_file     = "humid_out.png"
 dew_point_out_diagram_file = "dew_out.png"
 pressure_diagram_file      = "pressure.png"
 
+# Number of processes drawing charts (1 - draw in this process)
+plot_processes = 4
+# Chart is not drawn again if its data and settings are the same as of the file already drawn
+# (digest kept next to each chart file, see render_cache.py)
+plot_cache = True
+
+# Before drawing, each series is reduced to about chart width in pixels (chart size grows with the
+# day of month - 1.5 inch * 100 dpi per day).
+# Method: "minmax" (min and max of each bucket), "lttb" (Largest-Triangle-Three-Buckets) or None (all points)
+plot_downsample_method = "minmax"
+plot_points_per_day    = 150
+
 
 # Converts a string back the datetime structure
 def getDateTimeFromISO8601String(s):
@@ -40,7 +64,16 @@ def getDateTimeFromISO8601String(s):
     return d
 
 
-def get_val_month_db(month, year):
+# Stations having data in db
+def get_stations_db():
+    conn = sqlite3.connect(db_path)
+    try:
+        return get_stations(conn)
+    finally:
+        conn.close()
+
+
+def get_val_month_db(month, year, station_id=default_station):
 
     if month < 1 or month > 12:
         return;
@@ -62,7 +95,7 @@ def get_val_month_db(month, year):
     int_time_max = int (time.mktime(getDateTimeFromISO8601String(str_time_max).timetuple()))
 
     try:
-        c.execute("SELECT time, temp, humid, dew_point, pressure FROM log WHERE time >= ? AND time < ?", (int_time_min, int_time_max))
+        c.execute("SELECT time, temp, humid, dew_point, pressure FROM log WHERE station_id = ? AND time >= ? AND time < ?", (station_id, int_time_min, int_time_max))
         rows = c.fetchall()
 #        for row in rows:
 #            print(row)
@@ -76,8 +109,19 @@ def get_val_month_db(month, year):
 
 
 
+# Chart file in hist dir: yyyy.mm.dataName.png
+def hist_file(date, file_name):
+    return hist_dir + str(date.year) + "." + str(date.month) + "." + file_name
+
+
 def plot_set_ax_fig (today, time, data, data_len, plot_type, ylabel, title, major_locator, minor_locator, file_name):
 
+    # time comes as array of unix times - convert it to Matplotlib dates (local time) at once
+    time = epoch_to_num(time)
+    # Reduce number of points to about chart width (peaks are kept)
+    time, data = downsample(time, data, plot_points_per_day * today.day, plot_downsample_method)
+    data_len = len(time) - 1
+
     # This keeps chart nice-looking
     #ratio = 0.20
     #plot_size_inches = 40
@@ -110,60 +154,52 @@ def plot_set_ax_fig (today, time, data, data_len, plot_type, ylabel, title, majo
     #print((xmax-xmin)/(ymax-ymin))
     ax.set_aspect(abs((xmax-xmin)/(ymax-ymin))*ratio) #, adjustable='box-forced')
 
-    fig.savefig(hist_dir + str(today.year) + "." + str(today.month) + "." + file_name, bbox_inches='tight')
+    fig.savefig(hist_file(today, file_name), bbox_inches='tight')
     plt.close()
 
 
+# Draws plots for outside values of a station: temperature, humidity, dew piont, pressure
+# Each plot is drawn by separate process.
+# t - numpy array of unix times, t_out, h_out, d_out, p_out - numpy arrays with values
+def draw_plots(today, t, t_out, h_out, d_out, p_out, station_id=default_station):
+    values_count = len(t)
+
+    chart_pool = ChartPool(plot_processes, plot_cache, (plot_downsample_method, plot_points_per_day))
+    try:
+        chart_pool.render([
+            ChartJob("temperature", plot_set_ax_fig, today, t, t_out, values_count-1, 'r-', 'Temperatura [C]', 'Wykres temperatury zewnetrznej', 1, 0.5, station_file(temp_out_diagram_file, station_id), output=hist_file(today, station_file(temp_out_diagram_file, station_id))),
+            ChartJob("humidity",    plot_set_ax_fig, today, t, h_out, values_count-1, 'g-', 'Wilgotnosc wzgledna [%]', 'Wykres wilgotnosci wzglednej', 5, 1, station_file(humid_out_diagram_file, station_id), output=hist_file(today, station_file(humid_out_diagram_file, station_id))),
+            ChartJob("dew point",   plot_set_ax_fig, today, t, d_out, values_count-1, 'b-', 'Temp. punktu rosy [C]', 'Wykres temperatury punktu rosy', 1, 1, station_file(dew_point_out_diagram_file, station_id), output=hist_file(today, station_file(dew_point_out_diagram_file, station_id))),
+            ChartJob("pressure",    plot_set_ax_fig, today, t, p_out, values_count-1, 'm-', 'Cisnienie atm. [hPa]', 'Wykres cisnienia atmosferycznego', 2, 1, station_file(pressure_diagram_file, station_id), output=hist_file(today, station_file(pressure_diagram_file, station_id))),
+        ])
+    finally:
+        chart_pool.close()
+
+
 # Draw a plot
 def draw_plot_month_db():
 
-    # Today
-    today = datetime.datetime.today()
+    # Today (midnight - time of day is not used by plots, and it would change digest of render cache)
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time())
     #plot_date_begin = datetime.datetime(today.year, today.month, 1)
     #plot_date_end   = datetime.datetime(today.year, today.month+1, 1)
 
-    t = []; # time axis for plot
-    t_out = []; # temp out for plot
-    h_out = []; # humid out for plot
-    d_out = []; # dew point for plot
-    p_out = []; # pressure for plot
-
-    rows = get_val_month_db(today.month, today.year)  # month, and year
-    # From each row creates a pairs of meteo data (time, value)
-
-    values_count = len(rows)
-    # Row format: (time, temp, humid, dew_point, pressure)
-    for row in rows:
-        # Append time for time axis
-        t.append(datetime.datetime.fromtimestamp(row[0]))
-        # Append meteo data for their axis
-        t_out.append(row[1])
-        h_out.append(row[2])
-        d_out.append(row[3])
-        p_out.append(row[4])
-
-    # draw plots for outside values: temperature, humidity, dew piont, pressure
-
-    ##############
-    # Temperature
-    plot_set_ax_fig(today, t, t_out, values_count-1, 'r-', 'Temperatura [C]', 'Wykres temperatury zewnetrznej', 1, 0.5, temp_out_diagram_file)
-    
-    ##############
-    # Humidity
-    plot_set_ax_fig(today, t, h_out, values_count-1, 'g-', 'Wilgotnosc wzgledna [%]', 'Wykres wilgotnosci wzglednej', 5, 1, humid_out_diagram_file)
-
-    ##############
-    # Dew point
-    plot_set_ax_fig(today, t, d_out, values_count-1, 'b-', 'Temp. punktu rosy [C]', 'Wykres temperatury punktu rosy', 1, 1, dew_point_out_diagram_file)
-
-    ##############
-    # Pressure
-    plot_set_ax_fig(today, t, p_out, values_count-1, 'm-', 'Cisnienie atm. [hPa]', 'Wykres cisnienia atmosferycznego', 2, 1, pressure_diagram_file)
+    # Plots for every station
+    for station_id in get_stations_db():
+        rows = get_val_month_db(today.month, today.year, station_id)  # month, and year
+        if not rows:
+            print("No data of station " + (station_id or "default") + " - no plots")
+            continue
+        # Row format: (time, temp, humid, dew_point, pressure)
+        t, (t_out, h_out, d_out, p_out) = rows_to_columns(rows, 4)
+
+        draw_plots(today, t, t_out, h_out, d_out, p_out, station_id)
 
     return
 
 
 
-# Main program:
-draw_plot_month_db();
+# Main program (only when started as a script - benchmarks import this module):
+if __name__ == "__main__":
+    draw_plot_month_db();
 
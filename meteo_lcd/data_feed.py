@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Data feed for charts drawn in web browser (www/charts.html) - small JSON files in www data dir,
+# one set for every station (station_file names, e.g. latest_garden.json):
+# * latest.json       - the newest reading (all values), written with web page,
+# * recent.json       - last 3 days (plot window) at full resolution, from memory buffer of the station,
+#                       written again every window_interval,
+# * recent_delta.json - rows newer than the last row of recent.json, written with every new db row;
+#                       browser loads recent.json once and then polls only this small file,
+# * month.json        - hourly rollups of last 31 days,
+# * year.json         - daily rollups of last 366 days (with min/max of temperature),
+#                       both written again every rollup_interval.
+# Series are kept in columns; times are delta-coded: first one is unix time, next ones are seconds
+# after previous one (usually the same number - compresses well if web server gzips json).
+# Values are rounded to precision of readings, missing values are null.
+# Files are replaced atomically, so browser never gets a half-written file.
+
+import json
+import os
+import time
+
+import numpy as np
+
+# Atomic file writes
+from metrics import write_file
+# Files of many stations
+from stations import station_file
+
+
+# Columns of station memory buffer (and of recent*.json) with number of decimal places
+recent_columns = [("temp", 1), ("humid", 0), ("dew_point", 2), ("pressure", 2)]
+
+# Rollup files: (file name, table, period [s], length [s], aggregates)
+rollup_files = [
+    ("month.json", "log_hourly", 3600,  31 * 86400,
+     ["temp_avg", "humid_avg", "dew_point_avg", "pressure_avg"]),
+    ("year.json",  "log_daily",  86400, 366 * 86400,
+     ["temp_avg", "temp_min", "temp_max", "humid_avg", "dew_point_avg", "pressure_avg"]),
+]
+
+# Decimal places of aggregates (averages get one more than readings)
+rollup_decimals = {"temp": 2, "humid": 1, "dew_point": 2, "pressure": 2}
+
+
+# Times -> delta-coded list of ints
+def delta_times(times):
+    times = np.asarray(times, dtype=np.int64)
+    if len(times) == 0:
+        return []
+    return [int(times[0])] + np.diff(times).tolist()
+
+
+# Values -> list of rounded numbers (None for NaN; whole numbers without ".0")
+def rounded(values, decimals):
+    values = np.round(np.asarray(values, dtype=np.float64), decimals)
+    return [None if v != v else (int(v) if v == int(v) else v) for v in values.tolist()]
+
+
+def to_json(data):
+    return json.dumps(data, separators=(",", ":"), sort_keys=True)
+
+
+class DataFeed(object):
+
+    # data_dir - dir of json files (in www dir), window - length of recent.json [s]
+    def __init__(self, data_dir, window, window_interval=60 * 60, rollup_interval=60 * 60):
+        self.data_dir = data_dir
+        self.window = window
+        self.window_interval = window_interval
+        self.rollup_interval = rollup_interval
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+
+        # station_id -> (time of the last row in recent.json, when it was written)
+        self.window_state = {}
+        # station_id -> when rollup files were written
+        self.rollup_time = {}
+
+        # Statistics
+        self.files_written = 0
+        self.bytes_written = 0
+
+    def path(self, file_name, station_id):
+        return station_file(os.path.join(self.data_dir, file_name), station_id)
+
+    def write(self, file_name, station_id, data):
+        text = to_json(data)
+        write_file(self.path(file_name, station_id), text)
+        self.files_written += 1
+        self.bytes_written += len(text)
+
+    # The newest reading of a station: t - unix time, values - dict of numbers
+    def write_latest(self, station_id, t, values):
+        data = dict(values)
+        data.update({"station": station_id, "time": int(t)})
+        self.write("latest.json", station_id, data)
+
+    # Series of station memory buffer: times, columns - arrays (recent_columns order)
+    def series(self, station_id, times, columns):
+        data = {"station": station_id, "generated": int(time.time()), "t": delta_times(times)}
+        for (name, decimals), column in zip(recent_columns, columns):
+            data[name] = rounded(column, decimals)
+        return data
+
+    # Called after new row of a station is added to its memory buffer (station.recent_data):
+    # writes recent_delta.json, or recent.json (and empty delta) when it's time to write it again
+    def update(self, station):
+        station_id = station.station_id
+        state = self.window_state.get(station_id)
+        now = time.time()
+        if state is None or now - state[1] >= self.window_interval:
+            times, columns = station.recent_data.window(int(now) - self.window)
+            if len(times) == 0:
+                return
+            last_time = int(times[-1])
+            self.write("recent.json", station_id, self.series(station_id, times, columns))
+            self.window_state[station_id] = (last_time, now)
+            times, columns = times[:0], [column[:0] for column in columns]
+        else:
+            last_time = state[0]
+            times, columns = station.recent_data.window(last_time + 1)
+        # Browser adds delta rows to data of recent.json with the same "since" time
+        data = self.series(station_id, times, columns)
+        data["since"] = last_time
+        self.write("recent_delta.json", station_id, data)
+
+    # Writes month.json and year.json of a station if they are older than rollup_interval
+    # meteo_db - MeteoDB (rollups are read with its connection)
+    def update_rollups(self, meteo_db, station_id):
+        now = time.time()
+        if now - self.rollup_time.get(station_id, 0) < self.rollup_interval:
+            return
+        self.rollup_time[station_id] = now
+        for file_name, table, period, length, aggregates in rollup_files:
+            time_max = int(now) + period
+            rows = meteo_db.select_rollup(table, time_max - length - period, time_max, aggregates, station_id)
+            data = {"station": station_id, "generated": int(now), "period": period,
+                    "t": delta_times([row[0] for row in rows])}
+            for i, name in enumerate(aggregates):
+                data[name] = rounded([np.nan if row[i + 2] is None else row[i + 2] for row in rows],
+                                     rollup_decimals[name.rsplit("_", 1)[0]])
+            self.write(file_name, station_id, data)
+
+    def stats_str(self):
+        return "files: " + str(self.files_written) + ", " + str(self.bytes_written // 1024) + " kB"
@@ -1,6 +1,18 @@
 import sqlite3
 import datetime
 import dateutil.parser
+import time
+import gzip
+import zipfile
+import tempfile
+import argparse
+import numpy as np
+
+# meteo_db.py is kept in parent dir (together with update_meteo.py)
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from meteo_db import migrate_db, log_columns, default_station
 
 working_dir = "/var/www/html/"
 data_dir = "/home/pi/meteo/"
@@ -8,36 +20,167 @@ data_dir = "/home/pi/meteo/"
 log_file_path = working_dir + "meteo.log"
 db_path = data_dir + "meteo.db"
 
+# Rows read from db at once (fetchmany) - memory use doesn't depend on table size
+chunk_size = 5000
+# Output file buffer size
+write_buffer = 1024 * 1024
+
+# Columns in order of meteo.log line
+log_file_columns = ("temp_in", "humid_in", "dew_point_in", "temp", "humid", "dew_point", "pressure")
+
+# Export of log table:
+# * log - meteo.log format (time;temp_in;humid_in;dew_in;temp_out;humid_out;dew_out;pressure)
+# * csv - gzip compressed CSV with header (unix time and selected columns)
+# * npz - NumPy arrays (one per column, "time" is int64, values float64 with NaN for NULL),
+#         read with numpy.load(). Columns are first written to temporary .npy files on disk.
 ###################################
 
-def db_to_log():
+# Station of exported rows
+station_id = default_station
+
+# Yields chunks of rows (time, columns...) with time_min <= time < time_max
+def select_chunks(c, columns, time_min, time_max):
+    c.execute("SELECT time, " + ", ".join(columns) + " FROM log WHERE station_id = ? AND time >= ? AND time < ? ORDER BY time ASC",
+              (station_id, time_min, time_max))
+    while True:
+        rows = c.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def write_log(c, path, columns, time_min, time_max):
+    count = 0
+    with open(path, "w", write_buffer) as lf:
+        for rows in select_chunks(c, columns, time_min, time_max):
+            lines = []
+            for row in rows:
+                lines.append(datetime.datetime.fromtimestamp(row[0]).isoformat() + ";" + \
+                             str(row[1]) + ";" + \
+                             str(row[2]) + ";" + \
+                             str(float(row[3])) + ";" + \
+                             str(row[4]) + ";" + \
+                             str(row[5]) + ";" + \
+                             str(float(row[6])) + ";" + \
+                             str(row[7]) + "\n")
+            lf.write("".join(lines))
+            count += len(rows)
+    return count
+
+
+def write_csv(c, path, columns, time_min, time_max):
+    count = 0
+    with gzip.open(path, "wb") as gf:
+        gf.write((",".join(("time", ) + tuple(columns)) + "\n").encode("ascii"))
+        for rows in select_chunks(c, columns, time_min, time_max):
+            lines = []
+            for row in rows:
+                lines.append(",".join("" if v is None else str(v) for v in row) + "\n")
+            gf.write("".join(lines).encode("ascii"))
+            count += len(rows)
+    return count
+
+
+def write_npz(c, path, columns, time_min, time_max):
+    c.execute("SELECT COUNT(*) FROM log WHERE station_id = ? AND time >= ? AND time < ?", (station_id, time_min, time_max))
+    count = c.fetchone()[0]
+    names = ("time", ) + tuple(columns)
+
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        arrays = []
+        for name in names:
+            dtype = np.int64 if name == "time" else np.float64
+            arrays.append(np.lib.format.open_memmap(os.path.join(tmp_dir, name + ".npy"), mode="w+", dtype=dtype, shape=(count, )))
 
-    lf = open(data_dir + "tmp.log", "w");
+        pos = 0
+        for rows in select_chunks(c, columns, time_min, time_max):
+            rows = rows[:count - pos] # rows added after COUNT(*)
+            data = np.array(rows, dtype=np.float64).reshape(len(rows), len(names))
+            for i in range(len(names)):
+                arrays[i][pos:pos + len(rows)] = data[:, i]
+            pos += len(rows)
+            if pos >= count:
+                break
+        for array in arrays:
+            array.flush()
+        del arrays
+
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            for name in names:
+                zf.write(os.path.join(tmp_dir, name + ".npy"), name + ".npy")
+    finally:
+        for name in names:
+            if os.path.exists(os.path.join(tmp_dir, name + ".npy")):
+                os.remove(os.path.join(tmp_dir, name + ".npy"))
+        os.rmdir(tmp_dir)
+    return pos
+
+
+writers = {
+    "log": write_log,
+    "csv": write_csv,
+    "npz": write_npz,
+}
+
+
+def db_to_log(path, file_format, columns, time_min, time_max):
 
     conn = sqlite3.connect(db_path)
     c = conn.cursor()
 
+    start = time.time()
     try:
-        c.execute("SELECT time, temp_in, humid_in, dew_point_in, temp, humid, dew_point, pressure FROM log ORDER BY time ASC")
-        rows = c.fetchall()
+        count = writers[file_format](c, path, columns, time_min, time_max)
     except Exception as e:
-        print("Error while get all values from db: " + str(e))
-
-    for row in rows:
-        new_line = datetime.datetime.fromtimestamp(row[0]).isoformat() + ";" + \
-                   str(row[1]) + ";" + \
-                   str(row[2]) + ";" + \
-                   str(float(row[3])) + ";" + \
-                   str(row[4]) + ";" + \
-                   str(row[5]) + ";" + \
-                   str(float(row[6])) + ";" + \
-                   str(row[7]) + "\n"
-        lf.write(new_line)
-
-    lf.close()
+        print("Error while exporting values from db: " + str(e))
+        conn.close()
+        return
+
     conn.close()
+    elapsed = max(time.time() - start, 1e-6)
+    print(str(count) + " rows written to " + path + " in " + ("%.1f" % elapsed) + "s (" + str(int(count / elapsed)) + " rows/s)")
+
+
+# "YYYY-MM-DD" or "YYYY-MM-DDTHH:MM:SS" (local time) -> unix time
+def parse_time(s):
+    return int(time.mktime(dateutil.parser.parse(s).timetuple()))
+
+
+def format_from_path(path):
+    if path.endswith(".npz"):
+        return "npz"
+    if path.endswith(".gz"):
+        return "csv"
+    return "log"
 
 
 ###################################
-db_to_log()
+# Runs only as a script (benchmarks import db_to_log() from here)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export meteo.db log table")
+    parser.add_argument("output", nargs="?", default=data_dir + "tmp.log", help="output file (default: " + data_dir + "tmp.log)")
+    parser.add_argument("--format", choices=sorted(writers.keys()), help="output format (default: from file extension: .npz, .gz - csv, other - log)")
+    parser.add_argument("--start", help="first time to export, e.g. 2018-01-01 or 2018-01-01T12:00:00 (local time)")
+    parser.add_argument("--end", help="export values before this time")
+    parser.add_argument("--station", default=default_station, help="station id (default: default station)")
+    parser.add_argument("--columns", help="comma separated columns for csv and npz (default: all): " + ",".join(log_columns[1:]))
+    args = parser.parse_args()
+
+    file_format = args.format or format_from_path(args.output)
+    columns = log_file_columns
+    if args.columns:
+        if file_format == "log":
+            parser.error("--columns can't be used with log format (log line has all values)")
+        columns = tuple(col.strip() for col in args.columns.split(","))
+        for col in columns:
+            if col not in log_columns[1:]:
+                parser.error("unknown column: " + col)
+    elif file_format != "log":
+        columns = log_columns[1:]
+    station_id = args.station
+    time_min = parse_time(args.start) if args.start else 0
+    time_max = parse_time(args.end) if args.end else 2 ** 62
 
+    migrate_db(db_path)
+    db_to_log(args.output, file_format, columns, time_min, time_max)
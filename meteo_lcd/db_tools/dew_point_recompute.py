@@ -0,0 +1,146 @@
+import sqlite3
+import time
+import argparse
+
+# meteo_db.py is kept in parent dir (together with update_meteo.py)
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import numpy as np
+from meteo_db import migrate_db, rebuild_rollups, get_stations
+from dew_point import dew_point, methods
+
+working_dir = "/var/www/html/"
+data_dir = "/home/pi/meteo/"
+
+db_path = data_dir + "meteo.db"
+
+# Rows read, computed and written in one transaction
+chunk_size = 50000
+# Progress is printed every progress_interval seconds
+progress_interval = 5
+
+# Recalculates dew_point and dew_point_in columns of whole history (or a part of it)
+# from temperature and humidity, with numpy - a chunk of rows at once:
+# * rows are read in time order, chunk by chunk (one station after another),
+# * dew points of the whole chunk are computed in one numpy pass,
+# * only rows with changed value are updated, each chunk in one transaction, together with
+#   hourly/daily rollups of its changed periods (interrupted run leaves db consistent - just run it again).
+# With --check nothing is written - rows with different stored values are counted (validation).
+# Rows without temperature or humidity keep stored dew point.
+# meteo.log is not changed - it can be written again from db with db_to_log.py.
+#
+# Usage:
+#   python dew_point_recompute.py [--method approx|magnus] [--float] [--check] [--station ID] [--start DATE] [--end DATE]
+###################################
+
+# Yields chunks of rows (time, temp, humid, dew_point, temp_in, humid_in, dew_point_in) of one station
+def read_chunks(c, station_id, time_min, time_max):
+    last_time = time_min - 1
+    while True:
+        c.execute("SELECT time, temp, humid, dew_point, temp_in, humid_in, dew_point_in FROM log \
+                   WHERE station_id = ? AND time > ? AND time < ? ORDER BY time ASC LIMIT ?",
+                  (station_id, last_time, time_max, chunk_size))
+        rows = c.fetchall()
+        if not rows:
+            return
+        yield rows
+        last_time = rows[-1][0]
+
+
+# Returns (values to store, mask of rows where stored value differs) for one dew point column
+def recompute(temp, humid, stored, method, rounded):
+    new = dew_point(temp, humid, method, rounded)
+    if not rounded:
+        new = np.round(new, 2)
+    valid = ~np.isnan(new)
+    with np.errstate(invalid="ignore"):
+        changed = valid & ~(np.abs(new - stored) < 1e-9) # NULL stored value (NaN) is changed too
+    return new, changed
+
+
+def dew_point_recompute(method, rounded, check, stations, time_min, time_max):
+    conn = sqlite3.connect(db_path)
+    # Transactions are started and committed explicitly
+    conn.isolation_level = None
+    c = conn.cursor()
+    if stations is None:
+        stations = get_stations(conn)
+
+    start = time.time()
+    last_progress = start
+    rows_read = 0
+    rows_changed = 0
+    max_diff = 0.0
+
+    for station_id in stations:
+        for rows in read_chunks(c, station_id, time_min, time_max):
+            # NULL -> NaN
+            data = np.array(rows, dtype=np.float64)
+            times = data[:, 0].astype(np.int64)
+            new_out, changed_out = recompute(data[:, 1], data[:, 2], data[:, 3], method, rounded)
+            new_in, changed_in = recompute(data[:, 4], data[:, 5], data[:, 6], method, rounded)
+            changed = changed_out | changed_in
+            rows_read += len(rows)
+
+            if changed.any():
+                rows_changed += int(changed.sum())
+                with np.errstate(invalid="ignore"):
+                    for new, stored, column_changed in ((new_out, data[:, 3], changed_out), (new_in, data[:, 6], changed_in)):
+                        diff = np.abs(new[column_changed] - stored[column_changed])
+                        diff = diff[~np.isnan(diff)]
+                        if len(diff):
+                            max_diff = max(max_diff, float(diff.max()))
+                if not check:
+                    # Rows where only one column changed get their stored value in the other one
+                    out = np.where(changed_out, new_out, data[:, 3])[changed]
+                    inside = np.where(changed_in, new_in, data[:, 6])[changed]
+                    convert = int if rounded else float
+                    updates = [(None if o != o else convert(o), None if i != i else convert(i), station_id, t)
+                               for o, i, t in zip(out.tolist(), inside.tolist(), times[changed].tolist())]
+                    c.execute("BEGIN")
+                    try:
+                        c.executemany("UPDATE log SET dew_point = ?, dew_point_in = ? WHERE station_id = ? AND time = ?", updates)
+                        # Dew points are aggregated in hourly/daily rollups too
+                        rebuild_rollups(c, int(times[changed][0]), int(times[changed][-1]), station_id)
+                        c.execute("COMMIT")
+                    except Exception:
+                        c.execute("ROLLBACK")
+                        raise
+
+            now = time.time()
+            if now - last_progress >= progress_interval:
+                last_progress = now
+                print("  " + str(rows_read) + " rows read, " + str(rows_changed) + " changed (" + \
+                      str(int(rows_read / (now - start))) + " rows/s)")
+
+    elapsed = max(time.time() - start, 1e-6)
+    print(str(rows_read) + " rows read, " + str(rows_changed) + (" differ" if check else " changed") + \
+          " (max difference: " + ("%.2f" % max_diff) + ") in " + ("%.1f" % elapsed) + "s (" + str(int(rows_read / elapsed)) + " rows/s)")
+
+    conn.close()
+    return rows_changed
+
+
+def parse_time(s):
+    return int(time.mktime(time.strptime(s, "%Y-%m-%d")))
+
+
+# Runs only as a script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recalculate dew points stored in meteo.db")
+    parser.add_argument("--method", choices=methods, default="approx", help="formula (default: approx - as update_meteo.py)")
+    parser.add_argument("--float", action="store_true", help="store full precision (2 decimal places) instead of integers")
+    parser.add_argument("--check", action="store_true", help="only count rows with different stored values, don't write")
+    parser.add_argument("--station", action="append", help="station id (can be repeated; default: all stations)")
+    parser.add_argument("--start", help="first day, YYYY-MM-DD (default: beginning of data)")
+    parser.add_argument("--end", help="day after the last one, YYYY-MM-DD (default: end of data)")
+    args = parser.parse_args()
+
+    migrate_db(db_path)
+    time_min = parse_time(args.start) if args.start else 0
+    time_max = parse_time(args.end) if args.end else 2 ** 62
+    changed = dew_point_recompute(args.method, not args.float, args.check, args.station, time_min, time_max)
+    # Exit code 1 - validation found differences
+    if args.check and changed:
+        sys.exit(1)
@@ -0,0 +1,88 @@
+import time
+import argparse
+import dateutil.parser
+
+# meteo_db.py is kept in parent dir (together with update_meteo.py)
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from log_reader import LogReader
+from binary_log import BinaryLogWriter, text_lines
+
+working_dir = "/var/www/html/"
+
+log_file_path = working_dir + "meteo.log"
+binary_log_file_path = working_dir + "meteo.bin"
+
+# Records converted at once
+chunk_size = 10000
+
+# Conversion between text meteo.log and binary log (see binary_log.py):
+#   log_convert.py to-bin  [meteo.log] [meteo.bin]
+#   log_convert.py to-text [meteo.bin] [meteo.log] [--start ...] [--end ...]
+# Values are kept exactly (as written by update_meteo). Conversion to binary stops
+# with an error when some value can't be stored exactly.
+# Only exception: "-0.0" (e.g. temperature rounded from -0.04) has no sign in fixed point,
+# so it comes back as "0.0" - the same number, but the line text differs.
+###################################
+
+def to_bin(text_path, bin_path):
+    if os.path.exists(bin_path):
+        print("Output file exists: " + bin_path)
+        return
+
+    reader = LogReader(text_path)
+    writer = BinaryLogWriter(bin_path)
+    start = time.time()
+    count = 0
+    not_in_order = 0
+    last_time = None
+    for times, values in reader.columns(chunk_size):
+        for t in times:
+            if last_time is not None and t < last_time:
+                not_in_order += 1
+            last_time = t
+        try:
+            writer.extend(times, values)
+        except ValueError as e:
+            print("Conversion stopped after " + str(count) + " records: " + str(e))
+            return
+        count += len(times)
+    reader.report()
+    if not_in_order:
+        print("Warning: " + str(not_in_order) + " records are older than previous record - time range search may skip them")
+    print(str(count) + " records written to " + bin_path + " in " + ("%.1f" % (time.time() - start)) + "s")
+
+
+def to_text(bin_path, text_path, time_min, time_max):
+    start = time.time()
+    count = 0
+    with open(text_path, "w", 1024 * 1024) as lf:
+        for line in text_lines(bin_path, time_min, time_max):
+            lf.write(line)
+            count += 1
+    print(str(count) + " lines written to " + text_path + " in " + ("%.1f" % (time.time() - start)) + "s")
+
+
+# "YYYY-MM-DD" or "YYYY-MM-DDTHH:MM:SS" (local time) -> unix time
+def parse_time(s):
+    return int(time.mktime(dateutil.parser.parse(s).timetuple()))
+
+
+###################################
+# Runs only as a script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert meteo log between text and binary format")
+    parser.add_argument("direction", choices=["to-bin", "to-text"])
+    parser.add_argument("input", nargs="?", help="input file (default: " + log_file_path + " or " + binary_log_file_path + ")")
+    parser.add_argument("output", nargs="?", help="output file (default: " + binary_log_file_path + " or meteo_bin.log)")
+    parser.add_argument("--start", help="to-text: first time to write, e.g. 2018-01-01 (local time)")
+    parser.add_argument("--end", help="to-text: write records before this time")
+    args = parser.parse_args()
+
+    if args.direction == "to-bin":
+        to_bin(args.input or log_file_path, args.output or binary_log_file_path)
+    else:
+        to_text(args.input or binary_log_file_path, args.output or working_dir + "meteo_bin.log",
+                parse_time(args.start) if args.start else None,
+                parse_time(args.end) if args.end else None)
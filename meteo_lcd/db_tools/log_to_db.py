@@ -1,6 +1,13 @@
 import sqlite3
-import datetime
-import dateutil.parser
+import time
+import argparse
+
+# meteo_db.py is kept in parent dir (together with update_meteo.py)
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from meteo_db import migrate_db, rebuild_rollups, default_station
+from log_reader import LogReader
 
 working_dir = "/var/www/html/"
 data_dir = "/home/pi/meteo/"
@@ -8,61 +15,118 @@ data_dir = "/home/pi/meteo/"
 log_file_path = working_dir + "meteo.log"
 db_path = data_dir + "meteo.db"
 
+# Rows inserted in one transaction
+batch_size = 5000
+# Progress is printed every progress_interval seconds
+progress_interval = 5
+
+# Bulk import of log file into database.
+# * rows are inserted in big batches (executemany), each batch in one transaction,
+#   with synchronous writes off for the time of import,
+# * rows with time that is already in database are skipped,
+# * after each batch a checkpoint (file offset and last time) is saved in log_import table,
+#   in the same transaction - interrupted import continues from there when run again,
+# * hourly/daily rollups of periods of a batch are recalculated in the same transaction too,
+#   so rows of an interrupted import are never missing in rollups.
+###################################
+
+# Returns saved (offset, last_time) for log file or (0, None)
+def get_checkpoint(c, path):
+    c.execute("SELECT offset, last_time FROM log_import WHERE path = ?", (path, ))
+    row = c.fetchone()
+    if row is None:
+        return 0, None
+    return row[0], row[1]
 
-# Converts a string back the datetime structure
-def getDateTimeFromISO8601String(s):
-    d = dateutil.parser.parse(s)
-    return d
 
+def save_checkpoint(c, path, offset, last_time):
+    c.execute("INSERT OR REPLACE INTO log_import (path, offset, last_time) VALUES (?, ?, ?)", (path, offset, last_time))
 
-def log_to_db ():
+
+def log_to_db (path, restart, station_id):
     conn = sqlite3.connect(db_path)
+    # Transactions are started and committed explicitly
+    conn.isolation_level = None
     c = conn.cursor()
+    # Import can be repeated if power goes down - no need to wait for disk on every commit
+    c.execute("PRAGMA synchronous=OFF")
+
+    path = os.path.abspath(path)
+    offset, last_time = get_checkpoint(c, path)
+    if restart:
+        offset, last_time = 0, None
+    elif offset > os.path.getsize(path):
+        print("Log file is smaller than saved checkpoint (new file?), starting from the beginning")
+        offset, last_time = 0, None
+    elif offset > 0:
+        print("Resuming import from offset " + str(offset) + " (last time: " + str(last_time) + ")")
+
+    reader = LogReader(path)
+    start = time.time()
+    last_progress = start
+    rows_read = 0
+    rows_inserted = 0
+    batch = []
+
+    def write_batch(batch, offset, last_time):
+        c.execute("BEGIN")
+        try:
+            changes = conn.total_changes
+            c.executemany("INSERT OR IGNORE INTO log (station_id, time, temp, humid, dew_point, pressure, temp_in, humid_in, dew_point_in) \
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            inserted = conn.total_changes - changes
+            # Imported rows have to be counted in hourly/daily rollups
+            if inserted > 0:
+                times = [row[1] for row in batch]
+                rebuild_rollups(c, min(times), max(times), station_id)
+            save_checkpoint(c, path, offset, last_time)
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        return inserted
+
+    # Record format: (time, temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure)
+    for offset, (int_time, temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure) in reader.records_with_offsets(offset):
+        batch.append((station_id, int_time, temp_out, humid_out, dew_out, pressure, temp_in, humid_in, dew_in))
+        last_time = int_time
+        if len(batch) >= batch_size:
+            rows_inserted += write_batch(batch, offset, last_time)
+            rows_read += len(batch)
+            batch = []
+            now = time.time()
+            if now - last_progress >= progress_interval:
+                last_progress = now
+                print("  " + str(rows_read) + " rows read, " + str(rows_inserted) + " inserted (" + \
+                      str(int(rows_read / (now - start))) + " rows/s)")
+    if batch:
+        rows_inserted += write_batch(batch, offset, last_time)
+        rows_read += len(batch)
+
+    elapsed = max(time.time() - start, 1e-6)
+    print(str(rows_read) + " rows read, " + str(rows_inserted) + " inserted, " + str(rows_read - rows_inserted) + \
+          " skipped (already in db) in " + ("%.1f" % elapsed) + "s (" + str(int(rows_read / elapsed)) + " rows/s)")
+    reader.report()
 
-    # Open log file
-    lf = open(log_file_path, "r");
-
-    # From each line of log file create a pairs of meteo data (time, value)
-    for line in lf:
-        # Parse line
-        time, temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure = str(line).split(";")
-        #c.execute("SELECT strftime('%s', (?), 'localtime')", (time, ))
-        #int_time = (c.fetchone())[0]
-        int_time = int (getDateTimeFromISO8601String(time).strftime("%s"))
-        #time_ = getDateTimeFromISO8601String(time)
-        #print int_time
-        c.execute("INSERT INTO log (time, temp, humid, dew_point, pressure, temp_in, humid_in, dew_point_in) \
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (int_time, temp_out, humid_out, dew_out, pressure, temp_in, humid_in, dew_in))
-
-    lf.close()
-    conn.commit()
     conn.close()
 
 
+# Creating table in database (or migrating it to current schema)
 def create_db ():
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
+    migrate_db(db_path)
 
-    sql = "CREATE TABLE IF NOT EXISTS log (\n\
-id INTEGER PRIMARY KEY ASC,\n\
-time INT NOT NULL,\n\
-temp REAL,\n\
-humid INT,\n\
-dew_point INT,\n\
-pressure REAL,\n\
-temp_in REAL,\n\
-humid_in INT,\n\
-dew_point_in INT)"
-                             
-    c.execute(sql)
-
-    conn.commit()
-    conn.close()
 
-print ("Creating database..")
-create_db()
-print ("Database OK")
-print ("Copying from log file to database...")
-log_to_db()
-print ("Copy OK")
+# Runs only as a script (benchmarks import log_to_db() from here)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import meteo.log into meteo.db")
+    parser.add_argument("log_file", nargs="?", default=log_file_path, help="log file (default: " + log_file_path + ")")
+    parser.add_argument("--station", default=default_station, help="station id of imported rows (default: default station)")
+    parser.add_argument("--restart", action="store_true", help="ignore saved checkpoint, import whole file")
+    args = parser.parse_args()
 
+    print ("Creating database..")
+    create_db()
+    print ("Database OK")
+    print ("Copying from log file to database...")
+    log_to_db(args.log_file, args.restart, args.station)
+    print ("Copy OK")
@@ -0,0 +1,50 @@
+import sqlite3
+import time
+
+# meteo_db.py is kept in parent dir (together with update_meteo.py)
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from meteo_db import migrate_db, rebuild_rollups
+
+working_dir = "/var/www/html/"
+data_dir = "/home/pi/meteo/"
+
+db_path = data_dir + "meteo.db"
+
+# Recalculates hourly and daily rollups from log table.
+# Usage:
+#   python rollup_backfill.py             - all data
+#   python rollup_backfill.py 2019-07-01  - only periods from this day
+###################################
+
+def rollup_backfill(time_min):
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+
+    start = time.time()
+    try:
+        rebuild_rollups(c, time_min)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print("Error while rebuilding rollups: " + str(e))
+        conn.close()
+        return
+
+    for table in ("log_hourly", "log_daily"):
+        c.execute("SELECT COUNT(*) FROM " + table)
+        print(table + ": " + str(c.fetchone()[0]) + " rows")
+    print("Rollups done in " + ("%.1f" % (time.time() - start)) + "s")
+    conn.close()
+
+
+###################################
+# Runs only as a script
+if __name__ == "__main__":
+    time_min = None
+    if len(sys.argv) > 1:
+        time_min = int(time.mktime(time.strptime(sys.argv[1], "%Y-%m-%d")))
+
+    migrate_db(db_path)
+    rollup_backfill(time_min)
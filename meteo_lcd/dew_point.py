@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Dew point formulas, for single readings (update daemon) and for whole numpy columns (db_tools):
+# * "approx" - the original formula of update_meteo.py (nested square roots),
+#              good for -30 < T < 70 *C and humidity 0-100%,
+# * "magnus" - Magnus-Tetens formula (a = 17.62, b = 243.12 *C), humidity must be > 0.
+# Result is rounded to integer (as it's always been stored in db and log) or kept as float.
+# Vectorized functions return NaN for readings without value (NULL in db) or out of formula range.
+
+import math
+
+import numpy as np
+
+
+methods = ("approx", "magnus")
+
+# Magnus-Tetens constants (over water)
+magnus_a = 17.62
+magnus_b = 243.12 # *C
+
+
+def approx(temp, humid):
+    return np.sqrt(np.sqrt(np.sqrt(humid / 100.0))) * (112.0 + 0.9 * temp) + 0.1 * temp - 112.0
+
+
+def magnus(temp, humid):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gamma = np.log(humid / 100.0) + magnus_a * temp / (magnus_b + temp)
+        result = magnus_b * gamma / (magnus_a - gamma)
+        return np.where(humid > 0, result, np.nan)
+
+
+# Rounds to nearest integer the same way update_meteo.get_dew_point always did (halves up)
+def round_half_up(values):
+    return np.floor(values + 0.5)
+
+
+# Dew points for numpy columns of temperature [*C] and relative humidity [%]
+def dew_point(temp, humid, method="approx", rounded=True):
+    temp = np.asarray(temp, dtype=np.float64)
+    humid = np.asarray(humid, dtype=np.float64)
+    if method == "approx":
+        with np.errstate(invalid="ignore"):
+            result = approx(temp, humid)
+    elif method == "magnus":
+        result = magnus(temp, humid)
+    else:
+        raise ValueError("Unknown dew point method: " + str(method))
+    if rounded:
+        result = round_half_up(result)
+    return result
+
+
+# Dew point of one reading (no numpy - it's called for every message)
+def dew_point_one(temp, humid, method="approx", rounded=True):
+    temp = float(temp)
+    humid = float(humid)
+    if method == "approx":
+        result = math.sqrt(math.sqrt(math.sqrt(humid / 100.0))) * (112.0 + 0.9 * temp) + 0.1 * temp - 112.0
+    elif method == "magnus":
+        gamma = math.log(humid / 100.0) + magnus_a * temp / (magnus_b + temp)
+        result = magnus_b * gamma / (magnus_a - gamma)
+    else:
+        raise ValueError("Unknown dew point method: " + str(method))
+    if rounded:
+        return math.floor(result + 0.5)
+    return result
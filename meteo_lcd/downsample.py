@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Reducing number of points before plotting.
+# There is no point in drawing 15000 points on a chart that is 4000 pixels wide -
+# it only makes drawing slow. Both methods keep peaks visible:
+# * "minmax" - data is split into buckets, min and max of each bucket is kept,
+# * "lttb"   - Largest-Triangle-Three-Buckets, keeps the point giving the biggest
+#              triangle with neighbour buckets (good shape, one point per bucket).
+# x has to be sorted (time axis). NaN values are dropped.
+
+import numpy as np
+
+
+def drop_nan(x, y):
+    keep = ~(np.isnan(x) | np.isnan(y))
+    if keep.all():
+        return x, y
+    return x[keep], y[keep]
+
+
+# Min and max of each bucket - result has at most max_points points
+def minmax(x, y, max_points):
+    n = len(x)
+    buckets = (max_points - 2) // 2 # first and last point are kept too
+    if n <= max_points or buckets < 1:
+        return x, y
+
+    size = -(-n // buckets) # ceil
+    pad = buckets * size - n
+    values = np.pad(y, (0, pad), mode="edge").reshape(buckets, size)
+    base = np.arange(buckets) * size
+    index = np.concatenate((base + values.argmin(axis=1), base + values.argmax(axis=1), [0, n - 1]))
+    index = np.unique(np.minimum(index, n - 1)) # sorted, without duplicates
+    return x[index], y[index]
+
+
+# Largest-Triangle-Three-Buckets - result has max_points points
+def lttb(x, y, max_points):
+    n = len(x)
+    if n <= max_points or max_points < 3:
+        return x, y
+
+    # First and last point are always kept, the rest is split into max_points - 2 buckets
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+    avg_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts
+    # "Next bucket" for the last bucket is the last point
+    avg_x = np.append(avg_x[1:], x[n - 1])
+    avg_y = np.append(avg_y[1:], y[n - 1])
+
+    index = np.empty(max_points, dtype=np.int64)
+    index[0] = 0
+    index[-1] = n - 1
+    a = 0
+    for i in range(max_points - 2):
+        start = edges[i]
+        end = edges[i + 1]
+        bx = x[start:end]
+        by = y[start:end]
+        area = np.abs((x[a] - avg_x[i]) * (by - y[a]) - (x[a] - bx) * (avg_y[i] - y[a]))
+        a = start + int(area.argmax())
+        index[i + 1] = a
+    return x[index], y[index]
+
+
+methods = {
+    "minmax": minmax,
+    "lttb":   lttb,
+}
+
+
+# Returns (x, y) reduced to about max_points points.
+# method - "minmax", "lttb" or None (no downsampling)
+def downsample(x, y, max_points, method="minmax"):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    x, y = drop_nan(x, y)
+    if method is None or not max_points:
+        return x, y
+    return methods[method](x, y, max_points)
@@ -0,0 +1,346 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Draws history plots (hist/ dir) of many months at once - e.g. after a change of chart style,
+# or after restoring database.
+# * month plots - the same as month_plot.py draws (yyyy.mm.dataName.png),
+# * day plots (optional, --days) - plot of every day of a month (yyyy.mm.dd.dataName.png).
+# Data of all months of a station is read in one sorted scan of db (hourly rollups for month plots
+# as month_plot.py does, log table for day plots) and cut into months/days while reading.
+# Charts of many months are drawn at once by a pool of processes.
+# Plots are not drawn again if their data and style have not changed since the last run: digest of charts
+# of each month/day (as render_cache.py counts it: renderer version, plot arguments with data and settings)
+# is kept in hist/backfill_state.json (--force draws everything).
+#
+# Usage:
+#   python hist_backfill.py [--start YYYY-MM] [--end YYYY-MM] [--days] [--station ID] [--processes 4] [--force]
+
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from matplotlib.ticker import MultipleLocator
+import numpy as np
+
+# Month plots, paths and settings of hist dir
+import month_plot
+# Drawing charts in parallel (pool of processes)
+from plot_render import ChartJob, ChartPool
+# Digests of charts
+import render_cache
+# Unix times -> Matplotlib date numbers
+from time_axis import epoch_to_num
+# Reducing number of points before drawing
+from downsample import downsample
+
+# Sqlite3 database
+import sqlite3
+from meteo_db import get_stations, day_start, default_station
+# Files of many stations
+from stations import station_file
+
+
+# Number of processes drawing charts (1 - draw in this process)
+plot_processes = 4
+# Charts given to the pool at once (months/days are read from db until there is this many of them)
+batch_charts = 64
+# Rows fetched from db at once while scanning
+scan_rows = 10000
+
+# Digests of data of drawn plots
+state_file_path = month_plot.hist_dir + "backfill_state.json"
+
+# Day plots: size as 3 day plots of update_meteo.py, points reduced to chart width
+day_plot_size_inches = 22
+day_plot_ratio       = 0.25
+day_plot_max_points  = 2200
+
+
+# Local midnight of the 1st day of a month (unix time)
+def month_start(year, month):
+    return int(time.mktime(datetime.date(year, month, 1).timetuple()))
+
+
+def next_month(year, month):
+    if month == 12:
+        return year + 1, 1
+    return year, month + 1
+
+
+# Returns list of (datetime of period start, unix time of period start) for months from first to last
+# (both given as (year, month)), and unix time of the end of the last month
+def month_periods(first, last):
+    periods = []
+    year, month = first
+    while (year, month) <= last:
+        periods.append((datetime.datetime(year, month, 1), month_start(year, month)))
+        year, month = next_month(year, month)
+    return periods, month_start(year, month)
+
+
+# The same for every day between time_min and time_max (local midnights)
+def day_periods(time_min, time_max):
+    periods = []
+    t = time_min
+    while t < time_max:
+        periods.append((datetime.datetime.fromtimestamp(t), t))
+        # 26 hours forward and back to midnight - days are 23-25 hours long when clock changes
+        t = day_start(t + 26 * 3600)
+    return periods
+
+
+# Runs sql (rows sorted by time, first column - time) and cuts result into periods.
+# boundaries - sorted period starts and the end of the last period (len(periods) + 1 values)
+# Yields (period index, numpy array of rows) for periods having any rows.
+def scan_periods(conn, sql, params, boundaries):
+    c = conn.cursor()
+    c.execute(sql, params)
+    boundaries = np.asarray(boundaries, dtype=np.int64)
+    index = 0
+    pending = []
+    while True:
+        rows = c.fetchmany(scan_rows)
+        if not rows:
+            break
+        # NULL -> NaN
+        data = np.array(rows, dtype=np.float64)
+        # Period of every row (rows before the first period can't come - sql has the same limits)
+        row_periods = np.searchsorted(boundaries, data[:, 0], side="right") - 1
+        while len(data):
+            end = np.searchsorted(row_periods, index, side="right")
+            if end > 0:
+                pending.append(data[:end])
+            if end == len(data):
+                break
+            if pending:
+                yield index, np.concatenate(pending)
+                pending = []
+            data = data[end:]
+            row_periods = row_periods[end:]
+            index = int(row_periods[0])
+    if pending:
+        yield index, np.concatenate(pending)
+
+
+# Settings used by plot functions, but not given to them as arguments
+def plot_settings():
+    return (month_plot.plot_downsample_method, month_plot.plot_max_points, month_plot.use_hourly_rollup,
+            day_plot_size_inches, day_plot_ratio, day_plot_max_points)
+
+
+# Digest of charts of a period, so unchanged periods are not drawn again
+def charts_digest(jobs):
+    settings = plot_settings()
+    h = hashlib.sha1()
+    for job in jobs:
+        h.update(render_cache.digest(job.plot_func, job.args, settings).encode("ascii"))
+    return h.hexdigest()
+
+
+def load_state():
+    try:
+        with open(state_file_path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+# Written to temporary file and renamed, so interrupted run doesn't leave a broken file
+def save_state(state):
+    tmp_path = state_file_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.rename(tmp_path, state_file_path)
+
+
+# Day plot file in hist dir: yyyy.mm.dd.dataName.png
+def day_file(date, file_name):
+    return month_plot.hist_dir + str(date.year) + "." + str(date.month) + "." + str(date.day) + "." + file_name
+
+
+# Plot of one day
+def plot_set_ax_fig_day(date, time, data, plot_type, ylabel, title, major_locator, minor_locator, file_name):
+
+    # time comes as array of unix times - convert it to Matplotlib dates (local time) at once
+    time = epoch_to_num(time)
+    # Reduce number of points to about chart width (peaks are kept)
+    time, data = downsample(time, data, day_plot_max_points, month_plot.plot_downsample_method)
+
+    fig, ax = plt.subplots()
+
+    fig.set_size_inches(day_plot_size_inches, day_plot_size_inches)
+
+    # Plot data:
+    ax.plot_date(time, data, plot_type)
+    ax.set_xlim(time[0], time[-1])
+    ax.set(xlabel='', ylabel=ylabel, title=title + " " + str(date.day) + "." + str(date.month) + "." + str(date.year))
+    ax.grid()
+
+    ax.xaxis.set_major_locator(matplotlib.dates.HourLocator(byhour=None, interval=3))
+    ax.xaxis.set_minor_locator(matplotlib.dates.HourLocator())
+    ax.xaxis.set_major_formatter(matplotlib.dates.DateFormatter("%m-%d %H:%M"))
+
+    ax.yaxis.set_major_locator(MultipleLocator(major_locator))
+    ax.yaxis.set_minor_locator(MultipleLocator(minor_locator))
+    ax.tick_params(labeltop=False, labelright=True)
+
+    plt.gcf().autofmt_xdate()
+
+    xmin, xmax = ax.get_xlim()
+    ymin, ymax = ax.get_ylim()
+    ax.set_aspect(abs((xmax-xmin)/(ymax-ymin))*day_plot_ratio)
+
+    fig.savefig(day_file(date, file_name), bbox_inches='tight')
+    plt.close()
+
+
+def day_chart_jobs(date, t, t_out, h_out, d_out, p_out, station_id, name_prefix):
+    return [
+        ChartJob(name_prefix + "temperature", plot_set_ax_fig_day, date, t, t_out, 'r-', 'Temperatura [C]', 'Wykres temperatury zewnetrznej', 1, 0.1, station_file(month_plot.temp_out_diagram_file, station_id), output=day_file(date, station_file(month_plot.temp_out_diagram_file, station_id))),
+        ChartJob(name_prefix + "humidity",    plot_set_ax_fig_day, date, t, h_out, 'g-', 'Wilgotnosc wzgledna [%]', 'Wykres wilgotnosci wzglednej', 5, 1, station_file(month_plot.humid_out_diagram_file, station_id), output=day_file(date, station_file(month_plot.humid_out_diagram_file, station_id))),
+        ChartJob(name_prefix + "dew point",   plot_set_ax_fig_day, date, t, d_out, 'b-', 'Temp. punktu rosy [C]', 'Wykres temperatury punktu rosy', 1, 1, station_file(month_plot.dew_point_out_diagram_file, station_id), output=day_file(date, station_file(month_plot.dew_point_out_diagram_file, station_id))),
+        ChartJob(name_prefix + "pressure",    plot_set_ax_fig_day, date, t, p_out, 'm-', 'Cisnienie atm. [hPa]', 'Wykres cisnienia atmosferycznego', 2, 1, station_file(month_plot.pressure_diagram_file, station_id), output=day_file(date, station_file(month_plot.pressure_diagram_file, station_id))),
+    ]
+
+
+class Backfill(object):
+
+    def __init__(self, processes, force):
+        self.force = force
+        self.state = load_state()
+        self.chart_pool = ChartPool(processes)
+        # Charts waiting for the pool: (state key, digest, jobs)
+        self.pending = []
+        self.drawn = 0
+        self.skipped = 0
+        self.failed = 0
+
+    # Adds chart set of one period (month or day) if its data changed
+    # key - state key (station and date)
+    def add(self, key, data, make_jobs):
+        t = data[:, 0].astype(np.int64)
+        columns = [np.ascontiguousarray(data[:, i]) for i in range(1, 5)]
+        jobs = make_jobs(t, columns, key + " ")
+        digest = charts_digest(jobs)
+        if not self.force and self.state.get(key) == digest and all(os.path.exists(job.output) for job in jobs):
+            self.skipped += 1
+            return
+        self.pending.append((key, digest, jobs))
+        if sum(len(jobs) for key, digest, jobs in self.pending) >= batch_charts:
+            self.flush()
+
+    # Draws waiting charts; digest is saved only for periods drawn without errors
+    def flush(self):
+        if not self.pending:
+            return
+        jobs = [job for key, digest, period_jobs in self.pending for job in period_jobs]
+        errors = set(name for name, elapsed, error in self.chart_pool.render(jobs) if error is not None)
+        for key, digest, period_jobs in self.pending:
+            if any(job.name in errors for job in period_jobs):
+                self.failed += 1
+                self.state.pop(key, None)
+            else:
+                self.drawn += 1
+                self.state[key] = digest
+        self.pending = []
+        save_state(self.state)
+
+    def close(self):
+        self.flush()
+        self.chart_pool.close()
+
+
+def backfill_station(conn, backfill, station_id, months, days):
+    periods, time_max = months
+    time_min = periods[0][1]
+    station_key = (station_id or "default") + " "
+
+    # Month plots - from hourly averages (shown in the middle of each hour) or from all readings
+    boundaries = [start for date, start in periods] + [time_max]
+    if month_plot.use_hourly_rollup:
+        sql = "SELECT time + 1800, temp_avg, humid_avg, dew_point_avg, pressure_avg FROM log_hourly \
+               WHERE station_id = ? AND time >= ? AND time < ? ORDER BY time ASC"
+        boundaries = [b + 1800 for b in boundaries]
+    else:
+        sql = "SELECT time, temp, humid, dew_point, pressure FROM log \
+               WHERE station_id = ? AND time >= ? AND time < ? ORDER BY time ASC"
+    for index, data in scan_periods(conn, sql, (station_id, time_min, time_max), boundaries):
+        date = periods[index][0]
+        backfill.add(station_key + str(date.year) + "." + str(date.month), data,
+                     lambda t, columns, name_prefix: month_plot.chart_jobs(date, t, *columns, station_id=station_id, name_prefix=name_prefix))
+
+    if not days:
+        return
+    # Day plots - from all readings
+    periods = day_periods(time_min, time_max)
+    boundaries = [start for date, start in periods] + [time_max]
+    sql = "SELECT time, temp, humid, dew_point, pressure FROM log \
+           WHERE station_id = ? AND time >= ? AND time < ? ORDER BY time ASC"
+    for index, data in scan_periods(conn, sql, (station_id, time_min, time_max), boundaries):
+        date = periods[index][0]
+        backfill.add(station_key + str(date.year) + "." + str(date.month) + "." + str(date.day), data,
+                     lambda t, columns, name_prefix: day_chart_jobs(date, t, *columns, station_id=station_id, name_prefix=name_prefix))
+
+
+def hist_backfill(first, last, days, stations, processes, force):
+    conn = sqlite3.connect(month_plot.db_path)
+    if stations is None:
+        stations = get_stations(conn)
+
+    # Without dates - months having any data
+    if first is None or last is None:
+        c = conn.cursor()
+        c.execute("SELECT MIN(time), MAX(time) FROM log_daily")
+        time_min, time_max = c.fetchone()
+        if time_min is None:
+            print("No data in db")
+            conn.close()
+            return
+        if first is None:
+            d = datetime.date.fromtimestamp(time_min)
+            first = (d.year, d.month)
+        if last is None:
+            d = datetime.date.fromtimestamp(time_max)
+            last = (d.year, d.month)
+    months = month_periods(first, last)
+    print("Months: " + str(len(months[0])) + ", stations: " + str(len(stations)) + (", with day plots" if days else ""))
+
+    start = time.time()
+    backfill = Backfill(processes, force)
+    try:
+        for station_id in stations:
+            backfill_station(conn, backfill, station_id, months, days)
+    finally:
+        backfill.close()
+        conn.close()
+    print("Plot sets drawn: " + str(backfill.drawn) + ", unchanged: " + str(backfill.skipped) + \
+          ", failed: " + str(backfill.failed) + " in " + ("%.1f" % (time.time() - start)) + "s")
+
+
+# "YYYY-MM" -> (year, month)
+def parse_month(s):
+    d = datetime.datetime.strptime(s, "%Y-%m")
+    return d.year, d.month
+
+
+# Main program:
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Draw history plots of many months")
+    parser.add_argument("--start", type=parse_month, help="first month, YYYY-MM (default: first month in db)")
+    parser.add_argument("--end", type=parse_month, help="last month, YYYY-MM (default: last month in db)")
+    parser.add_argument("--days", action="store_true", help="draw plot of every day too")
+    parser.add_argument("--station", action="append", help="station id (can be repeated; default: all stations)")
+    parser.add_argument("--processes", type=int, default=plot_processes, help="processes drawing charts (default: " + str(plot_processes) + ")")
+    parser.add_argument("--force", action="store_true", help="draw all plots, also those with unchanged data")
+    args = parser.parse_args()
+
+    hist_backfill(args.start, args.end, args.days, args.station, args.processes, args.force)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Bounded queue of readings with one writer thread.
+# MQTT thread only checks the message and calls put() - writing web page, log file and db
+# is done by the writer thread, in batches. Slow SD card makes the queue longer,
+# but never stops the MQTT connection.
+#
+# When queue is full:
+# * "drop_oldest" - the oldest reading is dropped (newest readings are more useful),
+# * "block"       - put() waits until writer makes room.
+#
+# Optional tick() is called by writer thread every tick_interval seconds, also when no reading comes
+# (e.g. commit of db rows waiting too long).
+
+import collections
+import threading
+import time
+
+
+overflow_modes = ("drop_oldest", "block")
+
+
+class IngestQueue(object):
+
+    # handler(items) is called in writer thread with list of up to batch_size items
+    def __init__(self, handler, capacity=1000, overflow="drop_oldest", batch_size=50, name="ingest",
+                 tick=None, tick_interval=60):
+        if overflow not in overflow_modes:
+            raise ValueError("Unknown overflow mode: " + str(overflow))
+        self.handler = handler
+        self.capacity = capacity
+        self.overflow = overflow
+        self.batch_size = batch_size
+        self.cond = threading.Condition()
+        self.items = collections.deque() # (put time, item)
+        self.stopping = False
+        self.tick = tick
+        self.tick_interval = tick_interval
+        self.last_tick = time.time()
+
+        # Statistics
+        self.received = 0
+        self.dropped = 0
+        self.processed = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.last_latency = 0.0  # [s] from put() to the end of handler, the oldest item of last batch
+        self.max_latency = 0.0
+        self.total_latency = 0.0 # sum for all processed items
+
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    # Adds item to queue. Returns False if item was not added (queue stopped).
+    def put(self, item):
+        with self.cond:
+            if self.stopping:
+                return False
+            self.received += 1
+            if len(self.items) >= self.capacity:
+                if self.overflow == "drop_oldest":
+                    self.items.popleft()
+                    self.dropped += 1
+                else:
+                    while len(self.items) >= self.capacity and not self.stopping:
+                        self.cond.wait()
+                    if self.stopping:
+                        return False
+            self.items.append((time.time(), item))
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.cond.notify_all()
+        return True
+
+    # Seconds to the next tick (None - no tick)
+    def tick_timeout(self):
+        if self.tick is None:
+            return None
+        return max(0.0, self.last_tick + self.tick_interval - time.time())
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.items and not self.stopping:
+                    timeout = self.tick_timeout()
+                    if timeout == 0.0:
+                        break
+                    self.cond.wait(timeout)
+                if not self.items and self.stopping:
+                    return # stopping and everything is written
+                batch = []
+                while self.items and len(batch) < self.batch_size:
+                    batch.append(self.items.popleft())
+                # Room for blocked put()
+                self.cond.notify_all()
+            if batch:
+                self.write(batch)
+            if self.tick_timeout() == 0.0:
+                self.last_tick = time.time()
+                try:
+                    self.tick()
+                except Exception as e:
+                    print("Error in " + self.thread.name + " tick: " + str(e))
+
+    def write(self, batch):
+        try:
+            self.handler([item for put_time, item in batch])
+        except Exception as e:
+            print("Error in " + self.thread.name + " writer: " + str(e))
+        now = time.time()
+        with self.cond:
+            self.processed += len(batch)
+            self.batches += 1
+            self.last_latency = now - batch[0][0]
+            self.max_latency = max(self.max_latency, self.last_latency)
+            self.total_latency += sum(now - put_time for put_time, item in batch)
+
+    # Number of items waiting in queue
+    def depth(self):
+        with self.cond:
+            return len(self.items)
+
+    # Stops writer after all queued items are written (waits up to timeout seconds)
+    def stop(self, timeout=None):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def stats_str(self):
+        with self.cond:
+            avg_latency = self.total_latency / self.processed if self.processed else 0.0
+            return "depth: " + str(len(self.items)) + " (max " + str(self.max_depth) + "), " + \
+                   "received: " + str(self.received) + ", dropped: " + str(self.dropped) + ", " + \
+                   "written: " + str(self.processed) + " in " + str(self.batches) + " batches, " + \
+                   "latency: last " + ("%.3f" % self.last_latency) + "s, avg " + ("%.3f" % avg_latency) + \
+                   "s, max " + ("%.3f" % self.max_latency) + "s"
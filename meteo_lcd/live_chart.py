@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Persistent charts for update daemon (3 day plots drawn every 10 minutes).
+# Figure of each chart file is built only once - on Agg canvas directly, without pyplot global state:
+# axes, line, labels, locators and formatters.
+# Next renders only replace line data (set_data), update axis limits and aspect, and save the figure.
+#
+# Figures are kept in the process that draws them (chart pool worker), each process has its own cache.
+# Update daemon pins every chart to one worker (see plot_render.py), so each figure is kept only once.
+# Agg renderer buffer (22x22 inch at 100 dpi - about 19 MB) is dropped after saving,
+# so cached figures stay small.
+# Figure is built again after rebuild_renders renders: Matplotlib 2.x keeps dead weak references
+# in long-lived transforms (a few with every render), so memory of old figure would grow slowly.
+# Old figure is full of reference cycles (figure - canvas - axes), so it's freed by garbage collector
+# only - it's run right away, otherwise old figures pile up until the next full collection.
+
+import gc
+
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import MultipleLocator
+import matplotlib.dates
+
+
+# This keeps chart nice-looking
+ratio = 0.25
+plot_size_inches = 22
+
+# Renders of one figure before it's built again (36 - 6 hours of renders every 10 minutes;
+# with 144 memory still grew about 8 MB a day)
+rebuild_renders = 36
+
+# Cached figures in one process: file name -> LiveChart
+charts = {}
+
+
+class LiveChart(object):
+
+    def __init__(self, plot_type, ylabel, title, major_locator, minor_locator):
+        self.params = (plot_type, ylabel, title, major_locator, minor_locator)
+        self.renders = 0
+
+        self.fig = Figure(figsize=(plot_size_inches, plot_size_inches))
+        FigureCanvasAgg(self.fig)
+        ax = self.fig.add_subplot(111)
+
+        # Line without data - data comes with each render
+        self.line, = ax.plot([], [], plot_type)
+        ax.xaxis_date()
+        ax.set(xlabel='', ylabel=ylabel, title=title)
+        ax.grid()
+
+        ax.xaxis.set_major_locator(matplotlib.dates.HourLocator(byhour=None, interval=3))
+        ax.xaxis.set_minor_locator(matplotlib.dates.HourLocator())
+        ax.xaxis.set_major_formatter(matplotlib.dates.DateFormatter("%m-%d %H:%M"))
+
+        ax.yaxis.set_major_locator(MultipleLocator(major_locator))
+        ax.yaxis.set_minor_locator(MultipleLocator(minor_locator))
+        ax.tick_params(labeltop=False, labelright=True)
+        self.ax = ax
+
+    # time - Matplotlib date numbers, data - values (numpy arrays of the same length)
+    def render(self, time, data, file_name):
+        ax = self.ax
+        self.line.set_data(time, data)
+
+        # Limits as for a new figure: x - whole time range, y - autoscaled to data
+        ax.set_aspect('auto')
+        ax.set_xlim(time[0], time[-1])
+        ax.relim()
+        ax.autoscale_view(scalex=False)
+        # Date labels of new limits rotated (tick labels are created again when limits change)
+        self.fig.autofmt_xdate()
+
+        xmin, xmax = ax.get_xlim()
+        ymin, ymax = ax.get_ylim()
+        ax.set_aspect(abs((xmax-xmin)/(ymax-ymin))*ratio)
+
+        self.fig.savefig(file_name, bbox_inches='tight')
+        # Free renderer buffer - it's created again for the next render
+        self.fig.canvas.renderer = None
+        self.fig.canvas._lastKey = None
+        self.renders += 1
+
+
+# Draws chart into file_name, using cached figure of this file (created if needed)
+def render(file_name, time, data, plot_type, ylabel, title, major_locator, minor_locator):
+    params = (plot_type, ylabel, title, major_locator, minor_locator)
+    chart = charts.get(file_name)
+    if chart is None or chart.params != params or chart.renders >= rebuild_renders:
+        if chart is not None:
+            # Old figure is freed now (see the top of this file)
+            del charts[file_name]
+            del chart
+            gc.collect()
+        chart = LiveChart(*params)
+        charts[file_name] = chart
+    chart.render(time, data, file_name)
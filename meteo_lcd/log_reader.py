@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Streaming reader of meteo.log.
+# Line format (written by update_meteo.log_to_file):
+#   YYYY-MM-DDTHH:MM:SS;temp_in;humid_in;dew_in;temp_out;humid_out;dew_out;pressure
+#
+# Time in this fixed format is parsed by hand (fast path). Local time -> unix time conversion
+# (time.mktime) is done once per hour and cached. Only lines that don't match the format go to
+# dateutil parser. Lines that can't be parsed at all are counted and skipped.
+#
+# Log is written in time order, so reading the newest part doesn't need the whole file:
+# * last_records(n)          - reads blocks backwards from the end of file,
+# * records_since(time_min)  - finds first record >= time_min by binary search on file offsets.
+
+import calendar
+import time
+
+import numpy as np
+
+
+# Number of values after time in each line
+values_count = 7
+
+# Record field order
+fields = ("time", "temp_in", "humid_in", "dew_in", "temp_out", "humid_out", "dew_out", "pressure")
+
+# Size of block read from file when seeking backwards
+block_size = 64 * 1024
+# Binary search stops when searched part of file is smaller than this, the rest is read line by line
+search_min_size = 4 * 1024
+
+
+def to_str(line):
+    if isinstance(line, str):
+        return line
+    return line.decode("utf-8", "replace") # Python 3.x
+
+
+class LogReader(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.lines = 0
+        self.bad_lines = 0
+        self.slow_lines = 0
+        self.hour_cache = {}
+
+    # "YYYY-MM-DDTHH:MM:SS" -> unix time (local time, as written by log_to_file)
+    def parse_time(self, s):
+        if len(s) == 19 and s[4] == "-" and s[7] == "-" and s[10] in "T " and s[13] == ":" and s[16] == ":":
+            try:
+                hour = s[:13]
+                hour_time = self.hour_cache.get(hour)
+                if hour_time is None:
+                    hour_time = int(time.mktime((int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), 0, 0, 0, 0, -1)))
+                    self.hour_cache[hour] = hour_time
+                return hour_time + int(s[14:16]) * 60 + int(s[17:19])
+            except ValueError:
+                pass
+        return self.parse_time_slow(s)
+
+    # Any other time format - generic (slow) parser
+    def parse_time_slow(self, s):
+        import dateutil.parser
+        self.slow_lines += 1
+        d = dateutil.parser.parse(s)
+        if d.tzinfo is not None:
+            return calendar.timegm(d.utctimetuple())
+        return int(time.mktime(d.timetuple()))
+
+    # Parses one line - returns record (time, temp_in, ..., pressure) or None for bad line
+    def parse_line(self, line):
+        parts = line.split(";")
+        if len(parts) != values_count + 1:
+            return None
+        try:
+            return (self.parse_time(parts[0].strip()), ) + tuple(float(v) for v in parts[1:])
+        except Exception:
+            return None
+
+    # Yields records (time, temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure)
+    # lines - iterable of lines (default: whole log file)
+    def records(self, lines=None):
+        if lines is None:
+            with open(self.path, "rb") as lf:
+                for record in self.records(self.lines_from(lf, 0)):
+                    yield record
+            return
+        for line in lines:
+            if not line.strip():
+                continue
+            self.lines += 1
+            record = self.parse_line(line)
+            if record is None:
+                self.bad_lines += 1
+                continue
+            yield record
+
+    # Yields (offset right after the line, record) starting at given file offset.
+    # Offset can be saved and used later to continue reading (e.g. resumed import).
+    def records_with_offsets(self, offset=0):
+        with open(self.path, "rb") as lf:
+            lf.seek(offset)
+            for line in lf:
+                offset += len(line)
+                line = to_str(line)
+                if not line.strip():
+                    continue
+                self.lines += 1
+                record = self.parse_line(line)
+                if record is None:
+                    self.bad_lines += 1
+                    continue
+                yield offset, record
+
+    # Yields chunks of records as columns: (times - int64 array, values - float64 array [n, 7])
+    def columns(self, chunk_size=10000, lines=None):
+        chunk = []
+        for record in self.records(lines):
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                yield records_to_columns(chunk)
+                chunk = []
+        if chunk:
+            yield records_to_columns(chunk)
+
+    # Returns list of last n records (or less if there are bad lines among last n lines)
+    def last_records(self, n):
+        with open(self.path, "rb") as lf:
+            lf.seek(0, 2)
+            pos = lf.tell()
+            data = b""
+            # n lines need n+1 line ends (the first one closes the line we don't want)
+            while pos > 0 and data.count(b"\n") <= n:
+                step = min(block_size, pos)
+                pos -= step
+                lf.seek(pos)
+                data = lf.read(step) + data
+        lines = data.splitlines()
+        if pos > 0:
+            lines = lines[1:]
+        return list(self.records(to_str(line) for line in lines[-n:]))
+
+    # Time of the first parsable line starting at or after offset.
+    # Returns (line start offset, time), or (None, None) at end of file.
+    def probe(self, lf, offset):
+        if offset > 0:
+            # Skip rest of the line we are in (unless offset is a line start)
+            lf.seek(offset - 1)
+            lf.readline()
+        else:
+            lf.seek(0)
+        while True:
+            start = lf.tell()
+            line = lf.readline()
+            if not line:
+                return None, None
+            record = self.parse_line(to_str(line))
+            if record is not None:
+                return start, record[0]
+
+    # Offset of the line from which records have time >= time_min (binary search)
+    def offset_for_time(self, lf, time_min):
+        lf.seek(0, 2)
+        low = 0
+        high = lf.tell()
+        # low is always a line start, lines before low have time < time_min
+        while high - low > search_min_size:
+            mid = (low + high) // 2
+            start, t = self.probe(lf, mid)
+            if start is None or t >= time_min:
+                high = mid
+            else:
+                low = start
+        return low
+
+    # Lines of the log file starting from offset
+    def lines_from(self, lf, offset):
+        lf.seek(offset)
+        for line in lf:
+            yield to_str(line)
+
+    # Yields records with time >= time_min; only part of file after time_min is read
+    def records_since(self, time_min):
+        with open(self.path, "rb") as lf:
+            offset = self.offset_for_time(lf, time_min)
+            for record in self.records(self.lines_from(lf, offset)):
+                if record[0] >= time_min:
+                    yield record
+
+    # Returns (times, values) of all records with time_min <= time < time_max (None - no limit)
+    # When time_min is given, file is read from the first record >= time_min (log is in time order),
+    # and reading stops after first record >= time_max.
+    def read_range(self, time_min=None, time_max=None, lines=None):
+        if lines is None and time_min is not None:
+            with open(self.path, "rb") as lf:
+                offset = self.offset_for_time(lf, time_min)
+                return self.read_range(time_min, time_max, self.lines_from(lf, offset))
+        if lines is None:
+            with open(self.path, "rb") as lf:
+                return self.read_range(time_min, time_max, self.lines_from(lf, 0))
+
+        times = []
+        values = []
+        for chunk_times, chunk_values in self.columns(lines=lines):
+            keep = np.ones(len(chunk_times), dtype=bool)
+            if time_min is not None:
+                keep &= chunk_times >= time_min
+            if time_max is not None:
+                keep &= chunk_times < time_max
+            times.append(chunk_times[keep])
+            values.append(chunk_values[keep])
+            if time_max is not None and chunk_times[-1] >= time_max:
+                break
+        if not times:
+            return records_to_columns([])
+        return np.concatenate(times), np.concatenate(values)
+
+    def report(self):
+        print("Log " + self.path + ": " + str(self.lines) + " lines, " + str(self.bad_lines) + " bad, " + \
+              str(self.slow_lines) + " parsed by slow parser")
+
+
+def records_to_columns(records):
+    data = np.array(records, dtype=np.float64).reshape(-1, values_count + 1)
+    return data[:, 0].astype(np.int64), data[:, 1:]
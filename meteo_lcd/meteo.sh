@@ -17,6 +17,8 @@ case "$1" in
     'start')
         cd $dir
         nohup stdbuf -oL python ./update_meteo.py > nohup.out 2>&1 & echo $! > nohup.pid
+        # or asyncio version (Python 3):
+        #nohup stdbuf -oL python3 ./update_meteo_async.py > nohup.out 2>&1 & echo $! > nohup.pid
         ;;
  
     'stop')
@@ -24,8 +26,13 @@ case "$1" in
         kill $(cat nohup.pid)
         ;;
  
+    'profile')
+        # start/stop sampling profiler of update script (report is shown when it stops)
+        curl -s http://127.0.0.1:8099/profile/toggle
+        ;;
+ 
     *)
-        echo "Usage: $0 { start | stop }"
+        echo "Usage: $0 { start | stop | profile }"
         ;;
  
 esac
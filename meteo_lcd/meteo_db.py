@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Database helpers shared by update daemon and db_tools:
+# * schema migrator - brings any older meteo.db to the current schema version,
+# * hourly/daily rollup tables (min, max, avg, count of every value),
+# * many stations in one database - every row has station_id (default station is "",
+#   it is the station sending to the old "meteo" topic),
+# * long-lived database connection used by the update daemon.
+#   Keeps one sqlite3 connection open (WAL mode) and buffers inserts, so they
+#   are committed in groups (by row count or by time) instead of one fsync per reading.
+
+import datetime
+import sqlite3
+import threading
+import time
+
+# Commit timings (update daemon)
+import metrics
+
+
+# Column order used for inserts into log table
+log_columns = ("time", "temp", "humid", "dew_point", "pressure", "temp_in", "humid_in", "dew_point_in")
+
+# Values aggregated in rollup tables
+rollup_columns = log_columns[1:]
+
+# Station of rows inserted without station_id (single station setup, old data)
+default_station = ""
+
+# Default group commit limits
+default_commit_rows     = 10       # commit when this many rows are waiting
+default_commit_interval = 60 * 15  # or when oldest waiting row is older than this [s]
+# Commit waits this long [s] for write lock held by other connection (e.g. db_tools) before it fails
+busy_timeout = 30
+
+
+##############################################################################################################
+### Schema migrations
+# Each step brings database from version N-1 to version N.
+# Current version is kept in schema_version table (no table means version 0).
+
+# Version 1: original table, rows identified by id, no index on time
+def migrate_v1(c):
+    c.execute("CREATE TABLE IF NOT EXISTS log (\n\
+id INTEGER PRIMARY KEY ASC,\n\
+time INT NOT NULL,\n\
+temp REAL,\n\
+humid INT,\n\
+dew_point INT,\n\
+pressure REAL,\n\
+temp_in REAL,\n\
+humid_in INT,\n\
+dew_point_in INT)")
+
+# Version 2: table rebuilt with time as a primary key (WITHOUT ROWID),
+# so range queries and "last time" lookups use the key instead of full table scan.
+# Rows with duplicated time (e.g. log_to_db run twice) are dropped.
+def migrate_v2(c):
+    c.execute("CREATE TABLE log_v2 (\n\
+time INT PRIMARY KEY NOT NULL,\n\
+temp REAL,\n\
+humid INT,\n\
+dew_point INT,\n\
+pressure REAL,\n\
+temp_in REAL,\n\
+humid_in INT,\n\
+dew_point_in INT) WITHOUT ROWID")
+    c.execute("INSERT OR IGNORE INTO log_v2 (" + ", ".join(log_columns) + ") \
+               SELECT " + ", ".join(log_columns) + " FROM log ORDER BY time ASC, id ASC")
+    c.execute("DROP TABLE log")
+    c.execute("ALTER TABLE log_v2 RENAME TO log")
+
+# Version 3: hourly and daily rollup tables.
+# They are created again (with station_id) and filled with data already in log in version 5.
+def migrate_v3(c):
+    for table in rollup_tables:
+        create_rollup_table(c, table)
+
+# Version 4: checkpoints of log file imports (db_tools/log_to_db.py)
+# offset - position in log file after the last imported line, last_time - time of that line
+def migrate_v4(c):
+    c.execute("CREATE TABLE IF NOT EXISTS log_import (\n\
+path TEXT PRIMARY KEY NOT NULL,\n\
+offset INT NOT NULL,\n\
+last_time INT)")
+
+# Version 5: many stations - station_id added to log and rollup tables, as the first part
+# of primary key (station_id, time), so range queries of one station still use the key.
+# Existing rows belong to default station.
+def migrate_v5(c):
+    c.execute("CREATE TABLE log_v5 (\n\
+station_id TEXT NOT NULL DEFAULT '',\n\
+time INT NOT NULL,\n\
+temp REAL,\n\
+humid INT,\n\
+dew_point INT,\n\
+pressure REAL,\n\
+temp_in REAL,\n\
+humid_in INT,\n\
+dew_point_in INT,\n\
+PRIMARY KEY (station_id, time)) WITHOUT ROWID")
+    c.execute("INSERT INTO log_v5 (" + ", ".join(log_columns) + ") \
+               SELECT " + ", ".join(log_columns) + " FROM log ORDER BY time ASC")
+    c.execute("DROP TABLE log")
+    c.execute("ALTER TABLE log_v5 RENAME TO log")
+    for table in rollup_tables:
+        c.execute("DROP TABLE " + table)
+        create_rollup_table(c, table)
+    rebuild_rollups(c)
+
+migrations = [
+    migrate_v1,
+    migrate_v2,
+    migrate_v3,
+    migrate_v4,
+    migrate_v5,
+]
+
+schema_version = len(migrations)
+
+
+def get_schema_version(conn):
+    c = conn.cursor()
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='schema_version'")
+    if c.fetchone() is None:
+        return 0
+    c.execute("SELECT version FROM schema_version")
+    row = c.fetchone()
+    if row is None:
+        return 0
+    return row[0]
+
+
+# Brings database to current schema version. Every step runs in its own transaction.
+def migrate(conn):
+    version = get_schema_version(conn)
+    if version > schema_version:
+        raise Exception("Database schema version " + str(version) + " is newer than supported " + str(schema_version))
+
+    isolation_level = conn.isolation_level
+    # Explicit transactions - so DDL statements are not auto-committed in the middle of a step
+    conn.isolation_level = None
+    try:
+        while version < schema_version:
+            print("Migrating database schema: " + str(version) + " -> " + str(version + 1))
+            c = conn.cursor()
+            c.execute("BEGIN")
+            try:
+                migrations[version](c)
+                c.execute("CREATE TABLE IF NOT EXISTS schema_version (version INT NOT NULL)")
+                c.execute("DELETE FROM schema_version")
+                c.execute("INSERT INTO schema_version (version) VALUES (?)", (version + 1, ))
+                c.execute("COMMIT")
+            except Exception:
+                c.execute("ROLLBACK")
+                raise
+            version += 1
+    finally:
+        conn.isolation_level = isolation_level
+    return version
+
+
+# Creates database (if it doesn't exist) and migrates it to current schema
+def migrate_db(path):
+    conn = sqlite3.connect(path)
+    try:
+        version = migrate(conn)
+    finally:
+        conn.close()
+    print("Database schema version: " + str(version))
+
+
+##############################################################################################################
+### Rollups
+# log_hourly and log_daily keep for each station and hour/day (time - start of period, unix time):
+# number of readings (count) and <column>_min, <column>_max, <column>_avg for every value.
+# Hours start at full hour, days start at local midnight.
+
+def hour_start(t):
+    return t - t % 3600
+
+def day_start(t):
+    return int(time.mktime(datetime.date.fromtimestamp(t).timetuple()))
+
+# Table name -> (function giving period start in Python, the same in SQL)
+rollup_tables = {
+    "log_hourly": (hour_start, "time - time % 3600"),
+    "log_daily":  (day_start,  "CAST(strftime('%s', date(time, 'unixepoch', 'localtime'), 'utc') AS INT)"),
+}
+
+
+def create_rollup_table(c, table):
+    fields = ["station_id TEXT NOT NULL DEFAULT ''", "time INT NOT NULL", "count INT NOT NULL"]
+    for col in rollup_columns:
+        fields += [col + "_min REAL", col + "_max REAL", col + "_avg REAL"]
+    fields += ["PRIMARY KEY (station_id, time)"]
+    c.execute("CREATE TABLE IF NOT EXISTS " + table + " (" + ", ".join(fields) + ") WITHOUT ROWID")
+
+
+# Recalculates rollups from log table (all of them, or only periods from time_min and/or up to time_max,
+# i.e. periods having any reading of time_min - time_max) for all stations or for station_id only
+def rebuild_rollups(c, time_min=None, time_max=None, station_id=None):
+    for table, (py_start, sql_start) in sorted(rollup_tables.items()):
+        where = []
+        params = []
+        log_where = []
+        log_params = []
+        if station_id is not None:
+            where.append("station_id = ?")
+            params.append(station_id)
+        if time_min is not None:
+            where.append("time >= ?")
+            params.append(py_start(time_min))
+        log_where += where
+        log_params += params
+        if time_max is not None:
+            where.append("time <= ?")
+            params.append(py_start(time_max))
+            # Period is never longer than 25 hours (day with DST change)
+            log_where += ["time < ?", sql_start + " <= ?"]
+            log_params += [py_start(time_max) + 25 * 3600, py_start(time_max)]
+        c.execute("DELETE FROM " + table + (" WHERE " + " AND ".join(where) if where else ""), params)
+        fields = ["station_id", "time", "count"]
+        values = ["station_id", sql_start + " AS period", "COUNT(*)"]
+        for col in rollup_columns:
+            fields += [col + "_min", col + "_max", col + "_avg"]
+            values += ["MIN(" + col + ")", "MAX(" + col + ")", "AVG(" + col + ")"]
+        c.execute("INSERT INTO " + table + " (" + ", ".join(fields) + ") \
+                   SELECT " + ", ".join(values) + " FROM log" + (" WHERE " + " AND ".join(log_where) if log_where else "") + \
+                  " GROUP BY station_id, period", log_params)
+
+
+# Adds one log row (in log_columns order) of a station to rollups - used on every insert
+def update_rollups(c, row, station_id=default_station):
+    t = row[0]
+    values = row[1:]
+    for table, (py_start, sql_start) in rollup_tables.items():
+        period = py_start(t)
+        # New period starts with count 0 - update below sets all aggregates
+        fields = ["station_id", "time", "count"]
+        for col in rollup_columns:
+            fields += [col + "_min", col + "_max", col + "_avg"]
+        init = [station_id, period, 0]
+        for v in values:
+            init += [v, v, v]
+        c.execute("INSERT OR IGNORE INTO " + table + " (" + ", ".join(fields) + ") \
+                   VALUES (" + ", ".join("?" * len(fields)) + ")", init)
+        sets = ["count = count + 1"]
+        params = []
+        for col, v in zip(rollup_columns, values):
+            sets += [col + "_min = MIN(" + col + "_min, ?)",
+                     col + "_max = MAX(" + col + "_max, ?)",
+                     col + "_avg = " + col + "_avg + (? - " + col + "_avg) / (count + 1)"]
+            params += [v, v, v]
+        c.execute("UPDATE " + table + " SET " + ", ".join(sets) + " WHERE station_id = ? AND time = ?", params + [station_id, period])
+
+
+# Returns rows (time, count, <column>_<aggregate>, ...) from rollup table with time_min <= time < time_max.
+# aggregates - list of names, e.g. ["temp_avg", "temp_min", "pressure_avg"]
+def select_rollup(conn, table, time_min, time_max, aggregates, station_id=default_station):
+    if table not in rollup_tables:
+        raise Exception("Unknown rollup table: " + table)
+    for name in aggregates:
+        col, agg = name.rsplit("_", 1)
+        if col not in rollup_columns or agg not in ("min", "max", "avg"):
+            raise Exception("Unknown rollup column: " + name)
+    c = conn.cursor()
+    c.execute("SELECT " + ", ".join(["time", "count"] + list(aggregates)) + " FROM " + table + \
+              " WHERE station_id = ? AND time >= ? AND time < ? ORDER BY time ASC", (station_id, time_min, time_max))
+    return c.fetchall()
+
+
+# Returns sorted list of stations having any data (read from small daily rollup table)
+def get_stations(conn):
+    c = conn.cursor()
+    c.execute("SELECT DISTINCT station_id FROM log_daily ORDER BY station_id")
+    return [row[0] for row in c.fetchall()]
+
+
+##############################################################################################################
+### Connection used by update daemon
+
+class MeteoDB(object):
+
+    def __init__(self, path, commit_rows=default_commit_rows, commit_interval=default_commit_interval):
+        self.path = path
+        self.commit_rows = commit_rows
+        self.commit_interval = commit_interval
+
+        # Connection is shared between MQTT thread and helper threads - all access goes through the lock
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL is still safe against corruption, and saves fsync on every commit
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+        # Write buffer - rows waiting for commit
+        self.pending = []
+        self.pending_since = None
+
+        # Statistics
+        self.start_time = time.time()
+        self.rows_written = 0
+        self.commits = 0
+
+    # Put a row into write buffer; commits if buffer is full or too old
+    # row - tuple of values in log_columns order
+    def insert(self, row, station_id=default_station):
+        with self.lock:
+            if not self.pending:
+                self.pending_since = time.time()
+            self.pending.append((station_id, tuple(row)))
+            self.flush_if_due()
+
+    # Commits buffered rows if row count or time limit is reached
+    def flush_if_due(self):
+        with self.lock:
+            if not self.pending:
+                return
+            if len(self.pending) >= self.commit_rows or time.time() - self.pending_since >= self.commit_interval:
+                self.flush()
+
+    # Commits all buffered rows in one transaction
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            rows = self.pending
+            start = time.time()
+            inserted = 0
+            try:
+                c = self.conn.cursor()
+                for station_id, row in rows:
+                    c.execute("INSERT OR IGNORE INTO log (station_id, " + ", ".join(log_columns) + ") \
+                               VALUES (" + ", ".join("?" * (len(log_columns) + 1)) + ")", (station_id, ) + row)
+                    # Rollups are updated in the same transaction, only for rows really inserted
+                    if c.rowcount == 1:
+                        inserted += 1
+                        update_rollups(c, row, station_id)
+                self.conn.commit()
+            except Exception as e:
+                # Rows stay in write buffer - next flush tries again
+                self.conn.rollback()
+                print("Error while insert log to database: " + str(e) + " (" + str(len(rows)) + " rows kept for next commit)")
+                return
+            self.pending = []
+            self.pending_since = None
+            metrics.observe("db_commit", time.time() - start)
+            # Rows ignored as duplicates (the same station and time) are not counted
+            self.rows_written += inserted
+            self.commits += 1
+            print("DB commit: " + str(inserted) + " rows, " + str(len(rows) - inserted) + " duplicates (" + \
+                  self.stats_str() + ")")
+
+    # Returns rows (time, temp, humid, dew_point, pressure) of a station with time_min <= time < time_max.
+    # Rows still waiting in write buffer are included too.
+    def select_range(self, time_min, time_max, station_id=default_station):
+        with self.lock:
+            c = self.conn.cursor()
+            c.execute("SELECT time, temp, humid, dew_point, pressure FROM log WHERE station_id = ? AND time >= ? AND time < ? ORDER BY time ASC",
+                      (station_id, time_min, time_max))
+            rows = c.fetchall()
+            rows.extend(row[:5] for station, row in self.pending if station == station_id and time_min <= row[0] < time_max)
+        return rows
+
+    # Returns rows of rollup table (see select_rollup above). Rows still waiting in write buffer are not included.
+    def select_rollup(self, table, time_min, time_max, aggregates, station_id=default_station):
+        with self.lock:
+            return select_rollup(self.conn, table, time_min, time_max, aggregates, station_id)
+
+    # Returns time of the newest row of a station (int, unix time) or None if there is no data
+    def last_time(self, station_id=default_station):
+        with self.lock:
+            for station, row in reversed(self.pending):
+                if station == station_id:
+                    return row[0]
+            c = self.conn.cursor()
+            c.execute("SELECT time FROM log WHERE station_id = ? ORDER BY time DESC LIMIT 1", (station_id, ))
+            row = c.fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    # Returns (commits per second, rows per second) since start
+    def stats(self):
+        elapsed = max(time.time() - self.start_time, 1e-6)
+        return self.commits / elapsed, self.rows_written / elapsed
+
+    def stats_str(self):
+        commits_per_s, rows_per_s = self.stats()
+        return "commits: " + str(self.commits) + " (" + ("%.5f" % commits_per_s) + "/s), " + \
+               "rows: " + str(self.rows_written) + " (" + ("%.5f" % rows_per_s) + "/s)"
+
+    # Returns list of stations having any data
+    def stations(self):
+        with self.lock:
+            stations = set(get_stations(self.conn))
+            stations.update(station for station, row in self.pending)
+        return sorted(stations)
+
+    # Flushes write buffer and closes connection - call it on shutdown
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.conn.close()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Simple html template used for meteo.html.
+# Values in template are marked with comments, e.g.:
+#   <!-- TEMP_OUT -->23.5<!-- /TEMP_OUT -->
+# Template file is parsed once (and again only when its mtime changes) into a list of
+# static byte chunks and slots. Rendering is a single join of these chunks.
+
+import os
+import re
+import tempfile
+
+
+slot_regexp = re.compile(br"<!-- ([A-Z_]+) -->.*?<!-- /\1 -->", re.DOTALL)
+
+
+def to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    if not isinstance(value, type(u"")):
+        value = str(value)
+        if isinstance(value, bytes): # Python 2.x
+            return value
+    return value.encode("utf-8")
+
+
+class HtmlTemplate(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.chunks = []  # static chunks and placeholders (None) for values
+        self.slots = {}   # slot name -> list of indexes in chunks
+        self.load()
+
+    # Parse template file into chunks
+    def load(self):
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, "rb") as f:
+            data = f.read()
+
+        chunks = []
+        slots = {}
+        pos = 0
+        for m in slot_regexp.finditer(data):
+            name = m.group(1).decode("ascii")
+            chunks.append(data[pos:m.start()] + b"<!-- " + m.group(1) + b" -->")
+            slots.setdefault(name, []).append(len(chunks))
+            chunks.append(None)
+            chunks.append(b"<!-- /" + m.group(1) + b" -->")
+            pos = m.end()
+        chunks.append(data[pos:])
+
+        self.chunks = chunks
+        self.slots = slots
+        self.mtime = mtime
+
+    # Parse template again if file was changed
+    def reload_if_changed(self):
+        try:
+            if os.stat(self.path).st_mtime != self.mtime:
+                print("Template changed, reloading: " + self.path)
+                self.load()
+        except OSError as e:
+            print("Cannot check template file: " + str(e))
+
+    # Returns page (bytes) with slots filled with values from dict (slot name -> value).
+    # Slots without value are left empty.
+    def render(self, values):
+        chunks = list(self.chunks)
+        for name, indexes in self.slots.items():
+            value = to_bytes(values.get(name, b""))
+            for i in indexes:
+                chunks[i] = value
+        return b"".join(chunks)
+
+    # Renders page and atomically replaces file under path with it
+    # (web server never sees a missing or half-written file)
+    def write(self, path, values):
+        self.reload_if_changed()
+        page = self.render(values)
+        dir_name = os.path.dirname(path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix=".meteo_", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(page)
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Lightweight instrumentation of update daemon.
+# * Metrics     - timings of hot paths (parse, web page, log append, db insert/commit, charts):
+#                 count, total, last, max and p50/p95 of recent values,
+# * MetricsServer - HTTP server on localhost:
+#                 /metrics       - Prometheus text format,
+#                 /status.json   - metrics and daemon status as JSON,
+#                 /profile       - sampling profiler report; /profile/start, /profile/stop, /profile/toggle,
+# * StatusWriter  - writes status.json file periodically (atomic replace, like web page),
+# * SamplingProfiler - thread that looks at stacks of other threads every few ms and counts functions.
+#                 It can be started and stopped at runtime (HTTP), no restart needed.
+#                 Charts drawn by chart pool processes are not seen - use plot_processes = 1 to profile them.
+#
+# Timing is done with module level registry:
+#   with metrics.timer("log_append"):
+#       ...
+#   metrics.observe("chart_temperature", seconds)
+
+import collections
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer # Python 2.x
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer # Python 3.x
+    from socketserver import ThreadingMixIn
+
+
+# Percentiles are computed from this many newest values of each metric
+recent_values = 1000
+# Prefix of Prometheus metric names
+prometheus_prefix = "meteo_"
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+class Metric(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+        self.recent = collections.deque(maxlen=recent_values)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.last = value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def snapshot(self):
+        values = sorted(self.recent)
+        return {
+            "count": self.count,
+            "total": self.total,
+            "last": self.last,
+            "max": self.max,
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+        }
+
+
+class Timer(object):
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.observe(self.name, time.time() - self.start)
+
+
+# Metrics by name; used from many threads
+class Metrics(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = collections.OrderedDict()
+        self.start_time = time.time()
+
+    def observe(self, name, value):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = Metric(name)
+                self.metrics[name] = metric
+            metric.observe(value)
+
+    def timer(self, name):
+        return Timer(self, name)
+
+    # Returns dict: name -> {count, total, last, max, p50, p95} (times in seconds)
+    def snapshot(self):
+        with self.lock:
+            return collections.OrderedDict((name, metric.snapshot()) for name, metric in self.metrics.items())
+
+    def reset(self):
+        with self.lock:
+            self.metrics.clear()
+            self.start_time = time.time()
+
+
+# Registry used by daemon modules
+registry = Metrics()
+
+def observe(name, value):
+    registry.observe(name, value)
+
+def timer(name):
+    return registry.timer(name)
+
+
+# Metric name -> Prometheus name (only [a-zA-Z0-9_] allowed)
+def prometheus_name(name):
+    return prometheus_prefix + "".join(c if c.isalnum() else "_" for c in name)
+
+
+# Prometheus text format: each timing metric as summary (seconds), gauges - numeric values
+def prometheus_text(snapshot, gauges):
+    lines = []
+    for name, m in snapshot.items():
+        metric = prometheus_name(name) + "_seconds"
+        lines.append("# TYPE " + metric + " summary")
+        lines.append(metric + "{quantile=\"0.5\"} " + repr(m["p50"]))
+        lines.append(metric + "{quantile=\"0.95\"} " + repr(m["p95"]))
+        lines.append(metric + "_sum " + repr(m["total"]))
+        lines.append(metric + "_count " + str(m["count"]))
+        lines.append("# TYPE " + metric + "_max gauge")
+        lines.append(metric + "_max " + repr(m["max"]))
+        lines.append("# TYPE " + metric + "_last gauge")
+        lines.append(metric + "_last " + repr(m["last"]))
+    for name, value in sorted(gauges.items()):
+        metric = prometheus_name(name)
+        lines.append("# TYPE " + metric + " gauge")
+        lines.append(metric + " " + repr(float(value)))
+    return "\n".join(lines) + "\n"
+
+
+# Writes text to file atomically (readers never see a half-written file)
+def write_file(path, text):
+    dir_name = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix=".status_", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+##############################################################################################################
+### Sampling profiler
+
+class SamplingProfiler(object):
+
+    # interval - time between samples [s]; depth - number of stack frames kept in each sample
+    def __init__(self, interval=0.005, depth=8):
+        self.interval = interval
+        self.depth = depth
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.samples = 0
+            self.functions = collections.Counter() # function -> samples where it is on top of stack
+            self.cumulative = collections.Counter() # function -> samples where it is anywhere in stack
+            self.stacks = collections.Counter()     # (thread, stack) -> samples
+            self.started = time.time() if self.running else None
+            self.elapsed = 0.0
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return False
+            self.running = True
+            self.started = time.time()
+            self.thread = threading.Thread(target=self.run, name="profiler")
+            self.thread.daemon = True
+            self.thread.start()
+        return True
+
+    def stop(self):
+        with self.lock:
+            if not self.running:
+                return False
+            self.running = False
+            thread = self.thread
+        thread.join()
+        with self.lock:
+            self.elapsed += time.time() - self.started
+            self.started = None
+        return True
+
+    # Starts profiler if it's stopped, stops it otherwise. Returns True if it's running now.
+    # Report is printed when profiler stops.
+    def toggle(self):
+        if self.running:
+            self.stop()
+            print("Profiler stopped\n" + self.report())
+            return False
+        self.reset()
+        self.start()
+        print("Profiler started")
+        return True
+
+    def run(self):
+        own_id = threading.current_thread().ident
+        while self.running:
+            names = dict((t.ident, t.name) for t in threading.enumerate())
+            frames = sys._current_frames()
+            with self.lock:
+                self.samples += 1
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < self.depth:
+                        code = frame.f_code
+                        stack.append((os.path.basename(code.co_filename), frame.f_lineno, code.co_name))
+                        frame = frame.f_back
+                    if not stack:
+                        continue
+                    # Functions are counted without line numbers
+                    self.functions[stack[0][0] + " " + stack[0][2]] += 1
+                    for function in set(f + " " + name for f, line, name in stack):
+                        self.cumulative[function] += 1
+                    self.stacks[(names.get(thread_id, str(thread_id)), tuple(stack))] += 1
+            del frames
+            time.sleep(self.interval)
+
+    # Text report: top functions (self and cumulative) and top stacks, in % of samples.
+    # Every thread is counted in each sample, so with many threads sum is more than 100%.
+    # Idle threads (waiting for lock, socket, sleep) are counted too - they show where threads wait.
+    def report(self, top=20):
+        with self.lock:
+            elapsed = self.elapsed
+            if self.started is not None:
+                elapsed += time.time() - self.started
+            lines = ["Profiler: " + ("running" if self.running else "stopped") + ", " + str(self.samples) + " samples in " + \
+                     ("%.1f" % elapsed) + "s (every " + str(self.interval * 1000) + "ms)"]
+            samples = max(self.samples, 1)
+            lines.append("")
+            lines.append("Top functions (self):")
+            for function, count in self.functions.most_common(top):
+                lines.append("  " + ("%5.1f%%" % (100.0 * count / samples)) + "  " + function)
+            lines.append("")
+            lines.append("Top functions (cumulative):")
+            for function, count in self.cumulative.most_common(top):
+                lines.append("  " + ("%5.1f%%" % (100.0 * count / samples)) + "  " + function)
+            lines.append("")
+            lines.append("Top stacks:")
+            for (thread, stack), count in self.stacks.most_common(top // 2):
+                lines.append("  " + ("%5.1f%%" % (100.0 * count / samples)) + "  thread " + thread)
+                for f, line, name in stack:
+                    lines.append("           " + f + ":" + str(line) + " " + name)
+        return "\n".join(lines) + "\n"
+
+
+##############################################################################################################
+### Status file and HTTP endpoint
+
+# Periodically writes status_func() result to JSON file
+class StatusWriter(object):
+
+    def __init__(self, path, status_func, interval=60):
+        self.path = path
+        self.status_func = status_func
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="status")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def write(self):
+        try:
+            write_file(self.path, json.dumps(self.status_func(), indent=2))
+        except Exception as e:
+            print("Error while writing status file: " + str(e))
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.write()
+            self.stopping.wait(self.interval)
+
+    # Stops writer; status is written once more (final values)
+    def stop(self):
+        self.stopping.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        self.write()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        try:
+            if path == "/metrics":
+                status = server.status_func()
+                self.reply(200, "text/plain; version=0.0.4", prometheus_text(status["metrics"], status.get("gauges", {})))
+            elif path in ("/", "/status.json"):
+                self.reply(200, "application/json", json.dumps(server.status_func(), indent=2))
+            elif path == "/profile":
+                self.reply(200, "text/plain", server.profiler.report())
+            elif path == "/profile/start":
+                server.profiler.reset()
+                server.profiler.start()
+                self.reply(200, "text/plain", "Profiler started\n")
+            elif path == "/profile/stop":
+                server.profiler.stop()
+                self.reply(200, "text/plain", server.profiler.report())
+            elif path == "/profile/toggle":
+                if server.profiler.toggle():
+                    self.reply(200, "text/plain", "Profiler started\n")
+                else:
+                    self.reply(200, "text/plain", server.profiler.report())
+            else:
+                self.reply(404, "text/plain", "Not found\n")
+        except Exception:
+            self.reply(500, "text/plain", traceback.format_exc())
+
+    def reply(self, code, content_type, text):
+        body = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # No access log in nohup.out
+    def log_message(self, format, *args):
+        pass
+
+
+# HTTP endpoint in background thread.
+# status_func() must return dict with "metrics" (Metrics.snapshot()) and optionally "gauges" (name -> number)
+class MetricsServer(object):
+
+    def __init__(self, port, status_func, profiler, host="127.0.0.1"):
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.status_func = status_func
+        self.server.profiler = profiler
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # Closes listening socket in forked process (server keeps running in parent process)
+    def close_inherited(self):
+        self.server.socket.close()
@@ -12,11 +12,27 @@ import dateutil.parser
 import datetime # datetime and timedelta structures
 import time
 import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MultipleLocator
+import numpy as np
+
+# Drawing charts in parallel (pool of processes)
+from plot_render import ChartJob, ChartPool, rows_to_columns
+# Reading meteo.log
+from log_reader import LogReader
+# Reading binary log
+from binary_log import BinaryLog
+# Unix times -> Matplotlib date numbers
+from time_axis import epoch_to_num
+# Reducing number of points before drawing
+from downsample import downsample
 
 # Sqlite3 database
 import sqlite3
+from meteo_db import select_rollup, get_stations, default_station
+# Files of many stations
+from stations import station_file
 
 
 # choose working dir
@@ -27,12 +43,31 @@ hist_dir    = working_dir + "hist/"
 log_file_path = working_dir + "meteo.log"
 db_path       = data_dir + "meteo.db"
 
+# Read binary log (meteo.bin, see binary_log.py) instead of meteo.log in draw_plot_month
+use_binary_log       = False
+binary_log_file_path = working_dir + "meteo.bin"
+
 # Diagiam file names
 temp_out_diagram_file      = "temp_out.png"
 humid_out_diagram_file     = "humid_out.png"
 dew_point_out_diagram_file = "dew_out.png"
 pressure_diagram_file      = "pressure.png"
 
+# Number of processes drawing charts (1 - draw in this process)
+plot_processes = 4
+# Chart is not drawn again if its data and settings are the same as of the file already drawn
+# (digest kept next to each chart file, see render_cache.py)
+plot_cache = True
+
+# Draw month plot from hourly averages (log_hourly table, ~750 rows) instead of all readings (~15000 rows).
+# Off: averages flatten daily peaks, which downsampling of all readings (below) keeps.
+use_hourly_rollup = False
+
+# Before drawing, each series is reduced to about chart width in pixels (40 inches * 100 dpi).
+# Method: "minmax" (min and max of each bucket), "lttb" (Largest-Triangle-Three-Buckets) or None (all points)
+plot_downsample_method = "lttb"
+plot_max_points        = 4000
+
 
 # Converts a string back the datetime structure
 def getDateTimeFromISO8601String(s):
@@ -40,7 +75,16 @@ def getDateTimeFromISO8601String(s):
     return d
 
 
-def get_val_month_db(month, year):
+# Stations having data in db
+def get_stations_db():
+    conn = sqlite3.connect(db_path)
+    try:
+        return get_stations(conn)
+    finally:
+        conn.close()
+
+
+def get_val_month_db(month, year, station_id=default_station):
 
     if month < 1 or month > 12:
         return;
@@ -64,14 +108,26 @@ def get_val_month_db(month, year):
     int_time_min = int (time.mktime(getDateTimeFromISO8601String(str_time_min).timetuple()))
     int_time_max = int (time.mktime(getDateTimeFromISO8601String(str_time_max).timetuple()))
 
-    try:
-        c.execute("SELECT time, temp, humid, dew_point, pressure FROM log WHERE time >= ? AND time < ?", (int_time_min, int_time_max))
-        rows = c.fetchall()
-#        for row in rows:
-#            print(row)
-
-    except Exception as e:
-        print("Error while get_val_month from db: " + str(e))
+    rows = None
+    if use_hourly_rollup:
+        try:
+            # Hourly averages, shown in the middle of each hour
+            rows = select_rollup(conn, "log_hourly", int_time_min, int_time_max,
+                                 ["temp_avg", "humid_avg", "dew_point_avg", "pressure_avg"], station_id)
+            rows = [(row[0] + 1800, ) + tuple(row[2:]) for row in rows]
+        except Exception as e:
+            print("Cannot read hourly rollups, using raw data: " + str(e))
+            rows = None
+
+    if rows is None:
+        try:
+            c.execute("SELECT time, temp, humid, dew_point, pressure FROM log WHERE station_id = ? AND time >= ? AND time < ?", (station_id, int_time_min, int_time_max))
+            rows = c.fetchall()
+#            for row in rows:
+#                print(row)
+
+        except Exception as e:
+            print("Error while get_val_month from db: " + str(e))
 
     conn.close()
     return rows
@@ -79,8 +135,19 @@ def get_val_month_db(month, year):
 
 
 
+# Chart file in hist dir: yyyy.mm.dataName.png
+def hist_file(date, file_name):
+    return hist_dir + str(date.year) + "." + str(date.month) + "." + file_name
+
+
 def plot_set_ax_fig (date, time, data, data_len, plot_type, ylabel, title, major_locator, minor_locator, file_name):
 
+    # time comes as array of unix times - convert it to Matplotlib dates (local time) at once
+    time = epoch_to_num(time)
+    # Reduce number of points to about chart width (peaks are kept)
+    time, data = downsample(time, data, plot_max_points, plot_downsample_method)
+    data_len = len(time) - 1
+
     # This keeps chart nice-looking
     ratio = 0.20
     plot_size_inches = 40
@@ -110,21 +177,34 @@ def plot_set_ax_fig (date, time, data, data_len, plot_type, ylabel, title, major
     #print((xmax-xmin)/(ymax-ymin))
     ax.set_aspect(abs((xmax-xmin)/(ymax-ymin))*ratio) #, adjustable='box-forced')
 
-    fig.savefig(hist_dir + str(date.year) + "." + str(date.month) + "." + file_name, bbox_inches='tight')
+    fig.savefig(hist_file(date, file_name), bbox_inches='tight')
     plt.close()
 
-# Draw a plot
-def draw_plot_month():
-    # Open log file
-    lf = open(log_file_path, "r");
-    # Calculates number lines in log file
-    num_lines = sum(1 for line in lf)
-    lf.seek(0)
+# Chart jobs of a month for outside values of a station: temperature, humidity, dew piont, pressure.
+# t - numpy array of unix times, t_out, h_out, d_out, p_out - numpy arrays with values
+# name_prefix is added to job names (hist_backfill.py draws many months at once)
+def chart_jobs(date, t, t_out, h_out, d_out, p_out, station_id=default_station, name_prefix=""):
+    values_count = len(t)
+    return [
+        ChartJob(name_prefix + "temperature", plot_set_ax_fig, date, t, t_out, values_count-1, 'r-', 'Temperatura [C]', 'Wykres temperatury zewnetrznej', 1, 0.5, station_file(temp_out_diagram_file, station_id), output=hist_file(date, station_file(temp_out_diagram_file, station_id))),
+        ChartJob(name_prefix + "humidity",    plot_set_ax_fig, date, t, h_out, values_count-1, 'g-', 'Wilgotnosc wzgledna [%]', 'Wykres wilgotnosci wzglednej', 5, 1, station_file(humid_out_diagram_file, station_id), output=hist_file(date, station_file(humid_out_diagram_file, station_id))),
+        ChartJob(name_prefix + "dew point",   plot_set_ax_fig, date, t, d_out, values_count-1, 'b-', 'Temp. punktu rosy [C]', 'Wykres temperatury punktu rosy', 1, 1, station_file(dew_point_out_diagram_file, station_id), output=hist_file(date, station_file(dew_point_out_diagram_file, station_id))),
+        ChartJob(name_prefix + "pressure",    plot_set_ax_fig, date, t, p_out, values_count-1, 'm-', 'Cisnienie atm. [hPa]', 'Wykres cisnienia atmosferycznego', 2, 1, station_file(pressure_diagram_file, station_id), output=hist_file(date, station_file(pressure_diagram_file, station_id))),
+    ]
+
+# Draws plots for outside values of a station: temperature, humidity, dew piont, pressure
+# Each plot is drawn by separate process.
+# t - numpy array of unix times, t_out, h_out, d_out, p_out - numpy arrays with values
+def draw_plots(date, t, t_out, h_out, d_out, p_out, station_id=default_station):
+    chart_pool = ChartPool(plot_processes, plot_cache, (plot_downsample_method, plot_max_points))
+    try:
+        chart_pool.render(chart_jobs(date, t, t_out, h_out, d_out, p_out, station_id))
+    finally:
+        chart_pool.close()
 
-    # This keeps chart nice-looking
-    ratio = 0.25
-    plot_size_inches = 28
 
+# Draw a plot
+def draw_plot_month():
     # Today
     today = datetime.datetime.today()
     if today.month == 1:
@@ -133,70 +213,18 @@ def draw_plot_month():
         plot_date_begin = datetime.datetime(today.year, today.month-1, 1)
     plot_date_end   = datetime.datetime(today.year, today.month, 1)
 
-    # Helpers
-    j = 0
-    values_count = 0
-    lines_to_skip = num_lines - 25000
-    # This much entries should be more than one month (31 days)
-    # This will cause that generating plot will take less time
-    if lines_to_skip < 0:
-        lines_to_skip = 0;
-
-    # Use every x (e.g. every second, or every third) value - this makes chart more 'smooth'
-    every_x = 1;
-
-    t = []; # time axis for plot
-    t_out = []; # temp out for plot
-    h_out = []; # humid out for plot
-    d_out = []; # dew point for plot
-    p_out = []; # pressure for plot
-    # From each line of log file create a pairs of meteo data (time, value)
-    for line in lf:
-        if lines_to_skip > 0:
-            lines_to_skip -= 1
-            continue
-        j += 1
-        if j >= every_x:
-            j = 0
-        else:
-            continue
-        # Parse line
-        time, temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure = str(line).split(";")
-        time = getDateTimeFromISO8601String(time)
-        if time < plot_date_begin:
-            continue
-        if time > plot_date_end:
-            continue
-        values_count += 1
-        # Append time for time axis
-        t.append(time)
-        # Append meteo data for their axis
-        t_out.append(float(temp_out))
-        h_out.append(float(humid_out))
-        d_out.append(float(dew_out))
-        p_out.append(float(pressure))
-
-    lf.close()
-
-    # draw plots for outside values: temperature, humidity, dew piont, pressure
-
-
-    ##############
-    # Temperature
-    plot_set_ax_fig(today, t, t_out, values_count-1, 'r-', 'Temperatura [C]', 'Wykres temperatury zewnetrznej', 1, 0.5, temp_out_diagram_file)
-
-    ##############
-    # Humidity
-    plot_set_ax_fig(today, t, h_out, values_count-1, 'g-', 'Wilgotnosc wzgledna [%]', 'Wykres wilgotnosci wzglednej', 5, 1, humid_out_diagram_file)
-
-    ##############
-    # Dew point
-    plot_set_ax_fig(today, t, d_out, values_count-1, 'b-', 'Temp. punktu rosy [C]', 'Wykres temperatury punktu rosy', 1, 1, dew_point_out_diagram_file)
-
-    ##############
-    # Pressure
-    plot_set_ax_fig(today, t, p_out, values_count-1, 'm-', 'Cisnienie atm. [hPa]', 'Wykres cisnienia atmosferycznego', 2, 1, pressure_diagram_file)
+    # Read records from previous month
+    int_time_min = int(time.mktime(plot_date_begin.timetuple()))
+    int_time_max = int(time.mktime(plot_date_end.timetuple())) + 1
+    if use_binary_log:
+        t, values = BinaryLog(binary_log_file_path).read_range(int_time_min, int_time_max)
+    else:
+        reader = LogReader(log_file_path)
+        t, values = reader.read_range(int_time_min, int_time_max)
+        reader.report()
 
+    # Values columns: temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure
+    draw_plots(today, t, values[:, 3], values[:, 4], values[:, 5], values[:, 6])
     return
 
 
@@ -210,48 +238,22 @@ def draw_plot_month_db():
     else:
         plot_date_begin = datetime.datetime(today.year, today.month-1, 1)
 
-    t = []; # time axis for plot
-    t_out = []; # temp out for plot
-    h_out = []; # humid out for plot
-    d_out = []; # dew point for plot
-    p_out = []; # pressure for plot
-
-    rows = get_val_month_db(plot_date_begin.month, plot_date_begin.year)  # month, and year
-    # From each row creates a pairs of meteo data (time, value)
-
-    values_count = len(rows)
-    # Row format: (time, temp, humid, dew_point, pressure)
-    for row in rows:
-        # Append time for time axis
-        t.append(datetime.datetime.fromtimestamp(row[0]))
-        # Append meteo data for their axis
-        t_out.append(row[1])
-        h_out.append(row[2])
-        d_out.append(row[3])
-        p_out.append(row[4])
-
-    # draw plots for outside values: temperature, humidity, dew piont, pressure
-
-    ##############
-    # Temperature
-    plot_set_ax_fig(plot_date_begin, t, t_out, values_count-1, 'r-', 'Temperatura [C]', 'Wykres temperatury zewnetrznej', 1, 0.5, temp_out_diagram_file)
-    
-    ##############
-    # Humidity
-    plot_set_ax_fig(plot_date_begin, t, h_out, values_count-1, 'g-', 'Wilgotnosc wzgledna [%]', 'Wykres wilgotnosci wzglednej', 5, 1, humid_out_diagram_file)
-
-    ##############
-    # Dew point
-    plot_set_ax_fig(plot_date_begin, t, d_out, values_count-1, 'b-', 'Temp. punktu rosy [C]', 'Wykres temperatury punktu rosy', 1, 1, dew_point_out_diagram_file)
-
-    ##############
-    # Pressure
-    plot_set_ax_fig(plot_date_begin, t, p_out, values_count-1, 'm-', 'Cisnienie atm. [hPa]', 'Wykres cisnienia atmosferycznego', 2, 1, pressure_diagram_file)
+    # Plots for every station
+    for station_id in get_stations_db():
+        rows = get_val_month_db(plot_date_begin.month, plot_date_begin.year, station_id)  # month, and year
+        if not rows:
+            print("No data of station " + (station_id or "default") + " - no plots")
+            continue
+        # Row format: (time, temp, humid, dew_point, pressure)
+        t, (t_out, h_out, d_out, p_out) = rows_to_columns(rows, 4)
+
+        draw_plots(plot_date_begin, t, t_out, h_out, d_out, p_out, station_id)
 
     return
 
 
 
-# Main program:
-draw_plot_month_db();
-#draw_plot_month();
+# Main program (only when started as a script - benchmarks import this module):
+if __name__ == "__main__":
+    draw_plot_month_db();
+    #draw_plot_month();
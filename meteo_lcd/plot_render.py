@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Drawing many charts at once using a pool of processes.
+# Each chart (temperature, humidity, dew point, pressure) is a separate job.
+# Job gets only data it needs: time column and one value column as numpy arrays
+# (much smaller to send to other process than lists of datetime objects).
+# Pool can skip charts which would be the same as already drawn files (see render_cache.py).
+# Pinned pool draws every chart (output file) always in the same worker process - needed when workers
+# keep state of charts between renders (figures of live_chart.py): otherwise every worker would
+# build and keep a figure of every chart. Pinned pool is a set of one-process pools, a chart is given
+# to worker when it's seen first time (in turn, so charts are spread evenly).
+#
+# Workers are moved out of process group of the daemon: signal sent to the whole group (Ctrl-C, timeout,
+# kill -- -pgid) doesn't kill them - worker killed from outside can leave task queue lock of the pool
+# locked, and then pool can't be closed or terminated. Pool starts a new worker when one dies anyway;
+# new worker is forked from running daemon, so it gets default SIGTERM action back (signal handler
+# of daemon would make it ignore terminate()) and can close inherited files, e.g. listening sockets (worker_init).
+# On shutdown pool is terminated: drawing not finished after waiting for it can't hang the daemon,
+# and workers still alive after terminate_timeout are killed.
+
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+import numpy as np
+
+# Skipping unchanged charts
+import render_cache
+
+
+# Converts rows from db (time, val1, val2, ...) into columns:
+# times - int64 numpy array (unix time), and list of float64 numpy arrays (one for each value)
+def rows_to_columns(rows, values_count):
+    data = np.array(rows, dtype=np.float64).reshape(-1, values_count + 1)
+    times = data[:, 0].astype(np.int64)
+    return times, [np.ascontiguousarray(data[:, i + 1]) for i in range(values_count)]
+
+
+# Chart job - plot_func will be called with args in a worker process.
+# plot_func must be a module level function (it is passed to worker by name).
+# output - file drawn by plot_func (optional; jobs without it are never skipped by render cache)
+class ChartJob(object):
+
+    def __init__(self, name, plot_func, *args, **kwargs):
+        self.name = name
+        self.plot_func = plot_func
+        self.args = args
+        self.output = kwargs.get("output")
+
+
+# Runs in worker process. Returns (chart name, time [s], error or None)
+def run_chart_job(job):
+    start = time.time()
+    try:
+        job.plot_func(*job.args)
+    except Exception as e:
+        return job.name, time.time() - start, str(e)
+    return job.name, time.time() - start, None
+
+
+# Pool terminate waits this long [s], then workers are killed
+terminate_timeout = 5
+
+
+# Runs in every new worker process
+def init_worker(worker_init):
+    os.setpgrp()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Ctrl-C stops the daemon, and the daemon stops workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if worker_init is not None:
+        worker_init()
+
+
+class ChartPool(object):
+
+    # processes - number of worker processes (1 - draw everything in current process)
+    # cache - skip charts with unchanged digest (render_cache.py);
+    # cache_settings - values used by plot functions, but not given to them as arguments;
+    # pinned - every chart is drawn always by the same worker process;
+    # worker_init - function called in every new worker process (forked, not passed by name)
+    def __init__(self, processes=4, cache=False, cache_settings=(), pinned=False, worker_init=None):
+        self.processes = processes
+        self.cache = cache
+        self.cache_settings = cache_settings
+        self.pool = None
+        self.pools = None
+        self.terminated = False
+        if processes > 1:
+            if pinned:
+                self.pools = [multiprocessing.Pool(1, init_worker, (worker_init, )) for i in range(processes)]
+            else:
+                self.pool = multiprocessing.Pool(processes, init_worker, (worker_init, ))
+        # Pinned charts: output file (or name) -> worker index
+        self.workers = {}
+
+        # Render cache statistics
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    # Draws all charts, prints time of each chart and total time.
+    # Returns list of (chart name, time [s], error or None) of charts really drawn
+    def render(self, jobs):
+        start = time.time()
+
+        # Digests of jobs to draw (job name -> digest); unchanged charts are dropped
+        digests = {}
+        if self.cache:
+            to_draw = []
+            for job in jobs:
+                if job.output is None:
+                    to_draw.append(job)
+                    continue
+                digest = render_cache.digest(job.plot_func, job.args, self.cache_settings)
+                if render_cache.is_fresh(job.output, digest):
+                    self.cache_hits += 1
+                    print("  " + job.name + ": unchanged")
+                    continue
+                self.cache_misses += 1
+                render_cache.invalidate(job.output)
+                digests[job.name] = digest
+                to_draw.append(job)
+            skipped = len(jobs) - len(to_draw)
+            jobs = to_draw
+        else:
+            skipped = 0
+
+        if self.pools is not None:
+            pending = [self.pools[self.worker(job)].apply_async(run_chart_job, (job, )) for job in jobs]
+            results = [self.get(result) or (job.name, 0.0, "chart pool terminated") for job, result in zip(jobs, pending)]
+        elif self.pool is not None and jobs:
+            results = self.get(self.pool.map_async(run_chart_job, jobs, chunksize=1)) or \
+                      [(job.name, 0.0, "chart pool terminated") for job in jobs]
+        else:
+            results = [run_chart_job(job) for job in jobs]
+        total = time.time() - start
+
+        outputs = dict((job.name, job.output) for job in jobs)
+        for name, elapsed, error in results:
+            if error is None:
+                print("  " + name + ": " + ("%.2f" % elapsed) + "s")
+                if name in digests:
+                    render_cache.store(outputs[name], digests[name])
+            else:
+                print("  " + name + ": failed after " + ("%.2f" % elapsed) + "s: " + error)
+        print("Charts done: " + str(len(jobs)) + " in " + ("%.2f" % total) + "s (" + str(self.processes) + " processes" + \
+              (", unchanged: " + str(skipped) + ", " + self.cache_stats_str() if self.cache else "") + ")")
+        return results
+
+    # Waits for result of worker; None if pool is terminated in the meantime (its results never come)
+    def get(self, result):
+        while True:
+            try:
+                return result.get(1)
+            except multiprocessing.TimeoutError:
+                if self.terminated:
+                    return None
+
+    # Index of worker process drawing the job in pinned pool - the same for every render of a chart
+    def worker(self, job):
+        key = job.output or job.name
+        index = self.workers.get(key)
+        if index is None:
+            index = len(self.workers) % self.processes
+            self.workers[key] = index
+        return index
+
+    # Share of charts skipped by render cache since start (0.0 - 1.0)
+    def cache_hit_rate(self):
+        checked = self.cache_hits + self.cache_misses
+        if checked == 0:
+            return 0.0
+        return float(self.cache_hits) / checked
+
+    def cache_stats_str(self):
+        return "cache hit rate: " + ("%.0f" % (100.0 * self.cache_hit_rate())) + "% (" + \
+               str(self.cache_hits) + "/" + str(self.cache_hits + self.cache_misses) + ")"
+
+    def close(self):
+        for pool in [self.pool] + (self.pools or []):
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.pool = None
+        self.pools = None
+
+    # Stops workers right away - drawing in progress is lost (render() gives "chart pool terminated" error).
+    # Pool terminate is run in other threads: it never ends if a worker was killed holding queue lock.
+    def terminate(self):
+        self.terminated = True
+        threads = []
+        for pool in [self.pool] + (self.pools or []):
+            if pool is not None:
+                thread = threading.Thread(target=pool.terminate, name="chart pool terminate")
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+        deadline = time.time() + terminate_timeout
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.time()))
+        if any(thread.is_alive() for thread in threads):
+            # Child processes of this process are workers of chart pools only
+            for process in multiprocessing.active_children():
+                print("Killing chart pool worker " + str(process.pid))
+                os.kill(process.pid, signal.SIGKILL)
+        self.pool = None
+        self.pools = None
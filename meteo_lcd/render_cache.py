@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Render cache - chart is not drawn again if it would be the same as the file already drawn.
+# Digest of everything a chart depends on:
+# * renderer version (below) and plot function name,
+# * all arguments of plot function (numpy arrays - their bytes; other values - repr),
+# * settings of the drawing script not given as arguments (e.g. downsampling method),
+# is kept next to the chart file: <file name>.digest (e.g. temp_out.png.digest).
+# Chart is drawn only if digest file is missing, it holds other digest, or chart file is missing.
+
+import hashlib
+import os
+
+import numpy as np
+
+
+# Bump when look of charts changes (plot functions, styles) - all charts will be drawn again
+renderer_version = 1
+
+# Digest file extension
+digest_suffix = ".digest"
+
+
+def digest(plot_func, args, settings=()):
+    h = hashlib.sha1()
+    h.update(("v" + str(renderer_version) + " " + plot_func.__module__ + "." + plot_func.__name__ + " " + repr(settings)).encode("utf-8"))
+    for arg in args:
+        if isinstance(arg, np.ndarray):
+            h.update((" " + str(arg.dtype) + str(arg.shape) + " ").encode("ascii"))
+            h.update(np.ascontiguousarray(arg).tobytes())
+        else:
+            h.update((" " + repr(arg)).encode("utf-8"))
+    return h.hexdigest()
+
+
+def digest_file(file_name):
+    return file_name + digest_suffix
+
+
+# True if file_name exists and was drawn from data with this digest
+def is_fresh(file_name, value):
+    try:
+        with open(digest_file(file_name)) as f:
+            stored = f.read().strip()
+    except (IOError, OSError):
+        return False
+    return stored == value and os.path.exists(file_name)
+
+
+# Called after chart is drawn
+def store(file_name, value):
+    with open(digest_file(file_name), "w") as f:
+        f.write(value + "\n")
+
+
+# Called before chart is drawn - if drawing fails, old digest doesn't mark a broken file as fresh
+def invalidate(file_name):
+    try:
+        os.remove(digest_file(file_name))
+    except OSError:
+        pass
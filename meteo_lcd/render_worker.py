@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Background worker for slow jobs (drawing plots).
+# MQTT thread only calls request() - it never waits for drawing.
+# Requests are coalesced: if many requests come while job is running,
+# only one more run is done after the current one.
+
+import threading
+import time
+
+
+class RenderWorker(object):
+
+    def __init__(self, job, name="render"):
+        self.job = job
+        self.cond = threading.Condition()
+        self.requested = False
+        self.stopping = False
+        self.busy = False
+
+        # Statistics
+        self.requests = 0
+        self.coalesced = 0
+        self.runs = 0
+        self.last_run_time = 0.0
+
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    # Ask for a job run. Returns immediately.
+    def request(self):
+        with self.cond:
+            self.requests += 1
+            if self.requested:
+                # There is already one pending run - it will use the newest data anyway
+                self.coalesced += 1
+                return
+            self.requested = True
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.requested and not self.stopping:
+                    self.cond.wait()
+                if self.stopping:
+                    return
+                self.requested = False
+                self.busy = True
+            start = time.time()
+            try:
+                self.job()
+            except Exception as e:
+                print("Error in " + self.thread.name + " worker: " + str(e))
+            with self.cond:
+                self.busy = False
+                self.runs += 1
+                self.last_run_time = time.time() - start
+
+    # Stops worker; job that is running now is allowed to finish (up to timeout seconds),
+    # pending request is dropped
+    def stop(self, timeout=None):
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def stats_str(self):
+        return "requests: " + str(self.requests) + ", coalesced: " + str(self.coalesced) + \
+               ", runs: " + str(self.runs) + ", last run: " + ("%.1f" % self.last_run_time) + "s"
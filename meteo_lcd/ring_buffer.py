@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Fixed size, in-memory buffer with the newest readings (e.g. last 3 days for plots).
+# Data is kept in numpy columns: time (int64, unix time) and one float64 column per value.
+#
+# Every row is written twice: at position i and i + capacity. Thanks to that the newest
+# rows are always one continuous slice of each column, so window() returns numpy views
+# (no copying, no per-row objects) even after the buffer wraps around.
+#
+# Rows are overwritten only when capacity is exceeded, so the capacity should be bigger
+# than the window that is read - then views handed out are not modified by next appends
+# for a long time.
+
+import threading
+
+import numpy as np
+
+
+class RingBuffer(object):
+
+    def __init__(self, capacity, values_count):
+        self.capacity = capacity
+        self.values_count = values_count
+        self.times = np.zeros(2 * capacity, dtype=np.int64)
+        self.values = [np.zeros(2 * capacity, dtype=np.float64) for i in range(values_count)]
+        self.head = 0  # position of the next write (0 .. capacity-1)
+        self.count = 0 # number of rows in buffer
+        self.lock = threading.Lock()
+
+    # Appends one row; rows must come in time order
+    def append(self, t, values):
+        with self.lock:
+            i = self.head
+            j = i + self.capacity
+            self.times[i] = t
+            self.times[j] = t
+            for column, value in zip(self.values, values):
+                column[i] = value
+                column[j] = value
+            self.head = (i + 1) % self.capacity
+            if self.count < self.capacity:
+                self.count += 1
+
+    # Appends many rows at once - times: array of unix times, columns: list of arrays
+    def extend(self, times, columns):
+        for k in range(len(times)):
+            self.append(times[k], [column[k] for column in columns])
+
+    # Returns (times, [column, ...]) - views on rows with time >= time_min, in time order
+    def window(self, time_min=None):
+        with self.lock:
+            # when buffer is full head is also the oldest row
+            end = self.head + self.capacity
+            start = end - self.count
+        times = self.times[start:end]
+        if time_min is not None:
+            start += int(np.searchsorted(times, time_min, side="left"))
+            times = self.times[start:end]
+        return times, [column[start:end] for column in self.values]
+
+    # Time of the newest row or None
+    def last_time(self):
+        with self.lock:
+            if self.count == 0:
+                return None
+            return int(self.times[self.head + self.capacity - 1])
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Many meteo stations in one setup.
+# Station sends its readings to MQTT topic "meteo/<station_id>". Old senders (single station setup)
+# send to "meteo" - their readings belong to default station "", and its files keep the old names
+# (meteo.html, meteo.log, temp_out.png, ...). Files of other stations have station id in the name:
+# meteo_<station_id>.html, meteo_<station_id>.log, temp_out_<station_id>.png, ...
+
+import os
+import re
+import datetime
+
+from meteo_db import default_station
+from ring_buffer import RingBuffer
+
+
+# Station id becomes a part of file names - only safe characters are allowed
+station_id_regexp = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+# "Never" - initial value of last update/log/plot times
+old_time = datetime.datetime.fromtimestamp(1284286794) # "2010-09-12T12:19:54"
+
+
+# Returns station id for MQTT topic: base_topic -> default station, base_topic/<id> -> id,
+# or None when topic is not a station topic (or id has not allowed characters)
+def station_from_topic(topic, base_topic):
+    if topic == base_topic:
+        return default_station
+    prefix = base_topic + "/"
+    if topic.startswith(prefix):
+        station_id = topic[len(prefix):]
+        if station_id_regexp.match(station_id):
+            return station_id
+    return None
+
+
+# File path for a station: "/x/meteo.html" -> "/x/meteo_<station_id>.html" (unchanged for default station)
+def station_file(path, station_id):
+    if station_id == default_station:
+        return path
+    root, ext = os.path.splitext(path)
+    return root + "_" + station_id + ext
+
+
+# State of one station: times of last web/log/plot update and the newest readings
+class Station(object):
+
+    def __init__(self, station_id, recent_data_capacity, values_count):
+        self.station_id = station_id
+        self.last_update_time = old_time
+        self.last_log_time    = old_time
+        self.last_plot_time   = old_time
+        self.recent_data = RingBuffer(recent_data_capacity, values_count)
+
+    def file(self, path):
+        return station_file(path, self.station_id)
+
+    # Name for messages
+    def name(self):
+        return self.station_id or "default"
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# Time axis for plots.
+# Converts whole column of unix times (as stored in db) into Matplotlib date numbers
+# in one numpy pass - instead of datetime.fromtimestamp() for every row and converting
+# the datetimes back to numbers inside Matplotlib.
+#
+# Plots show local time (as datetime.fromtimestamp() did), DST changes included.
+
+import calendar
+import datetime
+import time
+
+import numpy as np
+import matplotlib.dates
+
+
+# Matplotlib date number of 1970-01-01 00:00 (depends on Matplotlib version)
+epoch_date_num = matplotlib.dates.date2num(datetime.datetime(1970, 1, 1))
+
+# Local time offset can change only at full quarter of an hour (DST, time zone changes)
+offset_step = 15 * 60
+
+seconds_per_day = 24 * 60 * 60
+
+
+# Local time offset from UTC [s] at unix time t
+def local_offset(t):
+    return calendar.timegm(time.localtime(t)) - t
+
+
+# Returns array of local time offsets from UTC [s] for array of unix times.
+# time.localtime() is called once per distinct quarter of an hour, not once per row.
+def local_offsets(times):
+    steps, index = np.unique(np.asarray(times, dtype=np.int64) // offset_step, return_inverse=True)
+    offsets = np.array([local_offset(int(step) * offset_step) for step in steps], dtype=np.int64)
+    return offsets[index]
+
+
+# Converts array of unix times into array of Matplotlib date numbers (local time)
+def epoch_to_num(times):
+    times = np.asarray(times, dtype=np.int64)
+    if len(times) == 0:
+        return np.zeros(0, dtype=np.float64)
+    return epoch_date_num + (times + local_offsets(times)) / float(seconds_per_day)
@@ -16,17 +16,22 @@
 #
 # or for other diagrams (this seems to be too "heavy" for raspberry):
 # pip install plotly
+#
+# Fast start: only modules needed to handle a reading (parsing, web page, log, db) are imported
+# at startup. Plotting modules (matplotlib, time_axis, downsample, live_chart) are imported
+# on the first chart - in chart pool process (or render worker thread if plot_processes = 1),
+# dateutil - only when it's needed.
 
 
-import re #regular expression
-from shutil import move
-from os import remove
-from math import sqrt, floor
 import datetime # datetime and timedelta structures
 import time
 
 # Changing user
 import os # os.getuid
+
+# Plots are drawn in background, without any display - use non-interactive backend.
+# Set before matplotlib is imported (by anyone) - pyplot is not needed to choose backend.
+os.environ.setdefault("MPLBACKEND", "Agg")
 import pwd # pwd.getpwuid
 import grp # grp.getgrnam
 
@@ -35,13 +40,39 @@ import paho.mqtt.client as mqtt
 
 # Sqlite3 database
 import sqlite3
+from meteo_db import MeteoDB, migrate_db, default_station
+# Many stations (MQTT topic meteo/<station_id>)
+from stations import Station, station_from_topic
+
+# Web page template
+from meteo_template import HtmlTemplate
+
+# Drawing plots in background thread
+from render_worker import RenderWorker
+
+# Dew point formulas
+from dew_point import dew_point_one
+
+# Readings queue and writer thread
+from ingest_queue import IngestQueue
 
-# Needed for drawing a plot
-import dateutil.parser
-import matplotlib
-import matplotlib.pyplot as plt
-#import numpy as np
-from matplotlib.ticker import MultipleLocator
+# Timings, status and profiler
+import metrics
+from metrics import MetricsServer, StatusWriter, SamplingProfiler
+
+# Clean shutdown on SIGTERM (meteo.sh stop)
+import signal
+import sys
+import threading
+
+# Drawing charts in parallel (pool of processes); plotting modules are imported in plot_set_ax_fig
+from plot_render import ChartJob, ChartPool, rows_to_columns
+# Reading meteo.log
+from log_reader import LogReader
+# Binary log (optional)
+from binary_log import BinaryLog, BinaryLogWriter
+# Json files for charts drawn by web browser
+from data_feed import DataFeed
 
 ##############################################################################################################
 ### Needed defines & constants
@@ -56,54 +87,94 @@ www_meteo_path_tmp = working_dir + "meteo.html_tmp"
 log_file_path = working_dir + "meteo.log"
 db_path       = data_dir + "meteo.db"
 
+# Binary log (see binary_log.py) - written together with meteo.log, and used instead of it for plots from log
+use_binary_log       = False
+binary_log_file_path = working_dir + "meteo.bin"
+
+# Database group commit: commit after this many rows, or when oldest buffered row is this old
+db_commit_rows     = 10
+db_commit_interval = 60 * 15 # in seconds -> 15 minutes
+db_flush_period    = 30 # buffered rows are checked this often [s] (by ingest writer thread, also when no message comes)
+
 # Default user
 default_user = 'pi'
 
+# MQTT broker
+mqtt_username = "meteo"
+mqtt_password = "meteo1234"
+mqtt_topic = "meteo" # default station; other stations send to "meteo/<station_id>"
+mqtt_broker_ip = "192.168.0.8"
+mqtt_broker_port = 1883
+mqtt_topics = [(mqtt_topic, 0), (mqtt_topic + "/+", 0)] # (topic, qos) subscribed after connect
+
 # Diagiam file names
 temp_out_diagram_file      = working_dir + "temp_out.png"
 humid_out_diagram_file     = working_dir + "humid_out.png"
 dew_point_out_diagram_file = working_dir + "dew_out.png"
 pressure_diagram_file      = working_dir + "pressure.png"
 
-# We don't want to make update too often so we need to store last update time
-# And compare it with current time - if current time is too small then do nothing
-# Initialize it to some old time
-last_update_time = datetime.datetime.fromtimestamp(1284286794)
-last_log_time    = datetime.datetime.fromtimestamp(1284286794)
-last_plot_time   = datetime.datetime.fromtimestamp(1284286794)
+# We don't want to make update too often so for each station we store last update time
+# (see stations.Station) and compare it with current time - if current time is too small then do nothing
 update_delay = datetime.timedelta(seconds = 60 * 1) # update delay in seconds -> 1 minute
 log_delay    = datetime.timedelta(seconds = 60 * 3) # update delay in seconds -> 3 minute
 plot_delay   = datetime.timedelta(seconds = 60 * 10) # update delay in seconds -> 1 minute
-
-
-template_temp_out_begin      = "<!-- TEMP_OUT -->"
-template_temp_out_end        = "<!-- /TEMP_OUT -->"
-template_humid_out_begin     = "<!-- HUMID_OUT -->"
-template_humid_out_end       = "<!-- /HUMID_OUT -->"
-template_pressure_begin      = "<!-- PRESS -->"
-template_pressure_end        = "<!-- /PRESS -->"
-template_dew_point_out_begin = "<!-- DEW_OUT -->"
-template_dew_point_out_end   = "<!-- /DEW_OUT -->"
-template_temp_in_begin       = "<!-- TEMP_IN -->"
-template_temp_in_end         = "<!-- /TEMP_IN -->"
-template_humid_in_begin      = "<!-- HUMID_IN -->"
-template_humid_in_end        = "<!-- /HUMID_IN -->"
-template_dew_point_in_begin  = "<!-- DEW_IN -->"
-template_dew_point_in_end    = "<!-- /DEW_IN -->"
-
-template_last_update_begin  = "<!-- LAST_UPDATE -->"
-template_last_update_end    = "<!-- /LAST_UPDATE -->"
-
-val_regexp = ".*"
-
-template_temp_out      = template_temp_out_begin      + val_regexp + template_temp_out_end
-template_humid_out     = template_humid_out_begin     + val_regexp + template_humid_out_end
-template_pressure      = template_pressure_begin      + val_regexp + template_pressure_end
-template_dew_point_out = template_dew_point_out_begin + val_regexp + template_dew_point_out_end
-template_temp_in       = template_temp_in_begin       + val_regexp + template_temp_in_end
-template_humid_in      = template_humid_in_begin      + val_regexp + template_humid_in_end
-template_dew_point_in  = template_dew_point_in_begin  + val_regexp + template_dew_point_in_end
-template_last_update   = template_last_update_begin   + val_regexp + template_last_update_end
+render_stop_timeout = 60 # on shutdown wait this long [s] for drawing in progress
+plot_processes = 4 # number of processes drawing charts (1 - draw in daemon process)
+
+# Before drawing, each series is reduced to about chart width in pixels (22 inches * 100 dpi).
+# Method: "minmax" (min and max of each bucket), "lttb" (Largest-Triangle-Three-Buckets) or None (all points)
+plot_downsample_method = "minmax"
+plot_max_points        = 2200
+# Figure of each chart is created once and reused - only data is replaced (see live_chart.py).
+# Each chart is drawn always by the same chart pool process, which keeps its figure.
+# False - new figure for every render.
+plot_reuse_figures     = True
+# Chart is not drawn again if its data and settings are the same as of the file already drawn
+# (digest kept next to each chart file, see render_cache.py)
+plot_cache             = True
+# Drawing png charts (False - charts are drawn only by web browser, from data feed)
+plot_png               = True
+
+# Data feed for charts drawn by web browser (www/charts.html): json files in www data dir, see data_feed.py
+data_feed_enabled         = True
+data_feed_dir             = working_dir + "data/"
+data_feed_window_interval = 60 * 60 # recent.json written again every hour (recent_delta.json - with every db row)
+data_feed_rollup_interval = 60 * 60 # month.json and year.json written again every hour
+
+# Readings from MQTT wait in ingest queue for writer thread (web page, log, db).
+# When queue is full: "drop_oldest" (drop the oldest reading) or "block" (MQTT thread waits)
+ingest_queue_size     = 1000
+ingest_overflow       = "drop_oldest"
+ingest_batch_size     = 50
+ingest_stop_timeout   = 60 # on shutdown wait this long [s] for writing queued readings
+ingest_stats_interval = 60 * 60 # print queue statistics every hour
+last_ingest_stats_time = time.time()
+
+# Instrumentation (see metrics.py): timings of hot paths are served on localhost:metrics_port
+# (/metrics - Prometheus, /status.json, /profile) and written to status file every status_interval.
+# metrics_port = None - no HTTP endpoint. Profiler is started/stopped with /profile/toggle (meteo.sh profile).
+# (Not with a signal: in Python 2 signal breaks select() in MQTT loop and client reconnects.)
+metrics_port      = 8099
+status_file_path  = data_dir + "status.json"
+status_interval   = 60 # in seconds
+profiler_interval = 0.005 # time between profiler samples [s]
+start_time = time.time()
+
+# Dew point formula: "approx" (the original one) or "magnus" (Magnus-Tetens), see dew_point.py.
+# Rounded to integer (as always) or not (2 decimal places in log and db).
+# After a change, old readings can be recalculated with db_tools/dew_point_recompute.py
+dew_point_method  = "approx"
+dew_point_rounded = True
+
+# Readings out of these ranges are dropped as sensor errors (NaN too).
+# Humidity 0 is dropped as well - no dew point for it ("magnus").
+temp_range  = (-60.0, 70.0) # *C
+humid_range = (1, 100)      # %
+
+# Plots show last 3 days and 3 hours; readings from this period are kept in memory
+plot_window = datetime.timedelta(days = 3, hours = 3)
+# Rows in memory buffer - must be more than rows logged in plot_window (3 days 3 hours / log_delay = 1500)
+recent_data_capacity = 2048
 
 
 ##############################################################################################################
@@ -113,10 +184,10 @@ template_last_update   = template_last_update_begin   + val_regexp + template_la
 def change_user():
     user = pwd.getpwuid( os.getuid() ).pw_name
     if user == default_user :
-        print "User OK - '" + user + "'."
+        print("User OK - '" + user + "'.")
         return
     else:
-        print "Bad user '" + user + "', changing to '" + default_user + "'."
+        print("Bad user '" + user + "', changing to '" + default_user + "'.")
         try:
             # Remove group privileges
             os.setgroups([])
@@ -125,7 +196,7 @@ def change_user():
             os.setuid(pwd.getpwnam(default_user).pw_uid)
         except Exception as e:
             print("Error while changing user." + str(e))
-    print "User changed from '" + user + "' to '" + default_user + "'."
+    print("User changed from '" + user + "' to '" + default_user + "'.")
 
 
 
@@ -144,24 +215,35 @@ def get_meteo_data_in():
 def get_meteo_pressure():
 	return 999.3
 
-# Calculates dew point
-# This should give a correct result for temperature in ranges -30 < T < 70 *C, and humidity  0-100%
+# Calculates dew point (see dew_point.py; db_tools/dew_point_recompute.py recalculates old readings)
+# "approx" should give a correct result for temperature in ranges -30 < T < 70 *C, and humidity  0-100%
 def get_dew_point(temp, humid):
-	tmp = sqrt(sqrt(sqrt( float(humid)/100.0 ))) * (112.0 + (0.9 * float(temp))) + (0.1 * float(temp)) - 112.0;
-	return floor(tmp + 0.5);
+	if dew_point_rounded:
+		return dew_point_one(temp, humid, dew_point_method)
+	return round(dew_point_one(temp, humid, dew_point_method, False), 2)
+
+# Dew point value as it's stored in db
+def dew_point_db(value):
+	if dew_point_rounded:
+		return int(value)
+	return float(value)
 
 # Log data to file
 # We can use this data later to draw a plot
-def log_to_file(temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure):
-	lf = open(log_file_path, "a");
-	t = datetime.datetime.now()
-	t = t.replace(microsecond=0)
+def log_to_file(station, t, temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure):
+	lf = open(station.file(log_file_path), "a");
 	new_line = t.isoformat() + ";" + str(temp_in) + ";" + str(humid_in) + ";" + str(dew_in) + ";" + str(temp_out) + ";" + str(humid_out) + ";" + str(dew_out) + ";" + str(pressure) + "\n"
 	lf.write(new_line)
 	lf.close()
+	if use_binary_log:
+		try:
+			BinaryLogWriter(station.file(binary_log_file_path)).append(int(time.mktime(t.timetuple())), (temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure))
+		except Exception as e:
+			print("Error while writing binary log: " + str(e))
 
 # Converts a string back the datetime structure
 def getDateTimeFromISO8601String(s):
+    import dateutil.parser
     d = dateutil.parser.parse(s)
     return d
 
@@ -169,47 +251,26 @@ def getDateTimeFromISO8601String(s):
 ##############################################################################################################
 ### Database
 
-# Creating table in database
+# Creating table in database (or migrating it to current schema)
 def create_db ():
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-
-    sql = "CREATE TABLE IF NOT EXISTS log (\n\
-id INTEGER PRIMARY KEY ASC,\n\
-time INT NOT NULL,\n\
-temp REAL,\n\
-humid INT,\n\
-dew_point INT,\n\
-pressure REAL,\n\
-temp_in REAL,\n\
-humid_in INT,\n\
-dew_point_in INT)"
+    migrate_db(db_path)
 
-    c.execute(sql)
 
-    conn.commit()
-    conn.close()
-
-
-def log_into_db (date_time, temp, humid, dew_point, pressure, temp_in, humid_in, dew_point_in):
-
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
+def log_into_db (station, date_time, temp, humid, dew_point, pressure, temp_in, humid_in, dew_point_in):
 
     try:
         int_time = int (time.mktime(date_time.timetuple()))
-
-        c.execute("INSERT INTO log (time, temp, humid, dew_point, pressure, temp_in, humid_in, dew_point_in) \
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (int_time, temp, humid, dew_point, pressure, temp_in, humid_in, dew_point_in))
-        conn.commit()
+        # Row is buffered and committed together with other rows (see meteo_db.py)
+        # Values are converted here, so buffered rows look the same as rows read from db
+        meteo_db.insert((int_time, float(temp), int(humid), dew_point_db(dew_point), float(pressure), float(temp_in), int(humid_in), dew_point_db(dew_point_in)), station.station_id)
+        # Same values go to memory buffer used for plots
+        station.recent_data.append(int_time, (float(temp), int(humid), dew_point_db(dew_point), float(pressure)))
     except Exception as e:
         print("Error while insert log to database: " + str(e))
 
-    conn.close()
-
 
 # Get values from last days and hours
-def get_val_last_db(days, hours):
+def get_val_last_db(days, hours, station_id=default_station):
 
     if days < 0 or days > 31:
         return;
@@ -219,41 +280,49 @@ def get_val_last_db(days, hours):
     current_time = datetime.datetime.now()
     begin_time = current_time - datetime.timedelta(days=days, hours=hours)
 
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-
-    c.execute("SELECT strftime('%s', (?))", (begin_time, ))
-    int_time_min = (c.fetchone())[0]
-    c.execute("SELECT strftime('%s', (?))", (current_time, ))
-    int_time_max = (c.fetchone())[0]
+    int_time_min = int (time.mktime(begin_time.timetuple()))
+    int_time_max = int (time.mktime(current_time.timetuple()))
 
+    rows = []
     try:
-        c.execute("SELECT time, temp, humid, dew_point, pressure FROM log WHERE time >= ? AND time < ?", (int_time_min, int_time_max))
-        rows = c.fetchall()
-
+        rows = meteo_db.select_range(int_time_min, int_time_max, station_id)
     except Exception as e:
         print("Error while get_val_last from db: " + str(e))
 
-    conn.close()
     return rows
 
 
-# Get last updatate time from db
-def get_last_update_time_from_db():
+# Fill memory buffer of a station with data from db - done once, when station is set up
+def load_recent_data(station):
+    current_time = datetime.datetime.now()
+    int_time_min = int (time.mktime((current_time - plot_window).timetuple()))
+    int_time_max = int (time.mktime(current_time.timetuple())) + 1
+
+    try:
+        rows = meteo_db.select_range(int_time_min, int_time_max, station.station_id)
+    except Exception as e:
+        print("Error while loading recent data from db: " + str(e))
+        return
+    # Row format: (time, temp, humid, dew_point, pressure)
+    t, columns = rows_to_columns(rows, 4)
+    station.recent_data.extend(t, columns)
+    print("Recent data of station " + station.name() + " loaded from db: " + str(len(station.recent_data)) + " rows")
+
 
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
+# Get last updatate time from db
+def get_last_update_time_from_db(station_id=default_station):
 
+    ret = None
     try:
-        c.execute("SELECT time FROM log ORDER BY time DESC LIMIT 1")
-        row = c.fetchone()
-	ret = row[0]
-        print "Last update from db: " + str(ret) + " (" + str(datetime.datetime.fromtimestamp(ret)) + ")"
+        ret = meteo_db.last_time(station_id)
     except Exception as e:
-	print("Cannot read last update time from db: " + str(e))
+        print("Cannot read last update time from db: " + str(e))
+
+    if ret is None:
         ret = 1284286794 # "2010-09-12T12:19:54" - just some random old time
+    else:
+        print("Last update from db: " + str(ret) + " (" + str(datetime.datetime.fromtimestamp(ret)) + ")")
 
-    conn.close()
     return datetime.datetime.fromtimestamp(ret)
 
 
@@ -262,10 +331,32 @@ def get_last_update_time_from_db():
 
 def plot_set_ax_fig (time, data, data_len, plot_type, ylabel, title, major_locator, minor_locator, file_name):
 
+    # Plotting modules - imported on the first chart (see "Fast start" at the top)
+    from time_axis import epoch_to_num # Unix times -> Matplotlib date numbers
+    from downsample import downsample  # Reducing number of points before drawing
+
     # This keeps chart nice-looking
     ratio = 0.25
     plot_size_inches = 22
 
+    # time comes as array of unix times - convert it to Matplotlib dates (local time) at once
+    time = epoch_to_num(time)
+    # Reduce number of points to about chart width (peaks are kept)
+    time, data = downsample(time, data, plot_max_points, plot_downsample_method)
+    data_len = len(time) - 1
+
+    if plot_reuse_figures:
+        import live_chart # Charts drawn on figures kept between renders
+        live_chart.render(file_name, time, data, plot_type, ylabel, title, major_locator, minor_locator)
+        return
+
+    import matplotlib
+    # MPLBACKEND (top of this file) is not used if matplotlib was imported earlier (e.g. by benchmarks)
+    matplotlib.use("Agg")
+    import matplotlib.dates
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import MultipleLocator
+
     fig, ax = plt.subplots()
 
     fig.set_size_inches(plot_size_inches, plot_size_inches)
@@ -295,249 +386,375 @@ def plot_set_ax_fig (time, data, data_len, plot_type, ylabel, title, major_locat
     plt.close()
 
 
+# Chart pool of update daemon - with render cache if plot_cache is on.
+# Settings used by plot_set_ax_fig are part of chart digest, so charts are drawn again when they change.
+# Reused figures are kept in pool processes - each chart is pinned to one process.
+def create_chart_pool():
+    return ChartPool(plot_processes, plot_cache, (plot_downsample_method, plot_max_points), plot_reuse_figures,
+                     chart_worker_init)
+
+# Runs in every new chart pool process. Process started again while daemon runs (old one died)
+# inherits listening socket of metrics endpoint - closed, so a restarted daemon can bind its port.
+def chart_worker_init():
+    if metrics_server is not None:
+        metrics_server.close_inherited()
+
+# Draws plots for outside values of a station: temperature, humidity, dew piont, pressure
+# Each plot is drawn by separate process from chart_pool.
+# t - numpy array of unix times, t_out, h_out, d_out, p_out - numpy arrays with values
+def draw_plots(station, t, t_out, h_out, d_out, p_out):
+    values_count = len(t)
+
+    results = chart_pool.render([
+        ChartJob("temperature", plot_set_ax_fig, t, t_out, values_count-1, 'r-', 'Temperatura [C]', 'Wykres temperatury zewnetrznej', 1, 0.1, station.file(temp_out_diagram_file), output=station.file(temp_out_diagram_file)),
+        ChartJob("humidity",    plot_set_ax_fig, t, h_out, values_count-1, 'g-', 'Wilgotnosc wzgledna [%]', 'Wykres wilgotnosci wzglednej', 5, 1, station.file(humid_out_diagram_file), output=station.file(humid_out_diagram_file)),
+        ChartJob("dew point",   plot_set_ax_fig, t, d_out, values_count-1, 'b-', 'Temp. punktu rosy [C]', 'Wykres temperatury punktu rosy', 1, 1, station.file(dew_point_out_diagram_file), output=station.file(dew_point_out_diagram_file)),
+        ChartJob("pressure",    plot_set_ax_fig, t, p_out, values_count-1, 'm-', 'Cisnienie atm. [hPa]', 'Wykres cisnienia atmosferycznego', 2, 1, station.file(pressure_diagram_file), output=station.file(pressure_diagram_file)),
+    ])
+    for name, elapsed, error in results:
+        if error is None:
+            metrics.observe("chart_" + name.replace(" ", "_"), elapsed)
+
+
 # Draw a plot
-def draw_plot():
-        # Open log file
-        lf = open(log_file_path, "r");
-        # Calculates number lines in log file
-        num_lines = sum(1 for line in lf)
-        lf.seek(0)
-
-        # Current time
-        current_time = datetime.datetime.now()
-        plot_begin_time = current_time - datetime.timedelta(days = 3, hours = 3)
-
-        # Helpers
-        j = 0
-        values_count = 0
-        lines_to_skip = num_lines - 2500
-        # This much entries should be more than 3 days and 3 hours of logs.
-        # This will cause that generating plot will take less time
-        if lines_to_skip < 0:
-            lines_to_skip = 0;
-
-	# Use every x (e.g. every second, or every third) value - this makes chart more 'smooth'
-        every_x = 1;
-
-        t = []; # time axis for plot
-        t_out = []; # temp out for plot
-        h_out = []; # humid out for plot
-        d_out = []; # dew point for plot
-        p_out = []; # pressure for plot
-        # From each line of log file create a pairs of meteo data (time, value)
-        for line in lf:
-            if lines_to_skip > 0:
-                lines_to_skip -= 1
-                continue
-            j += 1
-            if j >= every_x:
-                j = 0
-            else:
-                continue
-            # Parse line
-            time, temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure = str(line).split(";")
-            time = getDateTimeFromISO8601String(time)
-            if time < plot_begin_time:
-                continue;
-            values_count += 1
-            # Append time for time axis
-            t.append(time)
-            # Append meteo data for their axis
-            t_out.append(float(temp_out))
-            h_out.append(float(humid_out))
-            d_out.append(float(dew_out))
-            p_out.append(float(pressure))
-
-        lf.close()
-
-        # draw plots for outside values: temperature, humidity, dew piont, pressure
-
-
-	##############
-	# Temperature
-        plot_set_ax_fig(t, t_out, values_count-1, 'r-', 'Temperatura [C]', 'Wykres temperatury zewnetrznej', 1, 0.1, temp_out_diagram_file)
-
-
-	##############
-	# Humidity
-        plot_set_ax_fig(t, h_out, values_count-1, 'g-', 'Wilgotnosc wzgledna [%]', 'Wykres wilgotnosci wzglednej', 5, 1, humid_out_diagram_file)
-
-
-        ##############
-        # Dew point
-        plot_set_ax_fig(t, d_out, values_count-1, 'b-', 'Temp. punktu rosy [C]', 'Wykres temperatury punktu rosy', 1, 1, dew_point_out_diagram_file)
-
-
-        ##############
-        # Pressure
-        plot_set_ax_fig(t, p_out, values_count-1, 'm-', 'Cisnienie atm. [hPa]', 'Wykres cisnienia atmosferycznego', 2, 1, pressure_diagram_file)
+def draw_plot(station):
+    # Current time
+    current_time = datetime.datetime.now()
+    plot_begin_time = current_time - plot_window
 
-        return
+    # Read records from plot_begin_time
+    if use_binary_log:
+        t, values = BinaryLog(station.file(binary_log_file_path)).read_range(int(time.mktime(plot_begin_time.timetuple())))
+    else:
+        reader = LogReader(station.file(log_file_path))
+        t, values = reader.read_range(int(time.mktime(plot_begin_time.timetuple())))
+        reader.report()
+
+    # Values columns: temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure
+    draw_plots(station, t, values[:, 3], values[:, 4], values[:, 5], values[:, 6])
+    return
 
 
 # Draw a plot using database
-def draw_plot_db():
+# Data comes from memory buffer of the station (filled from db at startup, and then with each new db row)
+def draw_plot_db(station):
+
+    begin_time = datetime.datetime.now() - plot_window
+    int_time_min = int (time.mktime(begin_time.timetuple()))
+    # Views on memory buffer - no copying
+    t, (t_out, h_out, d_out, p_out) = station.recent_data.window(int_time_min)
+    # New station - nothing to draw yet
+    if len(t) < 2:
+        print("Not enough data of station " + station.name() + " for plots")
+        return
 
-        t = []; # time axis for plot
-        t_out = []; # temp out for plot
-        h_out = []; # humid out for plot
-        d_out = []; # dew point for plot
-        p_out = []; # pressure for plot
+    draw_plots(station, t, t_out, h_out, d_out, p_out)
+    return
 
-        rows = get_val_last_db(3, 3)  # 3 days, 3 hours
-        # From each row creates a pairs of meteo data (time, value)
 
-	values_count = len(rows)
-        # Row format: (time, temp, humid, dew_point, pressure)
-        for row in rows:
-            # Append time for time axis
-            t.append(datetime.datetime.fromtimestamp(row[0]))
-            # Append meteo data for their axis
-            t_out.append(row[1])
-            h_out.append(row[2])
-            d_out.append(row[3])
-            p_out.append(row[4])
+# Stations waiting for drawing their plots (filled in ingest writer thread, emptied by render worker)
+plot_requests = set()
+plot_requests_lock = threading.Lock()
 
-        # draw plots for outside values: temperature, humidity, dew piont, pressure
+# Asks render worker to draw plots of a station
+def request_plots(station):
+    with plot_requests_lock:
+        plot_requests.add(station)
+    render_worker.request()
 
-	##############
-	# Temperature
-        plot_set_ax_fig(t, t_out, values_count-1, 'r-', 'Temperatura [C]', 'Wykres temperatury zewnetrznej', 1, 0.1, temp_out_diagram_file)
 
+# Draw plots - runs in render worker thread
+def render_plots():
+    start = time.time()
+    with plot_requests_lock:
+        requested = sorted(plot_requests, key=lambda station: station.station_id)
+        plot_requests.clear()
+    for station in requested:
+        print("Draw a plot using db (station " + station.name() + ")")
+        draw_plot_db(station)
+    end = time.time()
+    metrics.observe("render_plots", end - start)
+    print("Drawing done! (in " + str(int(end - start)) + "s, " + render_worker.stats_str() + \
+          (", " + chart_pool.cache_stats_str() if plot_cache else "") + ")")
 
-	##############
-	# Humidity
-        plot_set_ax_fig(t, h_out, values_count-1, 'g-', 'Wilgotnosc wzgledna [%]', 'Wykres wilgotnosci wzglednej', 5, 1, humid_out_diagram_file)
 
+##############################################################################################################
+### Data feed
 
-        ##############
-        # Dew point
-        plot_set_ax_fig(t, d_out, values_count-1, 'b-', 'Temp. punktu rosy [C]', 'Wykres temperatury punktu rosy', 1, 1, dew_point_out_diagram_file)
+# Data feed of update daemon, or None if it's off or its dir can't be created
+def create_data_feed():
+    if not data_feed_enabled:
+        return None
+    try:
+        return DataFeed(data_feed_dir, int(plot_window.total_seconds()), data_feed_window_interval, data_feed_rollup_interval)
+    except Exception as e:
+        print("Cannot start data feed: " + str(e))
+        return None
 
+# New row of a station in memory buffer - recent data json (and rollups, if it's time to write them again)
+def update_data_feed(station):
+    try:
+        data_feed.update(station)
+        data_feed.update_rollups(meteo_db, station.station_id)
+    except Exception as e:
+        print("Error while writing data feed: " + str(e))
 
-        ##############
-        # Pressure
-        plot_set_ax_fig(t, p_out, values_count-1, 'm-', 'Cisnienie atm. [hPa]', 'Wykres cisnienia atmosferycznego', 2, 1, pressure_diagram_file)
 
-        return
+# Get last updatate time from log file of a station
+# Only the end of file is read (see LogReader.last_records)
+def get_last_update_time_from_log(station):
+    try:
+        records = LogReader(station.file(log_file_path)).last_records(1)
+        if records:
+            ret = datetime.datetime.fromtimestamp(records[0][0])
+            print ("Last update time (from log) set to: " + ret.isoformat())
+            return ret
+        print("Cannot read last update time from log: no valid records at the end of file")
+    except Exception as e:
+        print("Cannot read last update time from log: " + str(e))
+    return datetime.datetime.fromtimestamp(1284286794)
 
 
-# Get last updatate time from log file
-def get_last_update_time_from_log():
-        # Open log file
-	lf = open(log_file_path, "r");
-	for line in lf:
-	    pass
-	last = line
-	lf.close()
-	try:
-		time, temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure = str(line).split(";")
-		print ("Last update time (from log) set to: " + time)
-	        return getDateTimeFromISO8601String(time)
-	except Exception as e:
-		print("Cannot read last update time from log: " + str(e))
-	return datetime.datetime.fromtimestamp(1284286794)
+##############################################################################################################
+### Stations
+
+# All stations seen so far: station_id -> Station. Added only in ingest writer thread.
+stations = {}
+
+# Returns state of a station - new station is set up with its data from db
+def get_station(station_id):
+    station = stations.get(station_id)
+    if station is None:
+        station = Station(station_id, recent_data_capacity, 4)
+        load_recent_data(station)
+        # Check last update and log time from db
+        station.last_update_time = get_last_update_time_from_db(station_id)
+        #station.last_update_time = get_last_update_time_from_log(station)
+        station.last_log_time    = station.last_update_time
+        station.last_plot_time   = station.last_update_time
+        stations[station_id] = station
+    return station
 
 
 ##############################################################################################################
 ### Main update function
 ### Updates: webpage, text file log, database, and plot
 
-# Update web data:
+# Checks meteo data from MQTT message - runs in MQTT thread, so it does only what is needed
+# to put reading into ingest queue.
 # Meteo data comes to function as a parameters in order:
 # temp in, humid in, temp_out, humid out, pressure
-def update_meteo_data(data):
+# Returns reading (station_id, time, temp_in, humid_in, temp_out, humid_out, pressure) or None
+def parse_meteo_data(data, station_id=default_station):
+
+    try:
+        if not isinstance(data, str):
+            data = data.decode("ascii") # Python 3.x - payload is bytes
+        temp_in, humid_in, temp_out, humid_out, pressure = data.split(";")
+        val = float(temp_in)
+        val = int(humid_in)
+        val = float(temp_out)
+        val = int(humid_out)
+        val = float(pressure)
+    except Exception as e:
+        print("Bad meteo data values: " + str(e))
+        return None
+    # (comparisons are False for NaN)
+    for temp in (float(temp_in), float(temp_out)):
+        if not temp_range[0] <= temp <= temp_range[1]:
+            print("Bad meteo data values: temperature out of range: " + str(temp))
+            return None
+    for humid in (int(humid_in), int(humid_out)):
+        if not humid_range[0] <= humid <= humid_range[1]:
+            print("Bad meteo data values: humidity out of range: " + str(humid))
+            return None
+    pressure = float(pressure) / 100.0
+
+    # Get current time
+    current_time = datetime.datetime.now()
+    # Reset microsecond in current time to 0 - we don't want to keep them
+    current_time = current_time.replace(microsecond=0)
+
+    return (station_id, current_time, temp_in, humid_in, temp_out, humid_out, pressure)
+
+
+# MQTT message - reading is checked and put into ingest queue (writer thread does the rest)
+def handle_message(topic, payload):
+    print("\nMessage: " + str(payload))
+    station_id = station_from_topic(topic, mqtt_topic)
+    if station_id is None:
+        print("Bad station topic: " + topic)
+        return
+    with metrics.timer("parse"):
+        reading = parse_meteo_data(payload, station_id)
+    if reading is not None:
+        ingest_queue.put(reading)
+
+
+# Update web data, log and db for one reading - runs in ingest writer thread.
+# Values for web page are put into pages (station_id -> (station, time, template values, latest values)).
+def update_reading(reading, pages):
+    station_id, current_time, temp_in, humid_in, temp_out, humid_out, pressure = reading
+    print(current_time)
+
+    station = get_station(station_id)
+    # if now() - last_update_time < update_delay - then do nothing
+    if current_time - station.last_update_time < update_delay:
+        # do nothing
+        #print("No need to update")
+        return
 
-        # Meteo data comes to function as a parameters in order:
-        # temp in, humid in, temp_out, humid out, pressure
+    print("Web update (station " + station.name() + ")")
+    # Calculate dew point (in and out)
+    dew_out = get_dew_point(temp_out, humid_out);
+    dew_in  = get_dew_point(temp_in, humid_in);
+
+    # save last update time
+    station.last_update_time = current_time;
+
+    pages[station_id] = (station, current_time, {
+        # out:
+        "TEMP_OUT":    temp_out,
+        "HUMID_OUT":   humid_out,
+        "DEW_OUT":     dew_out,
+        # pressure:
+        "PRESS":       pressure,
+        # in:
+        "TEMP_IN":     temp_in,
+        "HUMID_IN":    humid_in,
+        "DEW_IN":      dew_in,
+        # last update:
+        "LAST_UPDATE": current_time.isoformat(' '),
+    }, {
+        "temp_out": float(temp_out), "humid_out": int(humid_out), "dew_out": dew_point_db(dew_out),
+        "pressure": float(pressure),
+        "temp_in": float(temp_in), "humid_in": int(humid_in), "dew_in": dew_point_db(dew_in),
+    })
+
+    # Save data in log file (we can use to draw a plot)
+    if current_time >= station.last_log_time + log_delay:
+        station.last_log_time = current_time
+        # put data into log file
+        print("Update log")
+        with metrics.timer("log_append"):
+            log_to_file(station, current_time, temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure)
+        with metrics.timer("db_insert"):
+            log_into_db (station, current_time, temp_out, humid_out, dew_out, pressure, temp_in, humid_in, dew_in)
+        if data_feed is not None:
+            with metrics.timer("data_feed"):
+                update_data_feed(station)
+
+    # Drawing a plot - only a request for render worker, so writer thread is not blocked
+    if plot_png and current_time >= station.last_plot_time + plot_delay:
+        station.last_plot_time = current_time
+        request_plots(station)
+
+
+# Update web data, log and db - runs in ingest writer thread for a batch of readings.
+# Web page of a station is written once per batch, with the newest values.
+# Bad reading is skipped - other readings of the batch are written anyway.
+def update_meteo_data(readings):
+
+    pages = {} # station_id -> (station, time, template values, latest values)
+    for reading in readings:
         try:
-		temp_in, humid_in, temp_out, humid_out, pressure = data.split(";")
-		val = float(temp_in)
-		val = int(humid_in)
-		val = float(temp_out)
-		val = int(humid_out)
-		val = float(pressure)
+            update_reading(reading, pages)
         except Exception as e:
-		print("Bad meteo data values: " + str(e))
-		return
-        pressure = float(pressure) / 100.0
-
-	# Get current time
-	current_time = datetime.datetime.now()
-	# Reset microsecond in current time to 0 - we don't want to keep them
-	current_time = current_time.replace(microsecond=0)
-        print(current_time)
-	
-	global last_update_time
-	global last_log_time
-	global last_plot_time
-	# if now() - last_update_time < update_delay - then do nothing
-	if current_time - last_update_time < update_delay:
-		# do nothing
-		#print("No need to update")
-		return
-	
-	print("Web update")
-	# save last update time
-	last_update_time = current_time;
-	
-	# Open html template file (web page) 
-	tmp_file = open(www_meteo_path_tmp, "r")
-	# Remove old file
-	try:
-	        remove(www_meteo_path)
-	except Exception as e:
-		print("Skip removing file: " + str(e))
-	# Open (create) new html file
-	new_file = open(www_meteo_path, "w")
-
-	# Meteo data comes to function as a parameters in order:
-	# temp in, humid in, temp_out, humid out, pressure
-	#temp_in, humid_in, temp_out, humid_out, pressure = data.split(";")
-
-	# Calculate dew point (in and out)
-	dew_out = get_dew_point(temp_out, humid_out);
-	dew_in  = get_dew_point(temp_in, humid_in);
-	
-	# In html file replace old data with new data using regular expressions an templates
-	for line in tmp_file:
-		# out:
-		line = line.decode("utf-8") # Remove this for Python 3.x
-		new_line = re.sub(template_temp_out,      template_temp_out_begin      + str(temp_out)  + template_temp_out_end,      line)
-		new_line = re.sub(template_humid_out,     template_humid_out_begin     + str(humid_out) + template_humid_out_end,     new_line)
-		new_line = re.sub(template_dew_point_out, template_dew_point_out_begin + str(dew_out)   + template_dew_point_out_end, new_line)
-		# pressure:
-		new_line = re.sub(template_pressure,      template_pressure_begin      + str(pressure)  + template_pressure_end,      new_line)
-		# in:
-		new_line = re.sub(template_temp_in,       template_temp_in_begin       + str(temp_in)   + template_temp_in_end,       new_line)
-		new_line = re.sub(template_humid_in,      template_humid_in_begin      + str(humid_in)  + template_humid_in_end,      new_line)
-		new_line = re.sub(template_dew_point_in,  template_dew_point_in_begin  + str(dew_in)    + template_dew_point_in_end,  new_line)
-		# last update:
-		new_line = re.sub(template_last_update,   template_last_update_begin + current_time.isoformat(' ') + template_last_update_end, new_line)
-		# write to file:
-		new_file.write(new_line.encode("utf-8"))
-		#new_file.write(new_line) # use this for Python 3.x
-	
-	# Close opened files
-	tmp_file.close()
-	new_file.close()
-
-	# Save data in log file (we can use to draw a plot)
-	if current_time >= last_log_time + log_delay:
-		last_log_time = current_time
-		# put data into log file
-                print("Update log")
-                log_to_file(temp_in, humid_in, dew_in, temp_out, humid_out, dew_out, pressure)
-                log_into_db (current_time, temp_out, humid_out, dew_out, pressure, temp_in, humid_in, dew_in)
-
-	# Drawing a plot
-	if current_time >= last_plot_time + plot_delay:
-                last_plot_time = current_time
-		start = time.time()
-		print("Draw a plot using db")
-		draw_plot_db()
-		end = time.time()
-		print("Drawing done! (in " + str(int(end - start)) + "s)")
+            print("Error while updating meteo data (station " + str(reading[0]) + "): " + str(e))
+
+    # Fill html template with new data and replace old web page
+    for station, current_time, values, latest in pages.values():
+        try:
+            with metrics.timer("html_render"):
+                html_template.write(station.file(www_meteo_path), values)
+        except Exception as e:
+            print("Error while writing web page: " + str(e))
+        if data_feed is not None:
+            try:
+                data_feed.write_latest(station.station_id, time.mktime(current_time.timetuple()), latest)
+            except Exception as e:
+                print("Error while writing data feed: " + str(e))
+
+    # Commit buffered db rows if they wait too long
+    meteo_db.flush_if_due()
+
+    global last_ingest_stats_time
+    if time.time() - last_ingest_stats_time >= ingest_stats_interval:
+        last_ingest_stats_time = time.time()
+        print("Ingest queue: " + ingest_queue.stats_str())
+
+
+##############################################################################################################
+### Status and profiler
+
+# Sampling profiler - not running until started with HTTP /profile/start or /profile/toggle
+profiler = SamplingProfiler(profiler_interval)
+
+# Daemon status for status file and HTTP endpoint: timings, gauges (numbers for Prometheus) and stations
+def get_status():
+    gauges = {"uptime_seconds": time.time() - start_time, "stations": len(stations)}
+    if ingest_queue is not None:
+        gauges.update({"ingest_queue_depth": ingest_queue.depth(), "ingest_received": ingest_queue.received,
+                       "ingest_dropped": ingest_queue.dropped, "ingest_processed": ingest_queue.processed})
+    if meteo_db is not None:
+        gauges.update({"db_pending_rows": len(meteo_db.pending), "db_rows_written": meteo_db.rows_written,
+                       "db_commits": meteo_db.commits})
+    if render_worker is not None:
+        gauges.update({"render_requests": render_worker.requests, "render_runs": render_worker.runs,
+                       "render_last_run_seconds": render_worker.last_run_time})
+    if data_feed is not None:
+        gauges.update({"data_feed_files_written": data_feed.files_written, "data_feed_bytes_written": data_feed.bytes_written})
+    if chart_pool is not None:
+        gauges.update({"chart_cache_hits": chart_pool.cache_hits, "chart_cache_misses": chart_pool.cache_misses})
+    return {
+        "time": datetime.datetime.now().replace(microsecond=0).isoformat(),
+        "profiler": "running" if profiler.running else "stopped",
+        "gauges": gauges,
+        "metrics": metrics.registry.snapshot(),
+        "stations": dict((station.station_id, {"last_update": station.last_update_time.isoformat(),
+                                               "last_log": station.last_log_time.isoformat()})
+                         for station in list(stations.values())),
+    }
+
+# Set up in main program
+chart_pool = None
+data_feed = None
+meteo_db = None
+ingest_queue = None
+render_worker = None
+metrics_server = None
+status_writer = None
+
+# Starts HTTP endpoint and status file writer
+def start_monitoring():
+    global metrics_server, status_writer
+    if metrics_port is not None:
+        try:
+            metrics_server = MetricsServer(metrics_port, get_status, profiler)
+            metrics_server.start()
+            print("Metrics on http://127.0.0.1:" + str(metrics_port) + "/metrics")
+        except Exception as e:
+            print("Cannot start metrics endpoint: " + str(e))
+            metrics_server = None
+    if status_file_path is not None:
+        status_writer = StatusWriter(status_file_path, get_status, status_interval)
+        status_writer.start()
+
+def stop_monitoring():
+    if metrics_server is not None:
+        metrics_server.stop()
+    if profiler.running:
+        profiler.toggle()
+    if status_writer is not None:
+        status_writer.stop()
+
+
+# The end of shutdown, after waiting for drawing: buffered rows are written to db, then chart pool
+# processes are terminated (drawing not finished in render_stop_timeout can't hang the daemon)
+def close_db_and_charts():
+    meteo_db.close()
+    print("DB closed (" + meteo_db.stats_str() + ")")
+    chart_pool.terminate()
 
 
 ##############################################################################################################
@@ -547,55 +764,93 @@ def update_meteo_data(data):
 # Thomas Varnish (https://github.com/tvarnish), (https://www.instructables.com/member/Tango172)
 # Written for my Instructable - "How to use MQTT with the Raspberry Pi and ESP8266"
 
-change_user()
+# Main program runs only when started as a script - update_meteo_async.py imports functions from here
+if __name__ == "__main__":
 
-# Creating db - creates it only if it doesn't exist
-create_db()
-print "Database OK"
+    change_user()
 
-# MQTT init
-mqtt_username = "meteo"
-mqtt_password = "meteo1234"
-mqtt_topic = "meteo"
-mqtt_broker_ip = "192.168.0.8"
+    # Creating db - creates it only if it doesn't exist
+    create_db()
+    print("Database OK")
+
+    # Processes for drawing charts - started before any other thread
+    chart_pool = create_chart_pool()
+
+    # One connection for the whole daemon life, inserts are committed in groups
+    meteo_db = MeteoDB(db_path, db_commit_rows, db_commit_interval)
 
-client = mqtt.Client()
-# Set the username and password for the MQTT client
-client.username_pw_set(mqtt_username, mqtt_password)
+    # Readings for plots are kept in memory - read from db only once, for every station having data in db
+    # (other stations are set up when their first message comes)
+    for station_id in meteo_db.stations():
+        get_station(station_id)
 
-# Event handlers
-def on_connect(client, self, userdata, rc):
-    # rc is the error code returned when connecting to the broker
-    print "Connected!", str(rc)
+    # On SIGTERM leave loop_forever() normally, so buffered rows are written to db
+    def on_sigterm(signum, frame):
+        print("SIGTERM received, shutting down.")
+        sys.exit(0)
 
-    # Once the client has connected to the broker, subscribe to the topic
-    client.subscribe(mqtt_topic, 0)
+    signal.signal(signal.SIGTERM, on_sigterm)
 
-def on_message(client, userdata, msg):
-    #print "\n----------------\nTopic: ", msg.topic + "\nMessage: " + str(msg.payload)
-    print "\nMessage: " + str(msg.payload)
-    update_meteo_data(msg.payload);
+    # Template is parsed once here (and again only if the file changes)
+    html_template = HtmlTemplate(www_meteo_path_tmp)
 
-# Check last update and log time from log file
-last_update_time = get_last_update_time_from_db()
-#last_update_time = get_last_update_time_from_log()
-last_log_time    = last_update_time
-last_plot_time   = last_update_time
+    # Json files for charts drawn by web browser
+    data_feed = create_data_feed()
 
-client.on_connect = on_connect
-client.on_message = on_message
+    # Plots are drawn in background - requests coming during drawing are merged into one
+    render_worker = RenderWorker(render_plots, "render")
+    render_worker.start()
 
-while True:
+    # Web page, log and db are written by ingest writer thread - MQTT thread only queues readings.
+    # It also commits db rows waiting longer than db_commit_interval when stations are quiet.
+    ingest_queue = IngestQueue(update_meteo_data, ingest_queue_size, ingest_overflow, ingest_batch_size,
+                               tick=meteo_db.flush_if_due, tick_interval=db_flush_period)
+    ingest_queue.start()
+
+    # Timings and status on localhost:metrics_port and in status file
+    start_monitoring()
+
+    # MQTT init
+    client = mqtt.Client()
+    # Set the username and password for the MQTT client
+    client.username_pw_set(mqtt_username, mqtt_password)
+
+    # Event handlers
+    def on_connect(client, self, userdata, rc):
+        # rc is the error code returned when connecting to the broker
+        print("Connected! " + str(rc))
+
+        # Once the client has connected to the broker, subscribe to the topics
+        client.subscribe(mqtt_topics)
+
+    def on_message(client, userdata, msg):
+        #print "\n----------------\nTopic: ", msg.topic + "\nMessage: " + str(msg.payload)
+        handle_message(msg.topic, msg.payload)
+
+    client.on_connect = on_connect
+    client.on_message = on_message
+
+    while True:
+        try:
+            print("Try to connect to MQTT broker.")
+            client.connect(mqtt_broker_ip, mqtt_broker_port)
+        except Exception as e:
+            print("MQTT client connect failed: " + str(e))
+            time.sleep(5);
+            continue;
+        break;
+    print("MQTT client connected")
+
+    # Once we have told the client to connect, let the client object run itself
     try:
-        print("Try to connect to MQTT broker.")
-        client.connect(mqtt_broker_ip, 1883)
-    except Exception as e:
-        print("MQTT client connect failed: " + str(e))
-        time.sleep(5);
-        continue;
-    break;
-print("MQTT client connected")
-
-# Once we have told the client to connect, let the client object run itself
-client.loop_forever()
-client.disconnect()
+        client.loop_forever()
+    finally:
+        client.disconnect()
+        # Write readings waiting in queue
+        ingest_queue.stop(ingest_stop_timeout)
+        print("Ingest queue stopped (" + ingest_queue.stats_str() + ")")
+        # Let current drawing finish (don't leave half-written png files)
+        render_worker.stop(render_stop_timeout)
+        # Write all buffered rows to db, stop chart pool
+        close_db_and_charts()
+        stop_monitoring()
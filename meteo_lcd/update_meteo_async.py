@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Author:
+# Janusz Kozerski (https://github.com/jkozerski)
+
+# asyncio version of update_meteo.py main program (needs Python 3.7+).
+# Functions and settings come from update_meteo.py - only the main loop is different.
+# Work is done by cooperating tasks of one event loop:
+# * mqtt     - paho client driven by the event loop (socket callbacks, no loop_forever()),
+# * connect  - connects to broker, after connection loss reconnects with exponential backoff,
+# * ingest   - readings go to ingest queue, its writer thread writes web page, log and db,
+# * db flush - commits buffered db rows when they wait too long (also when no message comes),
+# * charts   - draws requested plots in executor (chart pool processes do the drawing).
+# SIGTERM (meteo.sh stop) and SIGINT stop all tasks: MQTT is disconnected, queued readings are written,
+# drawing in progress is finished and db buffer is committed before exit.
+#
+# Run:
+#   python3 update_meteo_async.py
+
+import asyncio
+import signal
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+import update_meteo
+from meteo_db import MeteoDB
+from meteo_template import HtmlTemplate
+from ingest_queue import IngestQueue
+
+
+# Reconnect delay [s]: doubled after every failed try, from reconnect_delay_min up to reconnect_delay_max
+reconnect_delay_min = 1
+reconnect_delay_max = 5 * 60
+# Buffered db rows are checked this often [s]
+db_flush_period = 30
+# paho housekeeping (keepalive pings, retries) is done this often [s]
+mqtt_misc_period = 1
+# On shutdown wait this long [s] for DISCONNECT to be sent
+mqtt_disconnect_timeout = 5
+
+
+# Takes place of update_meteo.render_worker: plot requests (from ingest writer thread) wake up charts task
+class ChartTrigger(object):
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+        self.drawing = None # future of drawing in progress
+
+        # Statistics
+        self.requests = 0
+        self.runs = 0
+        self.last_run_time = 0.0
+
+    # Called from other threads
+    def request(self):
+        self.requests += 1
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    def stats_str(self):
+        return "requests: " + str(self.requests) + ", runs: " + str(self.runs) + \
+               ", last run: " + ("%.1f" % self.last_run_time) + "s"
+
+
+# paho client driven by asyncio event loop: socket reads and writes are done when socket is ready
+class MqttClient(object):
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.loop_thread = threading.current_thread()
+        self.connected = asyncio.Event()
+        self.disconnected = asyncio.Event()
+        self.reconnect_delay = reconnect_delay_min
+        self.misc = None
+
+        self.client = mqtt.Client()
+        # Set the username and password for the MQTT client
+        self.client.username_pw_set(update_meteo.mqtt_username, update_meteo.mqtt_password)
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    # Socket callbacks come from event loop thread, or from executor thread during connect.
+    # Event loop can be changed only in its own thread.
+    def in_loop(self, func, *args):
+        if threading.current_thread() is self.loop_thread:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def on_socket_open(self, client, userdata, sock):
+        self.in_loop(self.socket_opened, sock)
+
+    def socket_opened(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        self.misc = self.loop.create_task(self.misc_loop())
+
+    def on_socket_close(self, client, userdata, sock):
+        self.in_loop(self.socket_closed, sock)
+
+    def socket_closed(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self.misc is not None:
+            self.misc.cancel()
+            self.misc = None
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.in_loop(self.loop.add_writer, sock, self.client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.in_loop(self.loop.remove_writer, sock)
+
+    async def misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(mqtt_misc_period)
+
+    def on_connect(self, client, userdata, flags, rc):
+        # rc is the error code returned when connecting to the broker
+        print("Connected! " + str(rc))
+        if rc != 0:
+            return
+        self.reconnect_delay = reconnect_delay_min
+        self.disconnected.clear()
+        self.connected.set()
+        # Once the client has connected to the broker, subscribe to the topics
+        client.subscribe(update_meteo.mqtt_topics)
+
+    def on_disconnect(self, client, userdata, rc):
+        print("MQTT client disconnected: " + str(rc))
+        self.connected.clear()
+        self.disconnected.set()
+
+    def on_message(self, client, userdata, msg):
+        update_meteo.handle_message(msg.topic, msg.payload)
+
+    # Connect task: keeps connection to broker
+    async def run(self):
+        while True:
+            self.disconnected.clear()
+            try:
+                print("Try to connect to MQTT broker.")
+                # TCP connect may take long when broker is down - not in event loop thread
+                await self.loop.run_in_executor(None, self.client.connect,
+                                                update_meteo.mqtt_broker_ip, update_meteo.mqtt_broker_port)
+                await self.disconnected.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("MQTT client connect failed: " + str(e))
+            print("Next MQTT connect in " + str(self.reconnect_delay) + "s")
+            await asyncio.sleep(self.reconnect_delay)
+            self.reconnect_delay = min(self.reconnect_delay * 2, reconnect_delay_max)
+
+    async def disconnect(self):
+        if self.connected.is_set():
+            self.client.disconnect()
+            try:
+                await asyncio.wait_for(self.disconnected.wait(), mqtt_disconnect_timeout)
+            except asyncio.TimeoutError:
+                print("MQTT disconnect timeout")
+        if self.misc is not None:
+            self.misc.cancel()
+
+
+# DB flush task: commits buffered rows when they wait longer than db_commit_interval
+async def db_flush_task(loop):
+    while True:
+        await asyncio.sleep(db_flush_period)
+        await loop.run_in_executor(None, update_meteo.meteo_db.flush_if_due)
+
+
+# Charts task: draws plots requested by ingest writer thread
+async def charts_task(loop, trigger):
+    while True:
+        await trigger.event.wait()
+        trigger.event.clear()
+        start = time.time()
+        # Drawing goes to executor thread (and chart pool processes) - event loop keeps running
+        trigger.drawing = loop.run_in_executor(None, update_meteo.render_plots)
+        try:
+            # Shielded - when this task is cancelled, drawing goes on (main() waits for it)
+            await asyncio.shield(trigger.drawing)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print("Error while drawing plots: " + str(e))
+        trigger.runs += 1
+        trigger.last_run_time = time.time() - start
+
+
+async def main():
+    loop = asyncio.get_running_loop()
+
+    stopping = asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    # Plot requests wake up charts task instead of render worker thread
+    trigger = ChartTrigger(loop)
+    update_meteo.render_worker = trigger
+
+    # Web page, log and db are written by ingest writer thread
+    ingest_queue = IngestQueue(update_meteo.update_meteo_data, update_meteo.ingest_queue_size,
+                               update_meteo.ingest_overflow, update_meteo.ingest_batch_size)
+    update_meteo.ingest_queue = ingest_queue
+    ingest_queue.start()
+
+    # Timings and status on localhost:metrics_port and in status file
+    update_meteo.start_monitoring()
+
+    client = MqttClient(loop)
+    connect = loop.create_task(client.run())
+    flush = loop.create_task(db_flush_task(loop))
+    charts = loop.create_task(charts_task(loop, trigger))
+
+    await stopping.wait()
+    print("SIGTERM received, shutting down.")
+
+    connect.cancel()
+    flush.cancel()
+    await client.disconnect()
+    # Write readings waiting in queue
+    await loop.run_in_executor(None, ingest_queue.stop, update_meteo.ingest_stop_timeout)
+    print("Ingest queue stopped (" + ingest_queue.stats_str() + ")")
+    # No new drawing is started after this; current drawing is let finish (don't leave half-written png files)
+    charts.cancel()
+    if trigger.drawing is not None and not trigger.drawing.done():
+        try:
+            await asyncio.wait_for(asyncio.shield(trigger.drawing), update_meteo.render_stop_timeout)
+        except asyncio.TimeoutError:
+            print("Drawing not finished in " + str(update_meteo.render_stop_timeout) + "s")
+    # Write all buffered rows to db, stop chart pool (executor thread of unfinished drawing ends too)
+    update_meteo.close_db_and_charts()
+    await asyncio.gather(connect, flush, charts, return_exceptions=True)
+
+
+### Main program
+update_meteo.change_user()
+
+# Creating db - creates it only if it doesn't exist
+update_meteo.create_db()
+print("Database OK")
+
+# Processes for drawing charts - started before any other thread
+update_meteo.chart_pool = update_meteo.create_chart_pool()
+
+# One connection for the whole daemon life, inserts are committed in groups
+update_meteo.meteo_db = MeteoDB(update_meteo.db_path, update_meteo.db_commit_rows, update_meteo.db_commit_interval)
+
+# Readings for plots are kept in memory - read from db only once, for every station having data in db
+for station_id in update_meteo.meteo_db.stations():
+    update_meteo.get_station(station_id)
+
+# Template is parsed once here (and again only if the file changes)
+update_meteo.html_template = HtmlTemplate(update_meteo.www_meteo_path_tmp)
+
+# Json files for charts drawn by web browser
+update_meteo.data_feed = update_meteo.create_data_feed()
+
+try:
+    asyncio.run(main())
+finally:
+    update_meteo.stop_monitoring()